@@ -0,0 +1,217 @@
+//===- triage-driver.cpp - Persistent worker for crash triage ---*- C++ -* ===//
+//
+// Part of the LLVM Project, under the Apache License v2.0 with LLVM Exceptions.
+// See https://llvm.org/LICENSE.txt for license information.
+// SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+//===----------------------------------------------------------------------===//
+
+/* This file turns a libFuzzer-style target (LLVMFuzzerTestOneInput) into a
+ long-lived worker for reproducing crashes, so that process startup,
+ target initialization and TargetMachine creation are only paid once.
+
+Usage:
+  isel-triage -mtriple=<triple> [-mcpu=<cpu>] [-mattr=<attrs>] [-global-isel]
+
+The worker reads requests from stdin and writes one response to stdout for
+each of them. All integers use the native byte order.
+
+  request:  u32 timeout in milliseconds (0 means no timeout)
+            u64 input size
+            input bytes
+  response: i32 wait status of the child (as returned by wait4)
+            u8  whether the child was killed for exceeding the timeout
+            i64 max resident set size of the child in KiB
+            f64 user CPU time of the child in seconds
+            f64 system CPU time of the child in seconds
+            f64 wall time of the child in seconds
+            u64 stderr size
+            stderr bytes
+
+Every input runs in a forked child, so a crashing input can't take the worker
+down, and the child's stderr is sent back so it can be classified the same way
+as `llc` output. The worker exits when stdin is closed.
+*/
+#include <errno.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/prctl.h>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#include <string>
+#include <vector>
+
+#include "llvm/Support/InitLLVM.h"
+#include "llvm/Support/raw_ostream.h"
+
+extern "C" {
+int LLVMFuzzerTestOneInput(const uint8_t *Data, size_t Size);
+int LLVMFuzzerInitialize(int *argc, char ***argv);
+}
+
+// Reads exactly `Size` bytes, returns false on EOF or error.
+static bool readAll(int FD, void *Buf, size_t Size) {
+  char *Ptr = static_cast<char *>(Buf);
+  while (Size > 0) {
+    ssize_t N = read(FD, Ptr, Size);
+    if (N < 0 && errno == EINTR)
+      continue;
+    if (N <= 0)
+      return false;
+    Ptr += N;
+    Size -= N;
+  }
+  return true;
+}
+
+// Writes exactly `Size` bytes, returns false on error.
+static bool writeAll(int FD, const void *Buf, size_t Size) {
+  const char *Ptr = static_cast<const char *>(Buf);
+  while (Size > 0) {
+    ssize_t N = write(FD, Ptr, Size);
+    if (N < 0 && errno == EINTR)
+      continue;
+    if (N <= 0)
+      return false;
+    Ptr += N;
+    Size -= N;
+  }
+  return true;
+}
+
+static double toSeconds(const struct timeval &TV) {
+  return TV.tv_sec + TV.tv_usec / 1e6;
+}
+
+static double now() {
+  struct timespec TS;
+  clock_gettime(CLOCK_MONOTONIC, &TS);
+  return TS.tv_sec + TS.tv_nsec / 1e9;
+}
+
+// Runs one input in a forked child and writes the response to `OutFD`.
+static bool runOne(const std::vector<uint8_t> &Input, uint32_t TimeoutMs,
+                   int OutFD) {
+  int StderrPipe[2];
+  if (pipe(StderrPipe) != 0) {
+    perror("pipe");
+    return false;
+  }
+
+  double Start = now();
+  pid_t Parent = getpid();
+  pid_t Pid = fork();
+  if (Pid < 0) {
+    perror("fork");
+    return false;
+  }
+
+  if (Pid == 0) {
+    // Dies with the worker, e.g. when the pool kills it on Ctrl-C.
+    prctl(PR_SET_PDEATHSIG, SIGKILL);
+    if (getppid() != Parent)
+      _exit(1);
+    close(StderrPipe[0]);
+    dup2(StderrPipe[1], STDERR_FILENO);
+    close(StderrPipe[1]);
+    LLVMFuzzerTestOneInput(Input.data(), Input.size());
+    llvm::errs().flush();
+    _exit(0);
+  }
+
+  close(StderrPipe[1]);
+
+  std::string Stderr;
+  bool TimedOut = false;
+  char Buf[64 * 1024];
+  // An absolute deadline, so a child that keeps writing to stderr is killed
+  // too, not only one that stays silent for the whole timeout.
+  double Deadline = Start + TimeoutMs / 1e3;
+  for (;;) {
+    int PollTimeout = -1;
+    if (TimeoutMs > 0) {
+      double Remaining = Deadline - now();
+      if (Remaining <= 0) {
+        TimedOut = true;
+        kill(Pid, SIGKILL);
+        break;
+      }
+      // Rounded up, so poll doesn't spin with a timeout of 0 just before it.
+      PollTimeout = static_cast<int>(Remaining * 1e3) + 1;
+    }
+
+    struct pollfd PFD = {StderrPipe[0], POLLIN, 0};
+    int Ready = poll(&PFD, 1, PollTimeout);
+    if (Ready < 0 && errno == EINTR)
+      continue;
+    if (Ready == 0)
+      continue; // the deadline has passed, checked at the top of the loop
+
+    ssize_t N = read(StderrPipe[0], Buf, sizeof(Buf));
+    if (N < 0 && errno == EINTR)
+      continue;
+    if (N <= 0)
+      break;
+    Stderr.append(Buf, N);
+  }
+  close(StderrPipe[0]);
+
+  int Status = 0;
+  struct rusage Usage;
+  while (wait4(Pid, &Status, 0, &Usage) < 0 && errno == EINTR)
+    ;
+
+  int32_t Status32 = Status;
+  uint8_t TimedOut8 = TimedOut;
+  int64_t MaxRSS = Usage.ru_maxrss;
+  double UserTime = toSeconds(Usage.ru_utime);
+  double SystemTime = toSeconds(Usage.ru_stime);
+  double WallTime = now() - Start;
+  uint64_t StderrSize = Stderr.size();
+
+  return writeAll(OutFD, &Status32, sizeof(Status32)) &&
+         writeAll(OutFD, &TimedOut8, sizeof(TimedOut8)) &&
+         writeAll(OutFD, &MaxRSS, sizeof(MaxRSS)) &&
+         writeAll(OutFD, &UserTime, sizeof(UserTime)) &&
+         writeAll(OutFD, &SystemTime, sizeof(SystemTime)) &&
+         writeAll(OutFD, &WallTime, sizeof(WallTime)) &&
+         writeAll(OutFD, &StderrSize, sizeof(StderrSize)) &&
+         writeAll(OutFD, Stderr.data(), Stderr.size());
+}
+
+int main(int argc, char **argv) {
+  // Prints the pretty stack trace (failed pass, backtrace) like `llc` does.
+  llvm::InitLLVM X(argc, argv);
+
+  if (LLVMFuzzerInitialize(&argc, &argv) != 0)
+    return 1;
+
+  // Responses go through the raw fd, keep stdout clean of anything else.
+  int OutFD = dup(STDOUT_FILENO);
+  dup2(STDERR_FILENO, STDOUT_FILENO);
+
+  std::vector<uint8_t> Input;
+  for (;;) {
+    uint32_t TimeoutMs;
+    uint64_t Size;
+    if (!readAll(STDIN_FILENO, &TimeoutMs, sizeof(TimeoutMs)) ||
+        !readAll(STDIN_FILENO, &Size, sizeof(Size)))
+      break;
+
+    Input.resize(Size);
+    if (!readAll(STDIN_FILENO, Input.data(), Size))
+      break;
+
+    if (!runOne(Input, TimeoutMs, OutFD))
+      return 1;
+  }
+
+  return 0;
+}
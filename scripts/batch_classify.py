@@ -1,15 +1,114 @@
 import argparse
+from collections import defaultdict
+import heapq
 import logging
 import subprocess
+from typing import Iterable, Iterator, NamedTuple, Optional
 
-from classify import classify
+from classify import (
+    MAX_STDERR_SIZE,
+    Classifier,
+    InputGroup,
+    add_limit_arguments,
+    classify,
+    get_limits,
+    group_inputs,
+)
 from pathlib import Path
 
-from lib import LLC, LLVM_DIS
+from lib import ISEL_TRIAGE, LLC, LLVM_DIS, get_llvm_commit
+from lib.crash_db import CRASH_DB_FILE_NAME, CrashDatabase
+from lib.experiment import Experiment
 from lib.fs import subdirs_of
 from lib.llc_command import LLCCommand
-from lib.process_concurrency import run_concurrent_subprocesses
+from lib.process_concurrency import (
+    ProcessResult,
+    ResourceLimits,
+    WorkQueue,
+    run_subprocess_pool,
+)
 from lib.target import Target, TargetFilter
+from lib.triage_cache import TriageCache
+
+
+class Replicate(NamedTuple):
+    input_dir: Path
+    """the directory containing the crashes of a fuzzing replicate"""
+
+    output_dir: Path
+    target: Target
+    global_isel: bool
+    experiment: Experiment
+
+
+class DisassembleJob(NamedTuple):
+    ir_bc_path: Path
+
+
+def get_classifier_args(
+    target: Target, global_isel: bool, persistent_workers: bool
+) -> tuple[list[str], Optional[list[str]]]:
+    """returns the llc command and, if `persistent_workers` is set, the isel-triage command"""
+    llc_command = LLCCommand(target=target, global_isel=global_isel)
+    args = [str(LLC), *llc_command.get_options(output="-")]
+    worker_args = (
+        [str(ISEL_TRIAGE), *llc_command.get_options()] if persistent_workers else None
+    )
+    return args, worker_args
+
+
+def create_disassemble_subprocess(ir_bc_path: Path) -> subprocess.Popen:
+    return subprocess.Popen(
+        args=[LLVM_DIS, ir_bc_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def get_ll_path(ir_bc_path: Path) -> Path:
+    """where `llvm-dis` writes the human-readable IR of `ir_bc_path`"""
+    return ir_bc_path.with_suffix(".ll")
+
+
+def is_disassembled(ir_bc_path: Path) -> bool:
+    """whether the `.ll` file of `ir_bc_path` exists and is not older than the input it links to"""
+    ll_path = get_ll_path(ir_bc_path)
+    return ll_path.exists() and ll_path.stat().st_mtime >= ir_bc_path.stat().st_mtime
+
+
+def disassemble(ir_bc_path: Path) -> Path:
+    """
+    Returns the `.ll` file of an input in a bucket folder, running `llvm-dis` on it unless it is cached.
+    Meant for inputs that were not picked as representatives.
+    """
+    if not is_disassembled(ir_bc_path):
+        subprocess.run(
+            [LLVM_DIS, ir_bc_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+    return get_ll_path(ir_bc_path)
+
+
+def get_inputs_to_disassemble(
+    output_dir: Path, n_representatives: Optional[int] = None
+) -> Iterator[Path]:
+    """
+    The `n_representatives` smallest inputs of every bucket folder in `output_dir` (all of them if not set),
+    except those that are already disassembled.
+    """
+    buckets: defaultdict[Path, list[Path]] = defaultdict(list)
+    for ir_bc_path in output_dir.rglob("*.bc"):
+        buckets[ir_bc_path.parent].append(ir_bc_path)
+
+    for ir_bc_paths in buckets.values():
+        if n_representatives is not None:
+            ir_bc_paths = heapq.nsmallest(
+                n_representatives, ir_bc_paths, key=lambda path: path.stat().st_size
+            )
+
+        yield from (path for path in ir_bc_paths if not is_disassembled(path))
 
 
 def classify_wrapper(
@@ -18,9 +117,15 @@ def classify_wrapper(
     target: Target,
     global_isel: bool = False,
     generate_ll_files: bool = True,
+    persistent_workers: bool = False,
+    cache_path: Optional[Path] = None,
+    crash_db_path: Optional[Path] = None,
+    experiment: Optional[Experiment] = None,
+    export_tree: bool = True,
+    limits: ResourceLimits = ResourceLimits(),
+    n_representatives: Optional[int] = None,
 ) -> None:
-    llc_command = LLCCommand(target=target, global_isel=global_isel)
-    args = [str(LLC), *llc_command.get_options(output="-")]
+    args, worker_args = get_classifier_args(target, global_isel, persistent_workers)
 
     print(f"Start classifying {input_dir} using '{(' '.join(args))}'...")
 
@@ -35,32 +140,37 @@ def classify_wrapper(
         hash_op_code_only_for_isel_crash=True,
         remove_addr_in_stacktrace=True,
         ignore_undefined_external_symbol=True,
+        worker_args=worker_args,
+        cache_path=cache_path,
+        crash_db_path=crash_db_path,
+        experiment=experiment,
+        export_tree=export_tree,
+        limits=limits,
     )
 
     print(f"Done classifying {input_dir} using '{(' '.join(args))}'.")
 
-    if generate_ll_files:
+    if export_tree and generate_ll_files:
         print(f"Generating human-readable IR files for {output_dir}...")
 
-        run_concurrent_subprocesses(
-            Path(output_dir).rglob("*.bc"),
-            lambda ir_bc_path: subprocess.Popen(
-                args=[LLVM_DIS, ir_bc_path],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            ),
+        run_subprocess_pool(
+            list(get_inputs_to_disassemble(Path(output_dir), n_representatives)),
+            create_disassemble_subprocess,
         )
 
         print(f"Done generating human-readable IR files for {output_dir}.")
 
 
-def batch_classify(
+def get_replicates(
     input_root_dir: Path,
     output_root_dir: Path,
     global_isel: bool = False,
-    generate_ll_files: bool = True,
     target_filter: TargetFilter = lambda _: True,
-) -> None:
+) -> Iterator[Replicate]:
+    """
+    all replicates under `input_root_dir`, which contains one directory per target.
+    `output_root_dir` is expected to be `<output>/<fuzzer>/<isel>`, like `get_all_experiments` does.
+    """
     for target_dir in subdirs_of(input_root_dir):
         target = Target.parse(target_dir.name)
 
@@ -68,20 +178,208 @@ def batch_classify(
             continue
 
         for replicate_dir in subdirs_of(target_dir.path):
-            try:
-                classify_wrapper(
-                    input_dir=Path(replicate_dir.path, "default", "crashes"),
-                    output_dir=output_root_dir.joinpath(
-                        target_dir.name, replicate_dir.name
-                    ),
+            output_dir = output_root_dir.joinpath(target_dir.name, replicate_dir.name)
+
+            yield Replicate(
+                input_dir=Path(replicate_dir.path, "default", "crashes"),
+                output_dir=output_dir,
+                target=target,
+                global_isel=global_isel,
+                experiment=Experiment(
+                    path=output_dir,
+                    fuzzer=output_root_dir.parent.name.split(".")[0],
+                    isel=output_root_dir.name,
                     target=target,
-                    global_isel=global_isel,
-                    generate_ll_files=generate_ll_files,
+                    replicate_id=int(replicate_dir.name),
+                ),
+            )
+
+
+def classify_replicates(
+    replicates: Iterable[Replicate],
+    generate_ll_files: bool = True,
+    cache_path: Optional[Path] = None,
+    usage_log: Optional[Path] = None,
+    spill_stderr: bool = False,
+    crash_db_path: Optional[Path] = None,
+    export_tree: bool = True,
+    limits: ResourceLimits = ResourceLimits(),
+    n_representatives: Optional[int] = None,
+) -> None:
+    """
+    Classify the crashes of all `replicates` on one shared pool,
+    so small replicates don't leave cores idle while waiting for each other.
+    Results go to the crash database at `crash_db_path` (in memory if not set).
+    With `export_tree`, each replicate also gets the folder tree in its own output directory,
+    and `llvm-dis` jobs for it are scheduled as soon as all of its crashes are classified,
+    for the `n_representatives` smallest inputs of every bucket (all inputs if not set).
+    Inputs of the same content are only run once for all replicates of a target.
+    Every input runs under `limits`, `llvm-dis` jobs don't.
+    """
+    cache = (
+        None
+        if cache_path is None
+        else TriageCache(cache_path, llvm_commit=get_llvm_commit())
+    )
+    crash_db = CrashDatabase(
+        Path(":memory:") if crash_db_path is None else crash_db_path
+    )
+    queue: WorkQueue[InputGroup | DisassembleJob] = WorkQueue()
+    n_remaining_jobs: dict[Classifier, int] = {}
+
+    def finish(classifier: Classifier) -> None:
+        print(f"Done classifying {classifier.input_dir}.")
+        classifier.finish()
+
+        if not export_tree:
+            return
+
+        crash_db.export_tree(classifier.output_dir)
+
+        if generate_ll_files:
+            # front of the queue, so the outputs of this replicate are complete as soon as possible
+            for ir_bc_path in get_inputs_to_disassemble(
+                Path(classifier.output_dir), n_representatives
+            ):
+                queue.push_front(DisassembleJob(ir_bc_path))
+
+    def create_subprocess(job: InputGroup | DisassembleJob) -> subprocess.Popen:
+        match job:
+            case InputGroup():
+                return job.create_subprocess()
+            case DisassembleJob(ir_bc_path):
+                return create_disassemble_subprocess(ir_bc_path)
+
+    def on_exit(job: InputGroup | DisassembleJob, result: ProcessResult) -> None:
+        if not isinstance(job, InputGroup):
+            return
+
+        try:
+            job.on_process_exit(result)
+        except Exception:
+            logging.exception(f"Something went wrong when processing {job}")
+
+        for classifier, _ in job.members:
+            n_remaining_jobs[classifier] -= 1
+            if n_remaining_jobs[classifier] == 0:
+                finish(classifier)
+
+    inputs: list[tuple[Classifier, str]] = []
+
+    try:
+        for replicate in replicates:
+            args, _ = get_classifier_args(
+                replicate.target, replicate.global_isel, persistent_workers=False
+            )
+
+            try:
+                classifier = Classifier(
+                    args,
+                    replicate.input_dir,
+                    replicate.output_dir,
+                    force=True,
+                    crash_db=crash_db,
+                    experiment=replicate.experiment,
+                    verbose=False,
+                    hash_stacktrace_only=True,
+                    hash_op_code_only_for_isel_crash=True,
+                    remove_addr_in_stacktrace=True,
+                    ignore_undefined_external_symbol=True,
+                    cache=cache,
+                    limits=limits,
                 )
+                file_names = list(classifier.get_inputs())
             except Exception:
                 logging.exception(
-                    f"Something went wrong when processing {target_dir.path}"
+                    f"Something went wrong when processing {replicate.input_dir}"
                 )
+                continue
+
+            n_remaining_jobs[classifier] = len(file_names)
+            inputs.extend((classifier, file_name) for file_name in file_names)
+
+            if len(file_names) == 0:
+                finish(classifier)
+
+        queue.extend(group_inputs(inputs))
+
+        run_subprocess_pool(
+            inputs=queue,
+            subprocess_creator=create_subprocess,
+            on_exit=on_exit,
+            timeout=lambda job: (
+                limits.wall_time if isinstance(job, InputGroup) else None
+            ),
+            usage_log=usage_log,
+            max_pipe_buffer_size=MAX_STDERR_SIZE,
+            spill_pipes=spill_stderr,
+            collect_results=False,
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+        crash_db.close()
+
+
+def batch_classify(
+    input_root_dir: Path,
+    output_root_dir: Path,
+    global_isel: bool = False,
+    generate_ll_files: bool = True,
+    target_filter: TargetFilter = lambda _: True,
+    persistent_workers: bool = False,
+    cache_path: Optional[Path] = None,
+    crash_db_path: Optional[Path] = None,
+    export_tree: bool = True,
+    limits: ResourceLimits = ResourceLimits(),
+    n_representatives: Optional[int] = None,
+) -> None:
+    """
+    `cache_path`: if set, classify incrementally: reuse the results cached in this file
+    and update existing outputs instead of starting over.
+    `crash_db_path`: the crash database to record results in.
+    `export_tree`: whether to also write the folder tree of every replicate to `output_root_dir`.
+    `limits`: the resource limits of every input, see `classify`.
+    `n_representatives`: if set, only this many smallest inputs of every bucket are disassembled,
+    the others can be disassembled on demand with `disassemble`.
+    """
+    replicates = get_replicates(
+        input_root_dir, output_root_dir, global_isel, target_filter
+    )
+
+    if not persistent_workers:
+        classify_replicates(
+            replicates,
+            generate_ll_files,
+            cache_path,
+            crash_db_path=crash_db_path,
+            export_tree=export_tree,
+            limits=limits,
+            n_representatives=n_representatives,
+        )
+        return
+
+    # a persistent worker is started for one llc command line, so it can't be shared across targets
+    for replicate in replicates:
+        try:
+            classify_wrapper(
+                input_dir=replicate.input_dir,
+                output_dir=replicate.output_dir,
+                target=replicate.target,
+                global_isel=replicate.global_isel,
+                generate_ll_files=generate_ll_files,
+                persistent_workers=persistent_workers,
+                cache_path=cache_path,
+                crash_db_path=crash_db_path,
+                experiment=replicate.experiment,
+                export_tree=export_tree,
+                limits=limits,
+                n_representatives=n_representatives,
+            )
+        except Exception:
+            logging.exception(
+                f"Something went wrong when processing {replicate.input_dir}"
+            )
 
 
 def main() -> None:
@@ -105,15 +403,88 @@ def main() -> None:
         help="The output directory",
     )
 
+    parser.add_argument(
+        "--persistent-workers",
+        action="store_true",
+        help="Reproduce crashes on persistent isel-triage workers instead of starting llc for every input",
+    )
+
+    parser.add_argument(
+        "--spill-stderr",
+        action="store_true",
+        help=f"Keep the whole stderr of every crash, spilling what exceeds {MAX_STDERR_SIZE} bytes to /dev/shm, "
+        "instead of only its start and end",
+    )
+
+    parser.add_argument(
+        "--export-tree",
+        action="store_true",
+        help=f"Besides recording crashes in <output>/{CRASH_DB_FILE_NAME}, write a folder per crash bucket "
+        "with symlinks to its inputs and human-readable IR files for every replicate",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only run crashes that are not in the triage cache (<output>/triage_cache.sqlite3) yet, "
+        "and merge them into the existing output",
+    )
+
+    parser.add_argument(
+        "--ll-representatives",
+        type=int,
+        default=1,
+        help="The number of inputs, smallest first, to generate human-readable IR files for in every bucket "
+        "with --export-tree, 0 for all of them",
+    )
+
+    add_limit_arguments(parser)
+
     args = parser.parse_args()
 
-    for fuzzer_dir in subdirs_of(args.input):
-        for isel_dir in subdirs_of(fuzzer_dir.path):
-            batch_classify(
+    cache_path = (
+        Path(args.output, "triage_cache.sqlite3") if args.incremental else None
+    )
+    crash_db_path = Path(args.output, CRASH_DB_FILE_NAME)
+    n_representatives = args.ll_representatives or None
+
+    if args.persistent_workers:
+        for fuzzer_dir in subdirs_of(args.input):
+            for isel_dir in subdirs_of(fuzzer_dir.path):
+                batch_classify(
+                    input_root_dir=Path(isel_dir.path),
+                    output_root_dir=Path(args.output, fuzzer_dir.name, isel_dir.name),
+                    global_isel=isel_dir.name == "gisel",
+                    persistent_workers=True,
+                    cache_path=cache_path,
+                    crash_db_path=crash_db_path,
+                    export_tree=args.export_tree,
+                    limits=get_limits(args),
+                    n_representatives=n_representatives,
+                )
+        return
+
+    # schedule the whole fuzzer/isel/target/replicate tree on one pool
+    Path(args.output).mkdir(parents=True, exist_ok=True)
+    classify_replicates(
+        (
+            replicate
+            for fuzzer_dir in subdirs_of(args.input)
+            for isel_dir in subdirs_of(fuzzer_dir.path)
+            for replicate in get_replicates(
                 input_root_dir=Path(isel_dir.path),
                 output_root_dir=Path(args.output, fuzzer_dir.name, isel_dir.name),
                 global_isel=isel_dir.name == "gisel",
             )
+        ),
+        cache_path=cache_path,
+        usage_log=Path(args.output, "resource_usage.jsonl"),
+        spill_stderr=args.spill_stderr,
+        crash_db_path=crash_db_path,
+        export_tree=args.export_tree,
+        limits=get_limits(args),
+        n_representatives=n_representatives,
+    )
 
 
 if __name__ == "__main__":
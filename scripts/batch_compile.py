@@ -3,7 +3,7 @@ import os
 import subprocess
 from typing import Iterable, Optional
 
-from lib.process_concurrency import MAX_SUBPROCESSES, run_concurrent_subprocesses
+from lib.process_concurrency import MAX_SUBPROCESSES, run_subprocess_pool
 
 
 def build_clang_flags(
@@ -34,8 +34,8 @@ def batch_compile(
 
     os.makedirs(out_dir, exist_ok=True)
 
-    run_concurrent_subprocesses(
-        iter=[
+    run_subprocess_pool(
+        inputs=[
             file_name for file_name in os.listdir(src_dir) if file_name.endswith(".c")
         ],
         subprocess_creator=lambda file_name: subprocess.Popen(
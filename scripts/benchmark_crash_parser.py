@@ -0,0 +1,132 @@
+import argparse
+import json
+from pathlib import Path
+import time
+import tracemalloc
+from typing import Any, NamedTuple
+
+from classify import CrashError
+
+SAMPLES_DIR = Path(__file__).parent.joinpath("crash_parser_samples")
+
+# the fingerprint options used by `classify.py` and `batch_classify.py`
+OPTIONS: dict[str, dict[str, bool]] = {
+    "default": {},
+    "stack_trace_only": {
+        "hash_stacktrace_only": True,
+        "remove_addr_in_stacktrace": True,
+    },
+    "batch_classify": {
+        "hash_stacktrace_only": True,
+        "hash_op_code_only_for_isel_crash": True,
+        "remove_addr_in_stacktrace": True,
+    },
+}
+
+
+class BenchmarkResult(NamedTuple):
+    n_lines: int
+    lines_per_sec: float
+    peak_memory_kb: float
+
+
+def parse(stderr_path: Path, args: list[str], options: dict[str, bool]) -> CrashError:
+    with open(stderr_path, errors="replace") as stderr_file:
+        return CrashError(args, 1, stderr_file, **options)
+
+
+def benchmark(
+    stderr_path: Path, args: list[str], options: dict[str, bool], iterations: int
+) -> BenchmarkResult:
+    with open(stderr_path, errors="replace") as stderr_file:
+        n_lines = sum(1 for _ in stderr_file)
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        parse(stderr_path, args, options)
+    elapsed_time = time.perf_counter() - start_time
+
+    # measured separately, tracing slows parsing down
+    tracemalloc.start()
+    parse(stderr_path, args, options)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return BenchmarkResult(
+        n_lines=n_lines,
+        lines_per_sec=n_lines * iterations / elapsed_time,
+        peak_memory_kb=peak_memory / 1024,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the crash parser of classify.py on recorded llc stderr samples"
+    )
+
+    parser.add_argument(
+        "-s",
+        "--samples",
+        type=Path,
+        default=SAMPLES_DIR,
+        help="The directory containing <name>.stderr samples and samples.json "
+        "with their llc arguments and expected fingerprints",
+    )
+
+    parser.add_argument(
+        "-n",
+        "--iterations",
+        type=int,
+        default=20,
+        help="The number of times each sample is parsed",
+    )
+
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Record the current fingerprints as expected instead of checking them",
+    )
+
+    args = parser.parse_args()
+
+    samples_json_path = Path(args.samples, "samples.json")
+    with open(samples_json_path) as file:
+        samples: dict[str, dict[str, Any]] = json.load(file)
+
+    n_mismatches = 0
+
+    print(f"{'sample':<24}{'options':<20}{'lines':>8}{'lines/s':>12}{'peak KiB':>10}")
+
+    for name, sample in samples.items():
+        stderr_path = Path(args.samples, f"{name}.stderr")
+        expected_fingerprints: dict[str, str] = sample.setdefault("fingerprints", {})
+
+        for options_name, options in OPTIONS.items():
+            fingerprint = parse(stderr_path, sample["args"], options).fingerprint
+
+            if args.record:
+                expected_fingerprints[options_name] = fingerprint
+            elif expected_fingerprints.get(options_name) != fingerprint:
+                n_mismatches += 1
+                print(
+                    f"ERROR: fingerprint of {name} with {options_name} options changed: "
+                    f"{expected_fingerprints.get(options_name)} -> {fingerprint}"
+                )
+
+            result = benchmark(stderr_path, sample["args"], options, args.iterations)
+
+            print(
+                f"{name:<24}{options_name:<20}{result.n_lines:>8}"
+                f"{result.lines_per_sec:>12.0f}{result.peak_memory_kb:>10.1f}"
+            )
+
+    if args.record:
+        with open(samples_json_path, "w") as file:
+            json.dump(samples, file, indent=4)
+            file.write("\n")
+    elif n_mismatches > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
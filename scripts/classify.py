@@ -1,13 +1,96 @@
 import argparse
+import csv
+from functools import cached_property
+import hashlib
+import io
 import subprocess
 import os
 import re
-from typing import Iterable, Iterator, List, Optional, Set, Tuple
+import signal
+from typing import Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 import shutil
 from pathlib import Path
-import tempfile
 
-from lib.process_concurrency import run_concurrent_subprocesses
+from lib import LLC, get_llvm_commit
+from lib.crash_db import IGNORED_BUCKET, OOM_BUCKET, TIMEOUT_BUCKET, CrashDatabase
+from lib.experiment import Experiment
+from lib.fs import get_content_hash
+from lib.llc_command import LLCCommand
+from lib.process_concurrency import (
+    ProcessResult,
+    ResourceLimits,
+    ResourceUsage,
+    run_subprocess_pool,
+)
+from lib.triage_cache import CachedResult, TriageCache
+from lib.triage_worker import WorkerResult, run_triage_workers
+
+FINGERPRINT_DIGEST_SIZE = 8
+
+BUG_REPORT_LINE = "PLEASE submit a bug report to https://github.com/llvm/llvm-project/issues/ and include the crash backtrace.\n"
+
+MAX_DAG_DUMP_LINES = 64
+"""
+Number of `tN: ...` DAG node lines (printed by LLVM builds with assertions) kept in the message of a crash.
+Only applies when the message does not affect the fingerprint, so buckets are the same with or without it.
+"""
+
+# patterns used on every line of stderr, compiled once
+_DAG_NODE_LINE = re.compile(r"^ +0x[0-9a-f]+: .+ = .+\n$")
+_DAG_NODE_ID_LINE = re.compile(r" +t[0-9]+: ")
+_UNDEFINED_EXTERNAL_SYMBOL = re.compile(r'LLVM ERROR: Undefined external symbol ".+"\n')
+_RUNNING_PASS = re.compile(r" *[0-9]+\.\tRunning pass \'([A-Za-z0-9 ]+)\'")
+_VALUE_NUMBER = re.compile(r"%[0-9]+")
+_HEX_NUMBER = re.compile(r"0x[0-9a-f]+")
+_FUNCTION_ARGUMENT_NUMBER = re.compile(
+    r"(unable to allocate function argument #)[0-9]+"
+)
+_SPILL_FAILURE = re.compile(
+    r"(Error while trying to spill )(.+)( from class )(.+)(: Cannot scavenge register without an emergency spill slot!)"
+)
+_GENERIC_OPCODE = re.compile(r"G_[A-Z_]+")
+_DAG_ISEL_FAILURE = re.compile(
+    r"LLVM ERROR: Cannot select:.+ = ([a-zA-Z0-9_:]+(<.+>)?)"
+)
+
+INPUT_PATH_PLACEHOLDER = "@@"
+"""stands for the input path in cached stderr, so it can be replayed for files of the same content"""
+
+MAX_STDERR_SIZE = 4 * 1024 * 1024
+"""
+Bytes of stderr kept per input, the first and last half of it.
+The error message is at the start and the stack dump at the end, only the middle of huge DAG dumps is lost.
+"""
+
+_OUT_OF_MEMORY_MESSAGES = ("LLVM ERROR: out of memory", "std::bad_alloc")
+
+RESULT_MATRIX_FILE_NAME = "results.csv"
+"""written by `classify_llc_commands`, with a row per input and a column per command"""
+
+
+def get_fingerprint(parts: Iterable[str]) -> str:
+    """
+    Stable hex digest of `parts`.
+    Unlike `hash()` on strings, it does not change between interpreter runs.
+    """
+    digest = hashlib.blake2b(digest_size=FINGERPRINT_DIGEST_SIZE)
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def scan_inputs(input_dir: str | Path) -> Iterator[str]:
+    """
+    Yields the name of every input file in `input_dir`, while reading the directory,
+    so huge directories are not listed in memory first.
+    """
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.split(".")[-1] in ["md", "txt", "s"] or not entry.is_file():
+                continue
+
+            yield entry.name
 
 
 class StackTrace:
@@ -23,7 +106,7 @@ class StackTrace:
             function = " ".join(words[2:-1])
             location = words[-1]
             if remove_addr:
-                location = re.sub(r"0x[0-9a-f]+", "0x_", location)
+                location = _HEX_NUMBER.sub("0x_", location)
             stack_frames.append((function, location))
 
         self.stack_frames = tuple(stack_frames)
@@ -40,8 +123,12 @@ class StackTrace:
     def __eq__(self, other) -> bool:
         return self.stack_frames == other.stack_frames
 
+    @cached_property
+    def fingerprint(self) -> str:
+        return get_fingerprint(f"{f} {l}" for (f, l) in self.stack_frames)
+
     def __hash__(self) -> int:
-        return hash(self.stack_frames)
+        return int(self.fingerprint, 16)
 
 
 class CrashError:
@@ -70,40 +157,60 @@ class CrashError:
         self.hash_op_code_only_for_isel_crash = hash_op_code_only_for_isel_crash
         self.undefined_external_symbol = False
 
-        # extract and minimize error message
-        message_lines = []
-        while (
-            (curr_line := next(stderr_iter, None))
-            and curr_line
-            != "PLEASE submit a bug report to https://github.com/llvm/llvm-project/issues/ and include the crash backtrace.\n"
-        ):
-            # do not include the entire DAG in the error message
-            if curr_line == "\n" or re.match(r"^ +0x[0-9a-f]+: .+ = .+\n$", curr_line):
+        # Single pass over stderr: the message up to the bug report line, then the stack dump.
+        # DAG node lines are dropped from the message, they can make up megabytes of stderr.
+        message_lines: List[str] = []
+        n_dag_id_lines = 0
+        n_omitted_dag_id_lines = 0
+        cap_dag_dump = False
+
+        for curr_line in stderr_iter:
+            if curr_line == BUG_REPORT_LINE:
+                break
+
+            if curr_line == "\n":
                 continue
 
-            if re.match(r'LLVM ERROR: Undefined external symbol ".+"\n', curr_line):
+            if curr_line.startswith(" "):
+                if _DAG_NODE_LINE.match(curr_line):
+                    continue
+
+                if cap_dag_dump and _DAG_NODE_ID_LINE.match(curr_line):
+                    n_dag_id_lines += 1
+                    if n_dag_id_lines > MAX_DAG_DUMP_LINES:
+                        n_omitted_dag_id_lines += 1
+                        continue
+            elif curr_line.startswith(
+                "LLVM ERROR: Undefined"
+            ) and _UNDEFINED_EXTERNAL_SYMBOL.match(curr_line):
                 self.undefined_external_symbol = True
 
+            if len(message_lines) == 0:
+                # only cap the dump if the message is not part of the fingerprint
+                cap_dag_dump = hash_stacktrace_only or (
+                    hash_op_code_only_for_isel_crash
+                    and curr_line.startswith("LLVM ERROR: Cannot select:")
+                )
+
             message_lines.append(curr_line)
 
+        if n_omitted_dag_id_lines > 0:
+            message_lines.append(f"  ... {n_omitted_dag_id_lines} more DAG nodes\n")
+
         self.message_raw = "".join(message_lines)
 
         self.message_minimized = (
-            re.sub(r"%[0-9]+", "%_", self.message_raw)
+            _VALUE_NUMBER.sub("%_", self.message_raw)
             .replace(args[0], os.path.basename(args[0]))
             .replace(args[-1], "ir.bc")
         )
 
-        self.message_minimized = re.sub(r"0x[0-9a-f]+", "0x_", self.message_minimized)
-        self.message_minimized = re.sub(
-            r"(unable to allocate function argument #)[0-9]+",
-            r"\1_",
-            self.message_minimized,
+        self.message_minimized = _HEX_NUMBER.sub("0x_", self.message_minimized)
+        self.message_minimized = _FUNCTION_ARGUMENT_NUMBER.sub(
+            r"\1_", self.message_minimized
         )
-        self.message_minimized = re.sub(
-            r"(Error while trying to spill )(.+)( from class )(.+)(: Cannot scavenge register without an emergency spill slot!)",
-            r"\1_\3\4\5",
-            self.message_minimized,
+        self.message_minimized = _SPILL_FAILURE.sub(
+            r"\1_\3\4\5", self.message_minimized
         )
 
         # extract failed pass and stack trace
@@ -114,10 +221,9 @@ class CrashError:
                 curr_line := next(stderr_iter, None)
             ) and "llvm::sys::PrintStackTrace" not in curr_line:
                 if (
-                    match := re.match(
-                        r" *[0-9]+\.\tRunning pass \'([A-Za-z0-9 ]+)\'", curr_line
-                    )
-                ) is not None:
+                    "Running pass" in curr_line
+                    and (match := _RUNNING_PASS.match(curr_line)) is not None
+                ):
                     self.failed_pass = match.group(1)
 
             # extract stack trace
@@ -132,20 +238,17 @@ class CrashError:
         # determine error type
         if self.message_raw.startswith("LLVM ERROR: unable to legalize instruction:"):
             self.type = "instruction-legalization"
-            matches = re.findall(r"G_[A-Z_]+", message_lines[0])
+            matches = _GENERIC_OPCODE.findall(message_lines[0])
             assert len(matches) == 1
             self.subtype = matches[0]
         elif self.message_raw.startswith("LLVM ERROR: cannot select:"):
             self.type = "global-instruction-selection"
-            matches = re.findall(r"G_[A-Z_]+", message_lines[0])
+            matches = _GENERIC_OPCODE.findall(message_lines[0])
             assert len(matches) == 1
             self.subtype = matches[0]
         elif self.message_raw.startswith("LLVM ERROR: Cannot select:"):
             self.type = "dag-instruction-selection"
-            match = re.match(
-                r"LLVM ERROR: Cannot select:.+ = ([a-zA-Z0-9_:]+(<.+>)?)",
-                message_lines[0],
-            )
+            match = _DAG_ISEL_FAILURE.match(message_lines[0])
             if match is None:
                 print(f'ERROR: failed to extract instruction from "{message_lines[0]}"')
                 self.subtype = "Unknown"
@@ -175,20 +278,416 @@ class CrashError:
         return os.path.join(
             self.type,
             self.subtype if self.subtype is not None else "",
-            f"tracedepth_{len(self.stack_trace)}__hash_0x{hash(self):08x}",
+            f"tracedepth_{len(self.stack_trace)}__hash_0x{self.fingerprint}",
         )
 
-    def __hash__(self):
+    @cached_property
+    def fingerprint(self) -> str:
+        """
+        Identifies the bucket of this crash, stable across runs and machines.
+        """
         if self.hash_op_code_only_for_isel_crash and (
             self.type == "dag-instruction-selection"
             or self.type == "global-instruction-selection"
         ):
-            return hash(self.subtype)
+            return get_fingerprint([self.subtype or ""])
 
         if self.hash_stacktrace_only:
-            return hash(self.stack_trace)
+            return self.stack_trace.fingerprint
+
+        return get_fingerprint([self.stack_trace.fingerprint, self.message_minimized])
+
+    def __hash__(self):
+        return int(self.fingerprint, 16)
+
+
+class Classifier:
+    """
+    Classifies the crashes in one input directory into `crash_db`, as the experiment `output_dir`.
+    Inputs can be run on any pool, as long as every result is handed to `on_process_exit`
+    or `on_worker_exit` and `finish` is called once all inputs are done.
+    """
+
+    cmd: List[str]
+    input_dir: str
+    output_dir: str
+    verbose: bool
+    hash_stacktrace_only: bool
+    hash_op_code_only_for_isel_crash: bool
+    remove_addr_in_stacktrace: bool
+    ignore_undefined_external_symbol: bool
+    worker_args: Optional[List[str]]
+    cache: Optional[TriageCache]
+    crash_db: CrashDatabase
+    limits: ResourceLimits
+    experiment_id: int
+
+    crash_hashes: Set[str]
+
+    def __init__(
+        self,
+        cmd: List[str],
+        input_dir: str | Path,
+        output_dir: str | Path,
+        force: bool,
+        crash_db: CrashDatabase,
+        experiment: Optional[Experiment] = None,
+        verbose: bool = False,
+        hash_stacktrace_only: bool = False,
+        hash_op_code_only_for_isel_crash: bool = False,
+        remove_addr_in_stacktrace: bool = False,
+        ignore_undefined_external_symbol: bool = False,
+        worker_args: Optional[List[str]] = None,
+        cache: Optional[TriageCache] = None,
+        limits: ResourceLimits = ResourceLimits(),
+        resume: bool = False,
+    ) -> None:
+        """
+        `resume`: continue an interrupted classification of the same `output_dir`,
+        keeping its recorded results and skipping the inputs they cover.
+        """
+        self.cmd = cmd
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.verbose = verbose
+        self.hash_stacktrace_only = hash_stacktrace_only
+        self.hash_op_code_only_for_isel_crash = hash_op_code_only_for_isel_crash
+        self.remove_addr_in_stacktrace = remove_addr_in_stacktrace
+        self.ignore_undefined_external_symbol = ignore_undefined_external_symbol
+        self.worker_args = worker_args
+        self.cache = cache
+        self.crash_db = crash_db
+        self.limits = limits
+        self.resume = resume
+
+        self.crash_hashes = set()
+        self.__content_hashes: dict[str, str] = {}
+
+        if os.path.exists(self.output_dir) and cache is None and not resume:
+            if force:
+                shutil.rmtree(self.output_dir)
+            else:
+                print(f"{self.output_dir} already exists, use -f to remove it. Abort.")
+                exit(1)
+
+        self.experiment_id = crash_db.add_experiment(self.output_dir, experiment)
+
+        if cache is None and not resume:
+            crash_db.clear_experiment(self.experiment_id)
+
+    @property
+    def args(self) -> List[str]:
+        """the command the inputs are run with, without the input path"""
+        return self.cmd if self.worker_args is None else self.worker_args
+
+    @property
+    def usage_log(self) -> Path:
+        return Path(self.output_dir, "resource_usage.jsonl")
+
+    def get_input_path(self, file_name: str) -> str:
+        return os.path.join(self.input_dir, file_name)
+
+    def get_content_hash(self, file_name: str) -> str:
+        """content hash of an input yielded by `get_inputs`, until its result is recorded"""
+        return self.__content_hashes[file_name]
+
+    def get_inputs(
+        self,
+        file_names: Optional[Iterable[str]] = None,
+        content_hashes: Optional[dict[str, str]] = None,
+    ) -> Iterator[str]:
+        """
+        Yields the name of every input that has to be run.
+        Inputs with a cached result are replayed right away instead.
+        `file_names` are the inputs in `input_dir`, if it was scanned already.
+        When resuming, inputs with a recorded result are skipped before their content is read.
+        `content_hashes` is shared by classifiers of the same inputs, so each is only hashed once.
+        """
+        if file_names is None:
+            file_names = scan_inputs(self.input_dir)
+
+        for file_name in file_names:
+            if self.resume and self.crash_db.has_input(
+                self.experiment_id, self.get_input_path(file_name)
+            ):
+                continue
+
+            content_hash = (
+                None if content_hashes is None else content_hashes.get(file_name)
+            )
+            if content_hash is None:
+                content_hash = get_content_hash(self.get_input_path(file_name))
+                if content_hashes is not None:
+                    content_hashes[file_name] = content_hash
+
+            self.__content_hashes[file_name] = content_hash
+
+            if (
+                self.cache is not None
+                and (cached := self.cache.get(content_hash, self.args)) is not None
+            ):
+                self.record_result(
+                    file_name,
+                    cached.return_code,
+                    cached.stderr,
+                    stderr_input_path=INPUT_PATH_PLACEHOLDER,
+                )
+            else:
+                yield file_name
+
+    def create_subprocess(self, file_name: str) -> subprocess.Popen:
+        return subprocess.Popen(
+            self.cmd + [self.get_input_path(file_name)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            preexec_fn=self.limits.preexec_fn,
+        )
+
+    def get_exceeded_limit(
+        self,
+        return_code: int,
+        stderr: str,
+        timed_out: bool,
+        usage: Optional[ResourceUsage],
+    ) -> Optional[str]:
+        """
+        `TIMEOUT_BUCKET` or `OOM_BUCKET` if the input was stopped by one of the `limits`.
+        Only limits that are set count, so e.g. a process killed by the kernel's OOM killer is a crash as any other.
+        """
+        # the watchdog only kills processes with a wall-clock limit
+        if timed_out:
+            return TIMEOUT_BUCKET
+
+        cpu_limit = self.limits.cpu_time
+        if cpu_limit is not None and (
+            return_code == -signal.SIGXCPU
+            # the hard limit, if the process ignored SIGXCPU
+            or (
+                return_code == -signal.SIGKILL
+                and usage is not None
+                and usage.cpu_time >= cpu_limit
+            )
+        ):
+            return TIMEOUT_BUCKET
+
+        # the address space is not in the resource usage, failed allocations tell that it was reached
+        if self.limits.address_space is not None and any(
+            message in stderr for message in _OUT_OF_MEMORY_MESSAGES
+        ):
+            return OOM_BUCKET
+
+        return None
+
+    def record_result(
+        self,
+        file_name: str,
+        return_code: int,
+        stderr: str,
+        stderr_input_path: Optional[str] = None,
+        timed_out: bool = False,
+        usage: Optional[ResourceUsage] = None,
+    ) -> None:
+        """
+        `stderr_input_path`: the input path that appears in `stderr`,
+        if it was produced by running a file of the same content under another name.
+        `timed_out` and `usage` are given for inputs that were just run, to tell if they exceeded a limit.
+        """
+        ir_bc_path = self.get_input_path(file_name)
+
+        if stderr_input_path is not None and stderr_input_path != ir_bc_path:
+            stderr = stderr.replace(stderr_input_path, ir_bc_path)
+
+        content_hash = self.__content_hashes.pop(file_name)
+        exceeded_limit = self.get_exceeded_limit(return_code, stderr, timed_out, usage)
+        if exceeded_limit is not None:
+            # not cached, the limits may be different next time
+            self.__record_limit_hit(ir_bc_path, return_code, exceeded_limit, usage)
+            return
 
-        return hash(self.stack_trace) ^ hash(self.message_minimized)
+        if self.cache is not None:
+            self.cache.put(
+                content_hash,
+                self.args,
+                CachedResult(
+                    return_code, stderr.replace(ir_bc_path, INPUT_PATH_PLACEHOLDER)
+                ),
+            )
+
+        if len(stderr) == 0:
+            self.crash_db.add_input(self.experiment_id, ir_bc_path, return_code, None)
+            return
+
+        self.__record_crash(
+            ir_bc_path, self.args + [ir_bc_path], return_code, io.StringIO(stderr)
+        )
+
+    def __record_crash(
+        self,
+        ir_bc_path: str,
+        args: List[str],
+        return_code: int,
+        stderr_iter: Iterator[str],
+    ) -> None:
+        crash = CrashError(
+            args,
+            return_code,
+            stderr_iter,
+            self.hash_stacktrace_only,
+            self.hash_op_code_only_for_isel_crash,
+            self.remove_addr_in_stacktrace,
+        )
+
+        if self.ignore_undefined_external_symbol and crash.undefined_external_symbol:
+            # not a bug in the backend, only recorded so resuming does not run it again
+            bucket_id = self.crash_db.add_bucket(
+                name=IGNORED_BUCKET,
+                fingerprint=get_fingerprint([IGNORED_BUCKET]),
+                type=IGNORED_BUCKET,
+                subtype=None,
+                report=f"Error Type: {IGNORED_BUCKET}\n",
+                stack_frames=[],
+            )
+            self.crash_db.add_input(
+                self.experiment_id, ir_bc_path, return_code, bucket_id
+            )
+            return
+
+        folder_name = crash.get_folder_name()
+
+        if crash.fingerprint not in self.crash_hashes:
+            self.crash_hashes.add(crash.fingerprint)
+
+            if self.verbose:
+                print("New crash type:", folder_name)
+
+        bucket_id = self.crash_db.add_bucket(
+            name=folder_name,
+            fingerprint=crash.fingerprint,
+            type=crash.type,
+            subtype=crash.subtype,
+            report=str(crash),
+            stack_frames=crash.stack_trace.stack_frames,
+        )
+        self.crash_db.add_input(self.experiment_id, ir_bc_path, return_code, bucket_id)
+
+    def __record_limit_hit(
+        self,
+        ir_bc_path: str,
+        return_code: int,
+        bucket: str,
+        usage: Optional[ResourceUsage],
+    ) -> None:
+        fingerprint = get_fingerprint([bucket])
+
+        if fingerprint not in self.crash_hashes:
+            self.crash_hashes.add(fingerprint)
+
+            if self.verbose:
+                print("New crash type:", bucket)
+
+        bucket_id = self.crash_db.add_bucket(
+            name=bucket,
+            fingerprint=fingerprint,
+            type=bucket,
+            subtype=None,
+            report=f"Error Type: {bucket}\n{self.limits}",
+            stack_frames=[],
+        )
+        self.crash_db.add_input(
+            self.experiment_id, ir_bc_path, return_code, bucket_id, usage
+        )
+
+    def finish(self) -> None:
+        """print the summary of all results, including those recorded before resuming"""
+        self.crash_db.commit()
+        summary = self.crash_db.get_experiment_summary(self.experiment_id)
+        print(
+            f"{summary.n_false_alarms} false positives, {summary.n_unique_crashes} unique crashes"
+            + (
+                f", not counting {summary.n_timeouts} timeouts and {summary.n_ooms} out of memory"
+                if summary.n_timeouts + summary.n_ooms > 0
+                else ""
+            )
+        )
+
+
+class InputGroup:
+    """
+    Inputs with the same content that are classified with the same command.
+    Only the first one is run, its result is recorded for all of them.
+    """
+
+    members: List[Tuple[Classifier, str]]
+    size: int
+
+    def __init__(self, classifier: Classifier, file_name: str) -> None:
+        self.members = [(classifier, file_name)]
+        self.size = os.path.getsize(classifier.get_input_path(file_name))
+
+    @property
+    def input_path(self) -> str:
+        """the path of the input that is run"""
+        classifier, file_name = self.members[0]
+        return classifier.get_input_path(file_name)
+
+    def __str__(self) -> str:
+        return self.input_path
+
+    def create_subprocess(self) -> subprocess.Popen:
+        classifier, file_name = self.members[0]
+        return classifier.create_subprocess(file_name)
+
+    def on_process_exit(self, result: ProcessResult) -> None:
+        assert result.stderr is not None
+        self.record_result(
+            result.process.returncode,
+            result.stderr.decode(errors="replace"),
+            result.timed_out,
+            result.usage,
+        )
+
+    def on_worker_exit(self, result: WorkerResult) -> None:
+        self.record_result(
+            result.returncode,
+            result.stderr.decode(errors="replace"),
+            result.timed_out,
+            result.usage,
+        )
+
+    def record_result(
+        self,
+        return_code: int,
+        stderr: str,
+        timed_out: bool = False,
+        usage: Optional[ResourceUsage] = None,
+    ) -> None:
+        for classifier, file_name in self.members:
+            classifier.record_result(
+                file_name,
+                return_code,
+                stderr,
+                stderr_input_path=self.input_path,
+                timed_out=timed_out,
+                usage=usage,
+            )
+
+
+def group_inputs(inputs: Iterable[Tuple[Classifier, str]]) -> List[InputGroup]:
+    """
+    Groups inputs by their command and content, so each distinct input is only run once.
+    Groups are sorted by input size, small inputs run faster and their results come in early.
+    """
+    groups: dict[Tuple[str, ...], InputGroup] = {}
+
+    for classifier, file_name in inputs:
+        key = (*classifier.args, classifier.get_content_hash(file_name))
+
+        if (group := groups.get(key)) is None:
+            groups[key] = InputGroup(classifier, file_name)
+        else:
+            group.members.append((classifier, file_name))
+
+    return sorted(groups.values(), key=lambda group: group.size)
 
 
 def classify(
@@ -202,100 +701,268 @@ def classify(
     hash_op_code_only_for_isel_crash: bool = False,
     remove_addr_in_stacktrace: bool = False,
     ignore_undefined_external_symbol: bool = False,
+    worker_args: Optional[List[str]] = None,
+    cache_path: Optional[Path] = None,
+    spill_stderr: bool = False,
+    crash_db_path: Optional[Path] = None,
+    experiment: Optional[Experiment] = None,
+    export_tree: bool = True,
+    limits: ResourceLimits = ResourceLimits(),
+    stream: bool = False,
+    resume: bool = False,
 ) -> None:
-    output_dir = os.path.abspath(output_dir)
-    input_dir = os.path.abspath(input_dir)
-    temp_dir = tempfile.gettempdir()
+    """
+    Run `cmd` on every input in `input_dir` and group the crashes by their errors in `output_dir`.
+    Inputs of the same content are only run once, smallest first.
+    With `stream`, inputs are run while `input_dir` is read instead, in directory order,
+    so memory does not grow with the size of `input_dir`.
+    Inputs of the same content are then only run once if they are in the cache by the time they are read.
 
-    if os.path.exists(output_dir):
-        if force:
-            shutil.rmtree(output_dir)
-        else:
-            print(f"{output_dir} already exists, use -f to remove it. Abort.")
-            exit(1)
+    Results are recorded in the crash database at `crash_db_path` (see `lib/crash_db.py`),
+    `experiment` describes `input_dir` if it is a fuzzing replicate.
+    Without `crash_db_path`, the database only lives in memory.
+    If `export_tree` is set, the classic folder tree with a folder per bucket (holding symlinks to its inputs
+    if `create_symlink_to_source` is set) and a `.log` report is written to `output_dir`.
 
-    Path(output_dir).mkdir(parents=True)
+    Stderr is captured through pipes, keeping at most `MAX_STDERR_SIZE` bytes per input.
+    With `spill_stderr`, it is kept whole instead and what exceeds `MAX_STDERR_SIZE` is spilled to `/dev/shm`.
 
-    crash_hashes: Set[int] = set()
-    false_alarms: List[str] = []
+    If `worker_args` is set, inputs are not run with `cmd` but on a pool of persistent `isel-triage` workers
+    started with `worker_args` (see `llvm-isel-afl/triage-driver.cpp`), which only pay LLVM's startup cost once.
 
-    def on_process_exit(file_name: str, exit_code: Optional[int], p: subprocess.Popen) -> None:
-        ir_bc_path: str = p.args[-1]  # type: ignore
-        stderr_dump_path = os.path.join(temp_dir, file_name + ".stderr")
-        stderr_dump_file = open(stderr_dump_path)
+    If `cache_path` is set, classification is incremental: results are cached in that file,
+    inputs that were run with the same command and LLVM commit before are not run again,
+    and an existing `output_dir` is updated in place instead of being removed.
 
-        if os.stat(stderr_dump_path).st_size == 0:
-            false_alarms.append(ir_bc_path)
-            return
+    Every input runs under `limits`. Inputs exceeding the CPU or wall-clock limit are recorded
+    in the `TIMEOUT_BUCKET`, inputs exceeding the memory limit in the `OOM_BUCKET`, along with the resources they used.
 
-        crash = CrashError(
-            p.args,  # type: ignore
-            p.returncode,
-            stderr_dump_file,
-            hash_stacktrace_only,
-            hash_op_code_only_for_isel_crash,
-            remove_addr_in_stacktrace,
+    Results are committed to the crash database as they come in. With `resume`, a classification of `output_dir`
+    into the same `crash_db_path` that was interrupted continues where it stopped.
+    """
+    cache = (
+        None
+        if cache_path is None
+        else TriageCache(cache_path, llvm_commit=get_llvm_commit())
+    )
+    crash_db = CrashDatabase(
+        Path(":memory:") if crash_db_path is None else crash_db_path
+    )
+
+    try:
+        classifier = Classifier(
+            cmd,
+            input_dir,
+            output_dir,
+            force,
+            crash_db=crash_db,
+            experiment=experiment,
+            verbose=verbose,
+            hash_stacktrace_only=hash_stacktrace_only,
+            hash_op_code_only_for_isel_crash=hash_op_code_only_for_isel_crash,
+            remove_addr_in_stacktrace=remove_addr_in_stacktrace,
+            ignore_undefined_external_symbol=ignore_undefined_external_symbol,
+            worker_args=worker_args,
+            cache=cache,
+            limits=limits,
+            resume=resume,
         )
 
-        stderr_dump_file.close()
-        os.remove(stderr_dump_path)
+        Path(classifier.output_dir).mkdir(parents=True, exist_ok=True)
+        input_groups: Iterable[InputGroup] = (
+            (InputGroup(classifier, file_name) for file_name in classifier.get_inputs())
+            if stream
+            else group_inputs(
+                (classifier, file_name) for file_name in classifier.get_inputs()
+            )
+        )
 
-        if ignore_undefined_external_symbol and crash.undefined_external_symbol:
-            return
+        if worker_args is not None:
+            run_triage_workers(
+                inputs=input_groups,
+                worker_args=worker_args,
+                get_input_path=lambda group: group.input_path,
+                on_exit=lambda group, result: group.on_worker_exit(result),
+                timeout=limits.wall_time,
+                limits=limits,
+                collect_results=False,
+            )
+        else:
+            run_subprocess_pool(
+                inputs=input_groups,
+                subprocess_creator=lambda group: group.create_subprocess(),
+                on_exit=lambda group, result: group.on_process_exit(result),
+                timeout=limits.wall_time,
+                usage_log=classifier.usage_log,
+                max_pipe_buffer_size=MAX_STDERR_SIZE,
+                spill_pipes=spill_stderr,
+                collect_results=False,
+            )
+        classifier.finish()
 
-        folder_name = crash.get_folder_name()
-        folder_path = os.path.join(output_dir, folder_name)
-        Path(folder_path).mkdir(parents=True, exist_ok=True)
+        if export_tree:
+            crash_db.export_tree(classifier.output_dir, create_symlink_to_source)
+    finally:
+        if cache is not None:
+            cache.close()
+        crash_db.close()
 
-        if hash(crash) not in crash_hashes:
-            crash_hashes.add(hash(crash))
-            with open(
-                os.path.join(output_dir, folder_name + ".log"), "w+"
-            ) as report_path:
-                print(crash, file=report_path)
 
-            if verbose:
-                print("New crash type:", folder_name)
+def add_limit_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="The wall-clock limit in seconds for each input",
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        type=int,
+        default=None,
+        help="The CPU time limit in seconds for each input",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        default=None,
+        help="The address space limit in MiB for each input",
+    )
 
-        if create_symlink_to_source:
-            os.symlink(
-                ir_bc_path,
-                os.path.join(folder_path, os.path.basename(ir_bc_path) + ".bc"),
-            )
 
-    run_concurrent_subprocesses(
-        iter=list(
-            filter(
-                lambda file_name: file_name.split(".")[-1] not in ["md", "txt", "s"],
-                os.listdir(input_dir),
-            )
+def get_limits(args: argparse.Namespace) -> ResourceLimits:
+    return ResourceLimits(
+        cpu_time=args.cpu_limit,
+        wall_time=args.timeout,
+        address_space=(
+            None if args.memory_limit is None else args.memory_limit * 1024 * 1024
         ),
-        subprocess_creator=lambda file_name: subprocess.Popen(
-            cmd + [os.path.join(input_dir, file_name)],
-            stdout=subprocess.DEVNULL,
-            stderr=open(os.path.join(temp_dir, file_name + ".stderr"), "w"),
-        ),
-        on_exit=on_process_exit,
     )
 
-    print(f"{len(false_alarms)} false positives, {len(crash_hashes)} unique crashes")
-    with open(os.path.join(output_dir, "false_positives.txt"), "a+") as file:
-        file.writelines(line + "\n" for line in false_alarms)
 
-    with open(os.path.join(output_dir, "unique_crashes"), "w+") as file:
-        file.write(str(len(crash_hashes)))
+def classify_llc_commands(
+    llc_commands: Sequence[LLCCommand],
+    input_dir: str | Path,
+    output_dir: str | Path,
+    force: bool,
+    verbose: bool = False,
+    create_symlink_to_source: bool = True,
+    hash_stacktrace_only: bool = False,
+    hash_op_code_only_for_isel_crash: bool = False,
+    remove_addr_in_stacktrace: bool = False,
+    ignore_undefined_external_symbol: bool = False,
+    cache_path: Optional[Path] = None,
+    spill_stderr: bool = False,
+    crash_db_path: Optional[Path] = None,
+    export_tree: bool = True,
+    limits: ResourceLimits = ResourceLimits(),
+    resume: bool = False,
+) -> None:
+    """
+    Like `classify`, but runs every input in `input_dir` with each of `llc_commands`,
+    scanning `input_dir` once and scheduling all runs on one pool.
+    With `resume`, each command continues its interrupted classification recorded in `crash_db_path`.
+
+    The results of each command are classified as the experiment `<output_dir>/<command name>`
+    (see `LLCCommand.name`), and `<output_dir>/RESULT_MATRIX_FILE_NAME` has a row per input
+    and a column per command, holding the bucket the input crashed into, or nothing.
+    """
+    cache = (
+        None
+        if cache_path is None
+        else TriageCache(cache_path, llvm_commit=get_llvm_commit())
+    )
+    crash_db = CrashDatabase(
+        Path(":memory:") if crash_db_path is None else crash_db_path
+    )
+
+    try:
+        classifiers = [
+            Classifier(
+                [str(LLC), *llc_command.get_options(output="-")],
+                input_dir,
+                Path(output_dir, llc_command.name),
+                force,
+                crash_db=crash_db,
+                verbose=verbose,
+                hash_stacktrace_only=hash_stacktrace_only,
+                hash_op_code_only_for_isel_crash=hash_op_code_only_for_isel_crash,
+                remove_addr_in_stacktrace=remove_addr_in_stacktrace,
+                ignore_undefined_external_symbol=ignore_undefined_external_symbol,
+                cache=cache,
+                limits=limits,
+                resume=resume,
+            )
+            for llc_command in llc_commands
+        ]
+
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        file_names = list(scan_inputs(input_dir))
+        content_hashes: dict[str, str] = {}
+        input_groups = group_inputs(
+            (classifier, file_name)
+            for classifier in classifiers
+            for file_name in classifier.get_inputs(file_names, content_hashes)
+        )
+
+        run_subprocess_pool(
+            inputs=input_groups,
+            subprocess_creator=lambda group: group.create_subprocess(),
+            on_exit=lambda group, result: group.on_process_exit(result),
+            timeout=limits.wall_time,
+            usage_log=Path(output_dir, "resource_usage.jsonl"),
+            max_pipe_buffer_size=MAX_STDERR_SIZE,
+            spill_pipes=spill_stderr,
+            collect_results=False,
+        )
+
+        for classifier in classifiers:
+            classifier.finish()
+
+            if export_tree:
+                crash_db.export_tree(classifier.output_dir, create_symlink_to_source)
+
+        buckets: dict[str, list[str]] = {
+            file_name: [""] * len(classifiers) for file_name in file_names
+        }
+        for i, classifier in enumerate(classifiers):
+            for result in crash_db.get_input_results(classifier.output_dir):
+                # when resuming, the database may have inputs removed from `input_dir` since
+                row = buckets.get(os.path.basename(result.path))
+                if row is not None and result.bucket is not None:
+                    row[i] = result.bucket
+
+        with open(Path(output_dir, RESULT_MATRIX_FILE_NAME), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(
+                ["input", *(llc_command.name for llc_command in llc_commands)]
+            )
+            writer.writerows(
+                [file_name, *row] for file_name, row in sorted(buckets.items())
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+        crash_db.close()
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Run all crashed cases and classify them"
     )
-    parser.add_argument(
+    command_group = parser.add_mutually_exclusive_group(required=True)
+    command_group.add_argument(
         "--cmd",
         type=str,
-        required=True,
         help="The command to run on all files in the input dir",
     )
+    command_group.add_argument(
+        "--llc-command",
+        type=str,
+        action="append",
+        help="An llc command line (e.g. 'llc -mtriple=x86_64 -global-isel -O2') to run on all files in the input dir, "
+        f"can be given several times to classify with all of them at once and get a {RESULT_MATRIX_FILE_NAME} "
+        "with the results of every input for every command",
+    )
     parser.add_argument(
         "--input", type=str, required=True, help="The directory containing input files"
     )
@@ -312,8 +979,58 @@ def main() -> None:
         action="store_true",
         help="force delete the output directory if it already exists.",
     )
+    parser.add_argument(
+        "--crash-db",
+        type=Path,
+        default=None,
+        help="The crash database to record results in, kept in memory if not given",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Run inputs while reading the input dir instead of grouping and sorting them first, "
+        "for huge input dirs",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted classification recorded in --crash-db, skipping inputs it already has",
+    )
+    add_limit_arguments(parser)
     args = parser.parse_args()
-    classify(args.cmd.split(" "), args.input, args.output, args.force, verbose=True)
+
+    if args.resume and args.crash_db is None:
+        parser.error("--resume requires --crash-db")
+
+    if args.llc_command is not None:
+        if args.stream:
+            parser.error(
+                "--stream is not supported with --llc-command, which keeps every input name for the result matrix"
+            )
+
+        classify_llc_commands(
+            [LLCCommand.parse(command) for command in args.llc_command],
+            args.input,
+            args.output,
+            args.force,
+            verbose=True,
+            crash_db_path=args.crash_db,
+            limits=get_limits(args),
+            resume=args.resume,
+        )
+        return
+
+    classify(
+        args.cmd.split(" "),
+        args.input,
+        args.output,
+        args.force,
+        verbose=True,
+        crash_db_path=args.crash_db,
+        limits=get_limits(args),
+        stream=args.stream,
+        resume=args.resume,
+    )
 
 
 if __name__ == "__main__":
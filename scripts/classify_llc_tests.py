@@ -1,9 +1,10 @@
-from itertools import groupby
 from pathlib import Path
 import pandas as pd
 from tap import Tap
 
-from lib.llc_test import LLCTest, parse_llc_tests
+from lib.llc_command import LLCCommand
+from lib.llc_test import parse_llc_tests
+from lib.llc_test_query import LLCTestCorpus
 
 
 class Args(Tap):
@@ -16,11 +17,9 @@ class Args(Tap):
 
 def classify(
     backend: str,
-    tests: list[LLCTest],
+    commands: list[LLCCommand],
     summary_out: Path,
 ) -> None:
-    commands = (cmd for test in tests for cmd in test.runnable_llc_commands)
-
     df = pd.DataFrame(
         columns=["arch", "gisel", "triple", "cpu", "attrs"],
         data=(
@@ -57,15 +56,15 @@ def main() -> None:
     summary_out = Path(args.output)
     summary_out.mkdir(exist_ok=True)
 
-    tests = parse_llc_tests()
+    corpus = LLCTestCorpus(parse_llc_tests())
 
-    for key, group in groupby(tests, key=lambda test: test.backend):
-        arch_summary_out = summary_out.joinpath(key)
+    for backend in corpus.backends:
+        arch_summary_out = summary_out.joinpath(backend)
         arch_summary_out.mkdir(exist_ok=True)
 
         classify(
-            backend=key,
-            tests=list(group),
+            backend=backend,
+            commands=corpus.get_commands(backend),
             summary_out=arch_summary_out,
         )
 
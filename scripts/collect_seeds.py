@@ -1,16 +1,22 @@
 import logging
 from pathlib import Path
 import subprocess
-from typing import Iterable, Literal, Optional
+from typing import Iterable, Literal, NamedTuple, Optional
 
 from tap import Tap
 
-from lib.fs import count_files
+from lib import LLC, LLVM_AS, get_llvm_commit
+from lib.fs import count_files, get_content_hash
 from lib.llc_command import LLCCommand
-from lib.llc_test import LLCTest, parse_llc_tests
-from lib.target import Target, TargetFilter, TargetProp, create_target_filter
+from lib.llc_test import LLCTest
+from lib.llc_test_query import load_llc_test_corpus
+from lib.process_concurrency import ProcessResult, WorkQueue, run_subprocess_pool
+from lib.seed_cache import SeedFormat, SeedValidationCache, ValidationResult
+from lib.target import Target, TargetProp
 from lib.triple import Triple
 
+SEED_CACHE_FILE_NAME = "seed_validation_cache.sqlite3"
+
 
 class Args(Tap):
     triple: str
@@ -34,6 +40,11 @@ class Args(Tap):
     only include test cases that can be compiled within the specified in seconds.
     """
 
+    no_cache: bool = False
+    """
+    validate every seed again instead of reusing the outcomes cached in <output>/seed_validation_cache.sqlite3.
+    """
+
     output: str
     """directory for storing seeds (will create if not exist)"""
 
@@ -42,39 +53,39 @@ class Args(Tap):
 
 
 def get_runnable_llc_tests(
-    backend: str,
+    target: Target,
     global_isel: bool,
-    target_filter: TargetFilter = lambda _: True,
+    props_to_match: Iterable[TargetProp] = ["triple", "cpu", "attrs"],
 ) -> Iterable[LLCTest]:
-    return (
-        test
-        for test in parse_llc_tests(backend_filter=lambda a: a == backend)
-        if any(
-            cmd.global_isel == global_isel and target_filter(cmd.target)
-            for cmd in test.runnable_llc_commands
-        )
+    """tests with a command matching `target` in `props_to_match`, see `LLCTestCorpus.find_tests_for`"""
+    return load_llc_test_corpus(target.backend).find_tests_for(
+        target, props_to_match, global_isel
     )
 
 
-def validate_seed(
-    seed_path: Path, llc_command: LLCCommand, timeout_secs: Optional[float] = None
-) -> bool:
-    try:
-        subprocess.run(
-            llc_command.get_args(input=seed_path, output="-"),
-            timeout=timeout_secs,
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+class AssembleJob(NamedTuple):
+    test: LLCTest
+    content_hash: str
+    bc_path: Path
+
+
+class ValidateJob(NamedTuple):
+    test: LLCTest
+    content_hash: str
+    seed_format: SeedFormat
+    seed_path: Path
 
-        return True
-    except subprocess.CalledProcessError:
-        logging.warning(f"Seed candidate {seed_path} does not compile.")
-    except subprocess.TimeoutExpired:
-        logging.warning(f"Seed candidate {seed_path} timed out when compiling.")
 
-    return False
+def create_subprocess(
+    job: AssembleJob | ValidateJob, llc_options: list[str]
+) -> subprocess.Popen:
+    match job:
+        case AssembleJob(test, _, bc_path):
+            args = [LLVM_AS, test.path, "-o", bc_path]
+        case ValidateJob(_, _, _, seed_path):
+            args = [LLC, *llc_options, seed_path]
+
+    return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
 def collect_seeds_from_tests(
@@ -85,7 +96,13 @@ def collect_seeds_from_tests(
     dump_bc: bool = True,
     symlink_to_ll: bool = False,
     timeout_secs: Optional[float] = None,
+    use_cache: bool = True,
 ) -> Path:
+    """
+    Assembles (if `dump_bc`) and validates the tests runnable on `target` on a process pool.
+    Unless `use_cache` is unset, validation outcomes are cached in `<out_dir_parent>/SEED_CACHE_FILE_NAME`,
+    so tests that were validated with the same llc command and LLVM commit are not compiled again.
+    """
     print(f"Collecting seeds for target {target}...")
 
     out_dir = out_dir_parent.joinpath(
@@ -93,21 +110,88 @@ def collect_seeds_from_tests(
     )
     out_dir.mkdir(parents=True)
 
-    llc_command = LLCCommand(target=target, global_isel=global_isel)
-
-    for test in get_runnable_llc_tests(
-        backend=target.backend,
-        global_isel=global_isel,
-        target_filter=create_target_filter(target, props_to_match),
-    ):
-        if symlink_to_ll and validate_seed(test.path, llc_command, timeout_secs):
-            out_dir.joinpath(test.path.name).symlink_to(test.path.absolute())
-
-        if dump_bc:
-            bc_path = test.dump_bc(out_dir)
+    command = list(
+        LLCCommand(target=target, global_isel=global_isel).get_options(output="-")
+    )
+    cache = (
+        SeedValidationCache(
+            out_dir_parent.joinpath(SEED_CACHE_FILE_NAME), get_llvm_commit()
+        )
+        if use_cache
+        else None
+    )
+    queue: WorkQueue[AssembleJob | ValidateJob] = WorkQueue()
+
+    def get_cached_validity(
+        content_hash: str, seed_format: SeedFormat
+    ) -> Optional[bool]:
+        if cache is None:
+            return None
+
+        result = cache.get(content_hash, seed_format, command)
+        return None if result is None else result.is_valid(timeout_secs)
+
+    def on_valid_seed(test: LLCTest, seed_format: SeedFormat) -> None:
+        if seed_format == "ll":
+            out_dir.joinpath(test.seed_name).symlink_to(test.path.absolute())
+
+    def on_exit(job: AssembleJob | ValidateJob, result: ProcessResult) -> None:
+        match job:
+            case AssembleJob(test, content_hash, bc_path):
+                if result.exit_code != 0:
+                    print(f"WARNING: failed to convert {test.path} to {bc_path}")
+                    bc_path.unlink(missing_ok=True)
+                elif get_cached_validity(content_hash, "bc") is None:
+                    # validate it right away, so seeds are complete as early as possible
+                    queue.push_front(ValidateJob(test, content_hash, "bc", bc_path))
+
+            case ValidateJob(_, content_hash, seed_format, seed_path):
+                if result.timed_out:
+                    logging.warning(
+                        f"Seed candidate {seed_path} timed out when compiling."
+                    )
+                    outcome = "timeout"
+                elif result.exit_code != 0:
+                    logging.warning(f"Seed candidate {seed_path} does not compile.")
+                    outcome = "fails"
+                else:
+                    outcome = "compiles"
+
+                validation_result = ValidationResult(outcome, result.usage.wall_time)
+                if cache is not None:
+                    cache.put(content_hash, seed_format, command, validation_result)
+
+                if validation_result.is_valid(timeout_secs):
+                    on_valid_seed(job.test, seed_format)
+                elif seed_format == "bc":
+                    seed_path.unlink(missing_ok=True)
 
-            if not validate_seed(bc_path, llc_command, timeout_secs):
-                bc_path.unlink(missing_ok=True)
+    try:
+        for test in get_runnable_llc_tests(target, global_isel, props_to_match):
+            content_hash = get_content_hash(test.path)
+
+            if symlink_to_ll:
+                match get_cached_validity(content_hash, "ll"):
+                    case None:
+                        queue.push(ValidateJob(test, content_hash, "ll", test.path))
+                    case True:
+                        on_valid_seed(test, "ll")
+
+            # a valid bitcode seed still has to be assembled, an invalid one is skipped
+            if dump_bc and get_cached_validity(content_hash, "bc") is not False:
+                queue.push(AssembleJob(test, content_hash, test.get_bc_path(out_dir)))
+
+        run_subprocess_pool(
+            inputs=queue,
+            subprocess_creator=lambda job: create_subprocess(job, command),
+            on_exit=on_exit,
+            timeout=lambda job: (
+                timeout_secs if isinstance(job, ValidateJob) else None
+            ),
+        )
+    finally:
+        if cache is not None:
+            cache.close()
 
     print(f"{count_files(out_dir)} seeds written to {out_dir}.")
 
@@ -131,6 +215,7 @@ def main() -> None:
         dump_bc=args.seed_format == "bc",
         symlink_to_ll=args.seed_format == "ll",
         timeout_secs=args.timeout,
+        use_cache=not args.no_cache,
     )
 
 
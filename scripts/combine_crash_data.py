@@ -1,29 +1,10 @@
 import argparse
-from itertools import groupby
-from typing import Generator, Set, Tuple
+import os
+from pathlib import Path
 
 import pandas as pd
 
-from lib.experiment import Experiment, get_all_experiments
-from lib.fs import subdirs_of
-
-
-def iterate_over_all_experiments(
-    dir: str,
-) -> Generator[Tuple[Experiment, Set[str]], None, None]:
-    for expr in get_all_experiments(dir):
-        crashes = set()
-
-        for crash_type_dir in subdirs_of(expr.path):
-            for subdir in subdirs_of(crash_type_dir.path):
-                if subdir.name.startswith("tracedepth_"):
-                    crashes.add(subdir.name)
-                else:
-                    for subsubdir in subdirs_of(subdir.path):
-                        assert subsubdir.name.startswith("tracedepth_")
-                        crashes.add(subsubdir.name)
-
-        yield (expr, crashes)
+from lib.crash_db import CRASH_DB_FILE_NAME, CrashDatabase
 
 
 def main() -> None:
@@ -41,21 +22,22 @@ def main() -> None:
 
     args = parser.parse_args()
 
-    groups = groupby(
-        iterate_over_all_experiments(args.input),
-        key=lambda tuple: ([tuple[0].fuzzer, tuple[0].isel, str(tuple[0].target)]),
-    )
-
-    df = pd.DataFrame(
-        columns=["fuzzer", "isel", "target", "n_unique_crashes"],
-        data=(
-            [
-                *k,
-                len(set((crash for (_, crashes) in v for crash in crashes))),
-            ]
-            for (k, v) in groups
-        ),
-    )
+    # opening a missing database would create an empty one and report no crashes
+    if not os.path.exists(Path(args.input, CRASH_DB_FILE_NAME)):
+        parser.error(f"no {CRASH_DB_FILE_NAME} in {args.input}")
+
+    with CrashDatabase(Path(args.input, CRASH_DB_FILE_NAME)) as crash_db:
+        df = pd.DataFrame(
+            columns=[
+                "fuzzer",
+                "isel",
+                "target",
+                "n_unique_crashes",
+                "n_timeouts",
+                "n_ooms",
+            ],
+            data=(list(row) for row in crash_db.count_unique_crashes_per_target()),
+        )
 
     df.to_csv("combined-crash-counts.csv")
 
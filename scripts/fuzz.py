@@ -1,15 +1,31 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 import logging
 from pathlib import Path
 import subprocess
 from typing import Iterable, Literal, NamedTuple, Optional
 import typing
 import os
+import re
+import shlex
+import signal
+import statistics
 from tap import Tap
 import docker
+from docker.models.containers import Container
+import requests
 from time import sleep
 
 from collect_seeds import TargetProp, collect_seeds_from_tests
-from lib.process_concurrency import MAX_SUBPROCESSES, run_concurrent_subprocesses
+from lib.process_concurrency import (
+    MAX_SUBPROCESSES,
+    ProcessResult,
+    run_subprocess_pool,
+)
+from lib.adaptive_scheduler import AdaptiveScheduler
+from lib.cpu_topology import CoreAllocator, format_cpu_list
+from lib.experiment import MAIN_INSTANCE_NAME, get_all_experiments
 from lib.target import Target
 from lib.matcher_table_sizes import (
     DAGISEL_MATCHER_TABLE_SIZES,
@@ -41,6 +57,14 @@ ClutserType = Literal["screen", "docker", "stdout"]
 
 
 DOCKER_IMAGE = "irfuzzer"
+
+# the `-V <seconds>` option in the `command_line` of `fuzzer_stats`
+AFL_TIME_OPTION = re.compile(r"-V (\d+)")
+
+# Extra wall-clock time an experiment gets on top of its `-V` time before it is considered hung and killed.
+# (must be larger than the 180s of slack given to screen sessions)
+EXPERIMENT_TIMEOUT_GRACE_SECS = 600
+
 FUZZERS: dict[str, FuzzerConfig] = {
     "aflplusplus": FuzzerConfig(extra_env={"AFL_CUSTOM_MUTATOR_ONLY": "0"}),
     "libfuzzer": FuzzerConfig(
@@ -65,11 +89,28 @@ class ExperimentConfig(NamedTuple):
     expr_root: Path
     time: int
     replicate_id: int
+    secondaries: tuple[Fuzzer, ...] = ()
+    """
+    mutators of the secondary (`-S`) AFL++ instances fuzzing the target alongside the main (`-M`) one,
+    which uses `fuzzer`, sharing the output directory as sync directory.
+    Without secondaries, a single instance runs without `-M`.
+    """
 
     @property
     def name(self) -> str:
         return f"{self.fuzzer}:{self.isel}:{self.target}:{self.replicate_id}"
 
+    @property
+    def n_instances(self) -> int:
+        return 1 + len(self.secondaries)
+
+    @property
+    def instance_names(self) -> list[str]:
+        """output directories of the AFL++ instances, the main one first"""
+        return [MAIN_INSTANCE_NAME] + [
+            f"secondary{i}_{fuzzer}" for i, fuzzer in enumerate(self.secondaries, 1)
+        ]
+
     @property
     def matcher_table_size(self) -> Optional[int]:
         matcher_table_sizes = (
@@ -96,7 +137,12 @@ class ExperimentConfig(NamedTuple):
         envs.update(FUZZERS[self.fuzzer].extra_env)
         return envs
 
-    def get_fuzzing_command(self, output_dir: str | Path) -> str:
+    def __get_afl_command(
+        self,
+        fuzzer: Fuzzer,
+        output_dir: str | Path,
+        instance_option: list[str] = [],
+    ) -> list[str]:
         cmd = [
             "$AFL/afl-fuzz",
             "-V",
@@ -105,13 +151,52 @@ class ExperimentConfig(NamedTuple):
             str(self.seed_dir),
             "-o",
             str(output_dir),
+            *instance_option,
         ]
 
-        cmd += FUZZERS[self.fuzzer].extra_cmd
+        cmd += FUZZERS[fuzzer].extra_cmd
 
         cmd.append("llvm-isel-afl/build/isel-fuzzing")
 
-        return " ".join(cmd)
+        return cmd
+
+    def get_fuzzing_command(self, output_dir: str | Path) -> str:
+        """
+        The shell command running the experiment, with the environment of `get_fuzzing_env`.
+        With secondaries, they are started in the background, each with the mutator settings of its fuzzer
+        and its output in `<output_dir>/<instance name>.log`,
+        and the command returns the exit code of the main instance once all instances exited.
+        """
+        if len(self.secondaries) == 0:
+            return " ".join(self.__get_afl_command(self.fuzzer, output_dir))
+
+        # unset the settings of the main instance's mutator before applying the secondary's
+        mutator_env_keys = sorted(
+            set(key for config in FUZZERS.values() for key in config.extra_env)
+        )
+
+        commands: list[str] = []
+        for name, fuzzer in zip(self.instance_names[1:], self.secondaries):
+            env = [
+                "env",
+                *(arg for key in mutator_env_keys for arg in ("-u", key)),
+                *(f"{key}={value}" for key, value in FUZZERS[fuzzer].extra_env.items()),
+                "AFL_NO_UI=1",
+            ]
+            afl_command = self.__get_afl_command(fuzzer, output_dir, ["-S", name])
+            commands.append(
+                " ".join([*env, *afl_command, f"> {output_dir}/{name}.log 2>&1 &"])
+            )
+
+        main_command = " ".join(
+            self.__get_afl_command(self.fuzzer, output_dir, ["-M", MAIN_INSTANCE_NAME])
+        )
+
+        return (
+            "( "
+            + " ".join(commands)
+            + f" {main_command}; status=$?; wait; exit $status )"
+        )
 
     def get_output_dir(self) -> Path:
         return self.expr_root.joinpath(
@@ -194,6 +279,36 @@ class Args(Tap):
     type: Optional[ClutserType] = None
     """the method to start fuzzing cluster"""
 
+    whole_cores: bool = False
+    """give each experiment all SMT siblings of a physical core, instead of a single logical CPU"""
+
+    numa_nodes: Optional[list[int]] = None
+    """only run experiments on the CPUs of these NUMA nodes"""
+
+    parallel: int = 1
+    """
+    number of AFL++ instances fuzzing each target in parallel, one main (-M) and secondaries (-S),
+    each on CPUs of its own
+    """
+
+    secondary_fuzzers: Optional[list[Fuzzer]] = None
+    """
+    mutators of the secondary instances, assigned to them in turn (e.g. 'irfuzzer aflplusplus'),
+    the fuzzer of the experiment by default
+    """
+
+    plateau_window: Optional[str] = None
+    """
+    stop an experiment once its shw_cvg has not grown for this long (e.g. '1h'),
+    and start queued experiments of the backends gaining coverage fastest first
+    """
+
+    history: list[str] = []
+    """
+    output directories of past campaigns, besides the output directory, to estimate from
+    how long experiments run (from 'run_time' in 'fuzzer_stats'), so the longest ones are started first
+    """
+
     def configure(self):
         self.add_argument("-j", "--jobs")
         self.add_argument("-o", "--output")
@@ -225,8 +340,15 @@ def get_experiment_configs(
     seeding_from_tests: bool,
     props_to_match: list[TargetProp],
     compilation_timout_secs: Optional[float],
+    parallel: int = 1,
+    secondary_fuzzers: Optional[list[Fuzzer]] = None,
 ) -> Iterable[ExperimentConfig]:
     for fuzzer in fuzzers:
+        secondary_cycle = secondary_fuzzers or [fuzzer]
+        secondaries = tuple(
+            secondary_cycle[i % len(secondary_cycle)] for i in range(parallel - 1)
+        )
+
         for target in targets:
             expr_seed_dir = seed_dir
 
@@ -250,6 +372,7 @@ def get_experiment_configs(
                     expr_root=expr_root,
                     time=time,
                     replicate_id=r + offset,
+                    secondaries=secondaries,
                 )
 
                 if expr_config.matcher_table_size is None:
@@ -261,38 +384,122 @@ def get_experiment_configs(
                 yield expr_config
 
 
+def get_past_run_fractions(
+    history_roots: Iterable[Path],
+) -> dict[tuple[str, str, str], list[float]]:
+    """
+    For every (fuzzer, isel, target) fuzzed under `history_roots`, how much of their `-V` time its replicates ran,
+    from `run_time` and `command_line` of their `fuzzer_stats`, e.g. less than 1 for those that failed early.
+    """
+    fractions: dict[tuple[str, str, str], list[float]] = {}
+
+    for root in history_roots:
+        if not root.is_dir():
+            continue
+
+        for experiment in get_all_experiments(root):
+            if not experiment.fuzzer_stats_path.exists():
+                continue
+
+            stats = experiment.read_fuzzer_stats()
+            match = AFL_TIME_OPTION.search(stats.get("command_line", ""))
+            if match is None or "run_time" not in stats:
+                continue
+
+            fractions.setdefault(
+                (experiment.fuzzer, experiment.isel, str(experiment.target)), []
+            ).append(int(stats["run_time"]) / max(int(match.group(1)), 1))
+
+    return fractions
+
+
+def estimate_duration(
+    experiment: ExperimentConfig,
+    past_run_fractions: dict[tuple[str, str, str], list[float]],
+) -> float:
+    """seconds `experiment` is expected to run: its `-V` time, scaled by how much of it past runs used"""
+    fractions = past_run_fractions.get(
+        (experiment.fuzzer, experiment.isel, str(experiment.target))
+    )
+    if not fractions:
+        return experiment.time
+    return experiment.time * min(statistics.median(fractions), 1)
+
+
+def order_longest_first(
+    experiment_configs: list[ExperimentConfig],
+    history_roots: Iterable[Path],
+) -> list[ExperimentConfig]:
+    """
+    Experiments ordered by their estimated duration (see `estimate_duration`), longest first,
+    and by number of instances on ties.
+    As each starts as soon as CPUs are free, short experiments fill the gaps left at the end of the campaign
+    instead of a long one starting last and running alone.
+    """
+    past_run_fractions = get_past_run_fractions(history_roots)
+    return sorted(
+        experiment_configs,
+        key=lambda e: (estimate_duration(e, past_run_fractions), e.n_instances),
+        reverse=True,
+    )
+
+
 def combine_commands(*commands: str) -> str:
     return " && ".join(commands)
 
 
+class ContainerExit(NamedTuple):
+    exit_code: Optional[int]
+    """`None` if it is unknown, e.g. the container was already removed when waited on"""
+
+    timed_out: bool
+
+
+def wait_for_container(container: Container, timeout: float) -> ContainerExit:
+    """wait for `container` to exit, killing it if it is still running after `timeout` seconds"""
+    try:
+        return ContainerExit(container.wait(timeout=timeout)["StatusCode"], False)
+    except requests.exceptions.RequestException:
+        try:
+            container.kill()
+        except docker.errors.NotFound:
+            pass
+        return ContainerExit(None, True)
+    except docker.errors.NotFound:
+        # it exited and was removed (`remove=True`) before we started waiting
+        return ContainerExit(None, False)
+
+
 def batch_fuzz_using_docker(
     experiment_configs: list[ExperimentConfig],
     jobs: int,
+    allocator: CoreAllocator,
 ) -> None:
     """
-    Run each experiment inside a dedicated Docker container.
+    Run each experiment inside a dedicated Docker container, bound to CPUs from `allocator` no other container is using.
+    Every container is waited on by its own thread, so whichever exits first frees its CPUs for the next experiment,
+    instead of waiting on containers in the order they were started.
     (Docker Python SDK Reference: https://docker-py.readthedocs.io/en/stable/)
     """
 
     client = docker.client.from_env()
-    container_queue = []
-
-    def dequeue_and_wait():
-        dequeued_container = container_queue.pop(0)  # FIFO
-        if dequeued_container.status != "exited":
-            dequeued_container.wait()
-
-    for i, experiment in enumerate(experiment_configs):
-        if len(container_queue) == jobs:
-            dequeue_and_wait()
-
-        logging.info(f"Starting experiment {experiment.name}...")
+    pending = deque(experiment_configs)
+    running: dict[
+        Future[ContainerExit], tuple[ExperimentConfig, tuple[int, ...]]
+    ] = {}
+
+    def start_container(
+        experiment: ExperimentConfig, cpus: tuple[int, ...]
+    ) -> Container:
+        logging.info(
+            f"Starting experiment {experiment.name} on CPU(s) {format_cpu_list(cpus)}..."
+        )
 
         seed_dir = experiment.seed_dir
         out_dir = experiment.get_output_dir()
         out_dir.mkdir(parents=True)
 
-        container = client.containers.run(
+        return client.containers.run(
             image=DOCKER_IMAGE,
             command=[
                 "bash",
@@ -302,15 +509,16 @@ def batch_fuzz_using_docker(
                     # if AFL_NO_AFFINITY is not set, fuzzer will fail to start
                     "export AFL_NO_AFFINITY=1",
                     experiment.get_fuzzing_command("/fuzzing"),
-                    f"chown -R {os.getuid()} /fuzzing/default",
-                    "mv /fuzzing/default /output/default",
+                    f"chown -R {os.getuid()} /fuzzing",
+                    # the output of every instance
+                    "mv /fuzzing/* /output/",
                 ),
             ],
             remove=True,
             detach=True,
             name=experiment.name.replace("+", "").replace(",", "-").replace(":", "-"),
             environment=experiment.get_fuzzing_env(),
-            cpuset_cpus=str(i % jobs),  # core binding
+            cpuset_cpus=format_cpu_list(cpus),  # core binding
             tmpfs={"/fuzzing": "size=1G"},
             volumes=[
                 f"{seed_dir.absolute()}:{seed_dir.absolute()}",
@@ -318,29 +526,137 @@ def batch_fuzz_using_docker(
             ],
         )
 
-        container_queue.append(container)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            while (
+                len(pending) > 0
+                and len(running) < jobs
+                and (cpus := allocator.allocate(pending[0].n_instances)) is not None
+            ):
+                experiment = pending.popleft()
+
+                try:
+                    container = start_container(experiment, cpus)
+                except docker.errors.APIError as e:
+                    logging.error(f"Failed to start experiment {experiment.name}: {e}")
+                    allocator.release(cpus)
+                    continue
 
-    # wait for all running containers to exit
-    while len(container_queue) > 0:
-        dequeue_and_wait()
+                future = executor.submit(
+                    wait_for_container,
+                    container,
+                    experiment.time + EXPERIMENT_TIMEOUT_GRACE_SECS,
+                )
+                running[future] = (experiment, cpus)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                experiment, cpus = running.pop(future)
+                allocator.release(cpus)
+
+                result = future.result()
+                if result.timed_out:
+                    print(f"Experiment {experiment.name} timed out and was killed")
+                elif result.exit_code is None:
+                    print(f"Experiment {experiment.name} exited")
+                else:
+                    print(
+                        f"Experiment {experiment.name} exited with code {result.exit_code}"
+                    )
 
 
 def batch_fuzz(
     experiment_configs: list[ExperimentConfig],
     type: ClutserType,
     jobs: int,
+    usage_log: Optional[Path] = None,
+    allocator: Optional[CoreAllocator] = None,
+    plateau_window_secs: Optional[float] = None,
 ) -> None:
+    """
+    `usage_log`: file to append the exit status and resource usage of each experiment to, as JSON lines.
+    (not supported when `type` is "docker")
+    `allocator`: gives each experiment CPUs of its own, which it is pinned to (all CPUs of this machine by default).
+    `plateau_window_secs`: stop an experiment once its `shw_cvg` has not grown for that long,
+    and start queued experiments of the backends gaining coverage fastest first (see `AdaptiveScheduler`).
+    (not supported when `type` is "docker", whose output is only copied out of the container at the end)
+    """
+    if allocator is None:
+        allocator = CoreAllocator()
+
+    n_instances = max((e.n_instances for e in experiment_configs), default=1)
+    max_jobs = allocator.capacity // n_instances
+    if max_jobs == 0:
+        logging.error(
+            f"Experiments with {n_instances} instances need more than the {allocator.capacity} CPU(s) available."
+        )
+        exit(1)
+    if jobs > max_jobs:
+        logging.warning(
+            f"Only {max_jobs} experiment(s) can run on their own CPUs, not {jobs}."
+        )
+        jobs = max_jobs
+
     if type == "docker":
-        batch_fuzz_using_docker(experiment_configs, jobs)
+        if plateau_window_secs is not None:
+            logging.warning(
+                "Experiments in Docker can't be stopped at a coverage plateau, running them for their full time."
+            )
+        batch_fuzz_using_docker(experiment_configs, jobs, allocator)
         return
 
+    experiment_cpus: dict[ExperimentConfig, tuple[int, ...]] = {}
+    processes: dict[ExperimentConfig, subprocess.Popen] = {}
+
+    def stop_experiment(experiment: ExperimentConfig) -> None:
+        process = processes.get(experiment)
+        if process is None or process.returncode is not None:
+            return
+
+        if type == "screen":
+            # afl-fuzz stops gracefully on SIGHUP as well
+            subprocess.run(
+                ["screen", "-S", experiment.name, "-X", "quit"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+
+        # afl-fuzz writes its final stats on SIGINT
+        try:
+            os.killpg(process.pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+
+    scheduler = (
+        None
+        if plateau_window_secs is None
+        else AdaptiveScheduler(
+            experiment_configs,
+            get_arm=lambda experiment: experiment.target.backend,
+            get_plot_data_path=lambda experiment: experiment.get_output_dir().joinpath(
+                MAIN_INSTANCE_NAME, "plot_data"
+            ),
+            stop=stop_experiment,
+            plateau_window_secs=plateau_window_secs,
+        )
+    )
+
     def start_subprocess(experiment: ExperimentConfig) -> subprocess.Popen:
-        logging.info(f"Starting experiment {experiment.name}...")
+        # the pool never runs more experiments than the allocator has CPUs for
+        cpus = allocator.allocate(experiment.n_instances)
+        assert cpus is not None, "no free CPU for a new experiment"
+
+        logging.info(
+            f"Starting experiment {experiment.name} on CPU(s) {format_cpu_list(cpus)}..."
+        )
 
         out_dir = experiment.get_output_dir()
         out_dir.mkdir(parents=True)
 
         env = experiment.get_fuzzing_env()
+        # we pin the fuzzer, instead of letting it look for a free core itself
+        env["AFL_NO_AFFINITY"] = "1"
 
         if type == "stdout":
             env["AFL_NO_UI"] = "1"
@@ -350,28 +666,85 @@ def batch_fuzz(
         if type == "screen":
             # If using screen, this script will not be able to detect whether the fuzzing process fails early or did not
             # complete within the estimated time.
-            fuzzing_command = f'screen -S "{experiment.name}" -dm bash -c "{fuzzing_command}" && sleep {experiment.time + 180}'
-
-        process = subprocess.Popen(
-            fuzzing_command,
-            env={**os.environ, **env},
-            shell=True,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,
+            fuzzing_command = f'screen -S "{experiment.name}" -dm bash -c {shlex.quote(fuzzing_command)} && sleep {experiment.time + 180}'
+
+        # the affinity is inherited by everything the shell (or screen) starts,
+        # set by taskset, as a `preexec_fn` is not safe while the pool and scheduler threads run
+        fuzzing_command = (
+            f"taskset -c {format_cpu_list(cpus)} bash -c {shlex.quote(fuzzing_command)}"
         )
 
-        # Sleep for 1s so aflplusplus has time to bind core. Otherwise two fuzzers may bind to the same core.
-        sleep(1)
+        try:
+            process = subprocess.Popen(
+                fuzzing_command,
+                env={**os.environ, **env},
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                # so a timeout or Ctrl-C kills afl-fuzz as well, not just the shell
+                start_new_session=True,
+            )
+        except BaseException:
+            allocator.release(cpus)
+            raise
+
+        experiment_cpus[experiment] = cpus
+        processes[experiment] = process
+        if scheduler is not None:
+            scheduler.started(experiment)
 
         return process
 
-    run_concurrent_subprocesses(
-        iter=experiment_configs,
-        subprocess_creator=start_subprocess,
-        on_exit=lambda expr_cfg, exit_code, p: print(
-            f"Experiment {expr_cfg.name} exited with code {exit_code}"
-        ),
-        max_jobs=jobs,
+    # With screen the fuzzer runs in a detached session, not as a child of the pool,
+    # so its resource usage is not known, only that of the waiting shell.
+    usage_measured = type != "screen"
+
+    def on_exit(experiment: ExperimentConfig, result: ProcessResult) -> Optional[float]:
+        allocator.release(experiment_cpus.pop(experiment))
+        processes.pop(experiment)
+        if scheduler is not None:
+            scheduler.exited(experiment)
+
+        core_hours = result.usage.cpu_time / 3600 if usage_measured else None
+        usage = (
+            f"{core_hours:.2f} core-hours, max RSS {result.usage.max_rss_kb} KiB"
+            if core_hours is not None
+            else "core-hours N/A"
+        )
+
+        if result.timed_out:
+            print(f"Experiment {experiment.name} timed out and was killed ({usage})")
+        elif scheduler is not None and scheduler.was_stopped(experiment):
+            print(
+                f"Experiment {experiment.name} was stopped at a coverage plateau ({usage})"
+            )
+        else:
+            print(
+                f"Experiment {experiment.name} exited with code {result.exit_code} ({usage})"
+            )
+
+        return core_hours
+
+    if usage_log is not None:
+        usage_log.parent.mkdir(parents=True, exist_ok=True)
+
+    with nullcontext() if scheduler is None else scheduler:
+        core_hours = run_subprocess_pool(
+            inputs=experiment_configs if scheduler is None else scheduler,
+            subprocess_creator=start_subprocess,
+            on_exit=on_exit,
+            max_jobs=jobs,
+            timeout=lambda experiment: experiment.time + EXPERIMENT_TIMEOUT_GRACE_SECS,
+            usage_log=usage_log,
+        )
+
+    total_core_hours = (
+        f"{sum(hours for hours in core_hours.values() if hours is not None):.2f}"
+        if usage_measured
+        else "N/A"
+    )
+    print(
+        f"{len(core_hours)} experiment(s) used {total_core_hours} core-hours in total"
     )
 
 
@@ -415,8 +788,13 @@ def main() -> None:
             seeding_from_tests=args.seeding_from_tests,
             props_to_match=args.props_to_match,
             compilation_timout_secs=args.timeout,
+            parallel=args.parallel,
+            secondary_fuzzers=args.secondary_fuzzers,
         )
     )
+    expr_configs = order_longest_first(
+        expr_configs, [out_root, *(Path(dir) for dir in args.history)]
+    )
 
     # Pause for some seconds before starting.
     start_pause = 5
@@ -440,6 +818,15 @@ def main() -> None:
             experiment_configs=expr_configs,
             type=args.type,
             jobs=args.jobs,
+            usage_log=out_root.joinpath("resource_usage.jsonl"),
+            allocator=CoreAllocator(
+                whole_cores=args.whole_cores, numa_nodes=args.numa_nodes
+            ),
+            plateau_window_secs=(
+                None
+                if args.plateau_window is None
+                else get_time_in_seconds(args.plateau_window)
+            ),
         )
 
 
@@ -1,3 +1,4 @@
+from functools import cache
 import logging
 import os
 from pathlib import Path
@@ -12,9 +13,22 @@ LLC = Path(LLVM_BIN_PATH, "llc")
 LLVM_AS = Path(LLVM_BIN_PATH, "llvm-as")
 LLVM_DIS = Path(LLVM_BIN_PATH, "llvm-dis")
 
+# persistent crash reproduction worker, see `llvm-isel-afl/triage-driver.cpp`
+ISEL_TRIAGE = Path("llvm-isel-afl/build/isel-triage")
+
 IRFUZZER_DATA_ENV = "IRFUZZER_DATA"
 
 
+@cache
+def get_llvm_commit() -> str:
+    """short hash of the LLVM commit that `$LLVM` is checked out at"""
+    return (
+        subprocess.check_output(["git", "-C", LLVM, "rev-parse", "--short", "HEAD"])
+        .decode("ascii")
+        .strip()
+    )
+
+
 def __verify_working_dir():
     if FUZZING_HOME is None:
         logging.error(
@@ -29,13 +43,7 @@ def __verify_working_dir():
 def __verify_llvm_version():
     expected_commit = "bcb8a9450388"
 
-    actual_commit = (
-        subprocess.check_output(
-            ["git", "-C", LLVM, "rev-parse", "--short", "HEAD"]
-        )
-        .decode("ascii")
-        .strip()
-    )
+    actual_commit = get_llvm_commit()
 
     if actual_commit != expected_commit:
         logging.warn(
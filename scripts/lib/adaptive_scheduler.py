@@ -0,0 +1,219 @@
+from collections import deque
+import logging
+import math
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Generic, Hashable, Iterable, Iterator, Optional, TypeVar
+
+from lib.plot_data import COLUMNS, convert_percentage_to_float
+
+SHW_CVG_COLUMN_INDEX = COLUMNS.index("shw_cvg")
+
+CHECK_INTERVAL_SECS = 60
+"""default of how often the `plot_data` of running experiments is read"""
+
+_Item = TypeVar("_Item")
+
+
+class CoverageProgress:
+    """
+    The `shw_cvg` of a running experiment, following its `plot_data` by only reading the rows appended since the last poll.
+    Times are wall-clock times of this process, since AFL++ does not add rows while nothing changes.
+    """
+
+    plot_data_path: Path
+
+    start_time: float
+
+    last_growth_time: float
+    """when `shw_cvg` last increased, or the experiment started"""
+
+    first_cvg: Optional[float]
+
+    cvg: Optional[float]
+    """the highest `shw_cvg` so far, `None` until the first row is written"""
+
+    def __init__(self, plot_data_path: Path) -> None:
+        self.plot_data_path = plot_data_path
+        self.start_time = time.monotonic()
+        self.last_growth_time = self.start_time
+        self.first_cvg = None
+        self.cvg = None
+        self.__offset = 0
+        self.__partial_line = b""
+
+    def poll(self) -> None:
+        try:
+            with open(self.plot_data_path, "rb") as file:
+                file.seek(self.__offset)
+                data = file.read()
+                self.__offset = file.tell()
+        except FileNotFoundError:
+            return
+
+        lines = (self.__partial_line + data).split(b"\n")
+        self.__partial_line = lines.pop()
+
+        for line in lines:
+            if line.startswith(b"#"):
+                continue
+
+            try:
+                cvg = convert_percentage_to_float(
+                    line.split(b",")[SHW_CVG_COLUMN_INDEX].decode().strip()
+                )
+            except (IndexError, ValueError):
+                continue
+
+            if self.first_cvg is None:
+                self.first_cvg = cvg
+            if self.cvg is None or cvg > self.cvg:
+                self.cvg = cvg
+                self.last_growth_time = time.monotonic()
+
+    def is_plateaued(self, window_secs: float) -> bool:
+        return time.monotonic() - self.last_growth_time >= window_secs
+
+    @property
+    def growth_rate(self) -> float:
+        """`shw_cvg` gained per hour"""
+        if self.cvg is None or self.first_cvg is None:
+            return 0
+        hours = max(time.monotonic() - self.start_time, 1) / 3600
+        return (self.cvg - self.first_cvg) / hours
+
+
+class AdaptiveScheduler(Generic[_Item]):
+    """
+    Queue of fuzzing experiments for `run_subprocess_pool`, which takes the next experiment whenever one exits,
+    and a monitor of the running ones.
+
+    - The monitor follows the `shw_cvg` of every running experiment (see `started`),
+      and calls `stop` on it once it has not grown for `plateau_window_secs`, so its CPUs are freed early.
+    - Queued experiments are grouped into arms by `get_arm` (e.g. their backend). The next experiment is taken
+      from the arm with the best UCB1 score of the coverage growth rates of its running and finished experiments
+      (arms that never ran first, in queue order), so freed CPUs go to backends still gaining coverage.
+
+    Use as a context manager to run the monitor.
+    """
+
+    plateau_window_secs: float
+
+    check_interval_secs: float
+
+    exploration: float
+    """weight of the exploration term of UCB1"""
+
+    def __init__(
+        self,
+        items: Iterable[_Item],
+        get_arm: Callable[[_Item], Hashable],
+        get_plot_data_path: Callable[[_Item], Path],
+        stop: Callable[[_Item], None],
+        plateau_window_secs: float,
+        check_interval_secs: float = CHECK_INTERVAL_SECS,
+        exploration: float = math.sqrt(2),
+    ) -> None:
+        self.plateau_window_secs = plateau_window_secs
+        self.check_interval_secs = check_interval_secs
+        self.exploration = exploration
+        self.__get_arm = get_arm
+        self.__get_plot_data_path = get_plot_data_path
+        self.__stop = stop
+
+        self.__queues: dict[Hashable, deque[_Item]] = {}
+        for item in items:
+            self.__queues.setdefault(get_arm(item), deque()).append(item)
+
+        self.__running: dict[_Item, CoverageProgress] = {}
+        self.__stopped: set[_Item] = set()
+        self.__growth_rates: dict[Hashable, list[float]] = {}
+        """growth rates of the finished experiments of every arm"""
+
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        self.__monitor = threading.Thread(target=self.__monitor_loop, daemon=True)
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.__queues.values())
+
+    def __iter__(self) -> Iterator[_Item]:
+        return self
+
+    def __next__(self) -> _Item:
+        with self.__lock:
+            arms = [arm for arm, queue in self.__queues.items() if len(queue) > 0]
+            if len(arms) == 0:
+                raise StopIteration
+
+            rates = {arm: self.__get_growth_rates(arm) for arm in arms}
+
+            untried = [arm for arm in arms if len(rates[arm]) == 0]
+            if len(untried) > 0:
+                return self.__queues[untried[0]].popleft()
+
+            n_total = sum(len(r) for r in rates.values())
+            best_rate = max(sum(r) / len(r) for r in rates.values()) or 1
+
+            def ucb1(arm: Hashable) -> float:
+                n = len(rates[arm])
+                mean = sum(rates[arm]) / n / best_rate
+                return mean + self.exploration * math.sqrt(math.log(n_total) / n)
+
+            return self.__queues[max(arms, key=ucb1)].popleft()
+
+    def __get_growth_rates(self, arm: Hashable) -> list[float]:
+        return self.__growth_rates.get(arm, []) + [
+            progress.growth_rate
+            for item, progress in self.__running.items()
+            if self.__get_arm(item) == arm
+        ]
+
+    def started(self, item: _Item) -> None:
+        with self.__lock:
+            self.__running[item] = CoverageProgress(self.__get_plot_data_path(item))
+
+    def exited(self, item: _Item) -> None:
+        with self.__lock:
+            progress = self.__running.pop(item)
+            progress.poll()
+            self.__growth_rates.setdefault(self.__get_arm(item), []).append(
+                progress.growth_rate
+            )
+
+    def was_stopped(self, item: _Item) -> bool:
+        """whether the experiment was stopped because its coverage plateaued"""
+        return item in self.__stopped
+
+    def __monitor_loop(self) -> None:
+        while not self.__closed.wait(self.check_interval_secs):
+            with self.__lock:
+                plateaued: list[tuple[_Item, CoverageProgress]] = []
+                for item, progress in self.__running.items():
+                    progress.poll()
+                    if item not in self.__stopped and progress.is_plateaued(
+                        self.plateau_window_secs
+                    ):
+                        self.__stopped.add(item)
+                        plateaued.append((item, progress))
+
+            for item, progress in plateaued:
+                cvg = "unknown" if progress.cvg is None else f"{progress.cvg:.3%}"
+                logging.info(
+                    f"Coverage in {progress.plot_data_path} has not grown for {self.plateau_window_secs}s"
+                    f" (shw_cvg {cvg}), stopping the experiment."
+                )
+                self.__stop(item)
+
+    def close(self) -> None:
+        self.__closed.set()
+        if self.__monitor.is_alive():
+            self.__monitor.join()
+
+    def __enter__(self) -> "AdaptiveScheduler[_Item]":
+        self.__monitor.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -0,0 +1,200 @@
+import logging
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+SYS_CPU_DIR = Path("/sys/devices/system/cpu")
+
+
+class PhysicalCore(NamedTuple):
+    node: int
+    """NUMA node of the core"""
+
+    package: int
+
+    cpus: tuple[int, ...]
+    """the logical CPUs (SMT siblings) of the core that this process may run on"""
+
+
+def parse_cpu_list(s: str) -> list[int]:
+    """parse a kernel CPU list, e.g. `0-3,8,10-11`"""
+    cpus: list[int] = []
+    for part in s.strip().split(","):
+        if part == "":
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def __read_cpu_node(cpu_dir: Path) -> int:
+    for entry in cpu_dir.glob("node[0-9]*"):
+        return int(entry.name.removeprefix("node"))
+    return 0
+
+
+def read_cpu_topology(sys_cpu_dir: Path = SYS_CPU_DIR) -> list[PhysicalCore]:
+    """
+    The physical cores this process may run on (see `os.sched_getaffinity`), read from `sys_cpu_dir`,
+    ordered by NUMA node, package and first logical CPU.
+    Without topology information, every logical CPU is taken to be a core of its own on node 0.
+    """
+    usable_cpus = os.sched_getaffinity(0)
+
+    try:
+        online_cpus = parse_cpu_list(sys_cpu_dir.joinpath("online").read_text())
+    except OSError:
+        logging.warning(
+            f"Cannot read CPU topology from {sys_cpu_dir}, assuming no SMT and a single NUMA node."
+        )
+        return [PhysicalCore(0, 0, (cpu,)) for cpu in sorted(usable_cpus)]
+
+    cores: dict[tuple[int, int, int], list[int]] = {}
+    for cpu in online_cpus:
+        if cpu not in usable_cpus:
+            continue
+
+        cpu_dir = sys_cpu_dir.joinpath(f"cpu{cpu}")
+        try:
+            package = int(cpu_dir.joinpath("topology/physical_package_id").read_text())
+            core_id = int(cpu_dir.joinpath("topology/core_id").read_text())
+        except (OSError, ValueError):
+            # unknown core, don't pair it with any other CPU
+            package, core_id = 0, -1 - cpu
+
+        cores.setdefault((__read_cpu_node(cpu_dir), package, core_id), []).append(cpu)
+
+    return sorted(
+        (
+            PhysicalCore(node, package, tuple(sorted(cpus)))
+            for (node, package, _), cpus in cores.items()
+        ),
+        key=lambda core: (core.node, core.package, core.cpus),
+    )
+
+
+class CoreAllocator:
+    """
+    Hands out CPUs to concurrent jobs (e.g. fuzzing experiments) so that no two jobs share a logical CPU,
+    jobs have to `release` their CPUs when they exit.
+
+    With `whole_cores`, a job gets all SMT siblings of a physical core, otherwise a single logical CPU,
+    taken from the physical core with the fewest busy siblings, so siblings are only shared once every core is busy.
+    Ties are broken towards the NUMA node with the most free CPUs, to spread memory traffic over nodes,
+    but the processes of one job are kept on a single node when possible (see `allocate`).
+    With `numa_nodes`, only cores of these nodes are used.
+    """
+
+    cores: list[PhysicalCore]
+
+    whole_cores: bool
+
+    def __init__(
+        self,
+        cores: Optional[list[PhysicalCore]] = None,
+        whole_cores: bool = False,
+        numa_nodes: Optional[list[int]] = None,
+    ) -> None:
+        if cores is None:
+            cores = read_cpu_topology()
+        if numa_nodes is not None:
+            cores = [core for core in cores if core.node in numa_nodes]
+
+        self.cores = cores
+        self.whole_cores = whole_cores
+        self.__busy_cpus: set[int] = set()
+
+    @property
+    def capacity(self) -> int:
+        """number of jobs that can hold CPUs at the same time"""
+        if self.whole_cores:
+            return len(self.cores)
+        return sum(len(core.cpus) for core in self.cores)
+
+    def __n_free_cpus_per_node(self) -> dict[int, int]:
+        n_free: dict[int, int] = {}
+        for core in self.cores:
+            n_free[core.node] = n_free.get(core.node, 0) + sum(
+                cpu not in self.__busy_cpus for cpu in core.cpus
+            )
+        return n_free
+
+    def __choose_node(self, n: int) -> Optional[int]:
+        """
+        the NUMA node to place all `n` processes of a job on, or `None` if no node has room for them.
+        Prefers the node that can give the most of them a physical core of their own, then the one with the most free CPUs.
+        """
+        n_slots: dict[int, int] = {}
+        n_idle_cores: dict[int, int] = {}
+        n_free_per_node = self.__n_free_cpus_per_node()
+        for core in self.cores:
+            n_busy = sum(cpu in self.__busy_cpus for cpu in core.cpus)
+            n_idle_cores[core.node] = n_idle_cores.get(core.node, 0) + (n_busy == 0)
+            n_slots[core.node] = n_slots.get(core.node, 0) + (
+                n_busy == 0 if self.whole_cores else len(core.cpus) - n_busy
+            )
+
+        nodes = [node for node, n_free in n_slots.items() if n_free >= n]
+        if len(nodes) == 0:
+            return None
+        return min(
+            nodes,
+            key=lambda node: (-min(n_idle_cores[node], n), -n_free_per_node[node]),
+        )
+
+    def allocate(self, n: int = 1) -> Optional[tuple[int, ...]]:
+        """
+        the CPUs for a new job, or `None` if all are busy.
+        A job with `n` processes (e.g. parallel fuzzer instances) gets as many CPUs as `n` jobs, or none.
+        They are all taken from one NUMA node if any has room for them, so the processes share local memory,
+        and spread over nodes otherwise.
+        """
+        node = self.__choose_node(n)
+
+        allocations: list[tuple[int, ...]] = []
+        for _ in range(n):
+            cpus = self.__allocate_one(node)
+            if cpus is None:
+                for cpus in allocations:
+                    self.release(cpus)
+                return None
+            allocations.append(cpus)
+
+        return tuple(cpu for cpus in allocations for cpu in cpus)
+
+    def __allocate_one(self, node: Optional[int] = None) -> Optional[tuple[int, ...]]:
+        """a single allocation, from `node` if given"""
+        n_free_per_node = self.__n_free_cpus_per_node()
+        best_core: Optional[PhysicalCore] = None
+        best_key: Optional[tuple[int, int]] = None
+
+        for core in self.cores:
+            if node is not None and core.node != node:
+                continue
+
+            n_busy = sum(cpu in self.__busy_cpus for cpu in core.cpus)
+            if n_busy == len(core.cpus) or (self.whole_cores and n_busy > 0):
+                continue
+
+            key = (n_busy, -n_free_per_node[core.node])
+            if best_key is None or key < best_key:
+                best_core, best_key = core, key
+
+        if best_core is None:
+            return None
+
+        cpus = (
+            best_core.cpus
+            if self.whole_cores
+            else next((cpu,) for cpu in best_core.cpus if cpu not in self.__busy_cpus)
+        )
+        self.__busy_cpus.update(cpus)
+        return cpus
+
+    def release(self, cpus: tuple[int, ...]) -> None:
+        self.__busy_cpus.difference_update(cpus)
+
+
+def format_cpu_list(cpus: tuple[int, ...]) -> str:
+    """the CPU list syntax of `taskset -c` and Docker's `--cpuset-cpus`"""
+    return ",".join(str(cpu) for cpu in cpus)
@@ -0,0 +1,408 @@
+import os
+from pathlib import Path
+import sqlite3
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from lib.experiment import Experiment
+from lib.process_concurrency import ResourceUsage
+
+CRASH_DB_FILE_NAME = "crashes.sqlite3"
+
+TIMEOUT_BUCKET = "timeout"
+"""bucket of inputs that exceeded the CPU or wall-clock limit"""
+
+OOM_BUCKET = "oom"
+"""bucket of inputs that exceeded the memory limit"""
+
+LIMIT_BUCKETS = (TIMEOUT_BUCKET, OOM_BUCKET)
+"""buckets of inputs stopped by a resource limit, which are not counted as crashes"""
+
+IGNORED_BUCKET = "ignored"
+"""
+bucket of inputs left out of the results (e.g. crashes on an undefined external symbol),
+only recorded so resuming does not run them again
+"""
+
+# distinct crash fingerprints and inputs in each of the `LIMIT_BUCKETS`, of inputs `i` joined with their buckets `b`,
+# takes `_COUNT_CRASHES_AND_LIMIT_HITS_PARAMETERS`
+_COUNT_CRASHES_AND_LIMIT_HITS = """
+    COUNT(DISTINCT CASE WHEN b.type NOT IN (?, ?, ?) THEN b.fingerprint END),
+    COUNT(CASE WHEN b.type = ? THEN 1 END),
+    COUNT(CASE WHEN b.type = ? THEN 1 END)
+"""
+_COUNT_CRASHES_AND_LIMIT_HITS_PARAMETERS = (
+    *LIMIT_BUCKETS,
+    IGNORED_BUCKET,
+    *LIMIT_BUCKETS,
+)
+
+
+class ExperimentCrashCount(NamedTuple):
+    fuzzer: str
+    isel: str
+    target: str
+    replicate_id: int
+    n_unique_crashes: int
+    n_timeouts: int
+    n_ooms: int
+
+
+class TargetCrashCount(NamedTuple):
+    fuzzer: str
+    isel: str
+    target: str
+    n_unique_crashes: int
+    n_timeouts: int
+    n_ooms: int
+
+
+class ExperimentSummary(NamedTuple):
+    n_inputs: int
+    n_false_alarms: int
+    n_unique_crashes: int
+    """distinct crash fingerprints, without the `LIMIT_BUCKETS`"""
+
+    n_timeouts: int
+    """inputs in the `TIMEOUT_BUCKET`"""
+
+    n_ooms: int
+    """inputs in the `OOM_BUCKET`"""
+
+
+class InputResult(NamedTuple):
+    path: str
+    return_code: int
+    bucket: Optional[str]
+    """name of the bucket the input crashed into, `None` if it did not crash"""
+
+
+class CrashDatabase:
+    """
+    SQLite store of classified crashes, replacing the folder tree of symlinks and `.log` files.
+
+    - `experiments`: one row per classified directory, i.e. a replicate (fuzzer, isel, target, replicate id).
+    - `buckets`: one row per crash bucket, named like its folder in the tree
+      (`<type>/<subtype>/tracedepth_<n>__hash_0x<fingerprint>`), with the report of its first crash.
+    - `stack_frames`: the stack trace of each bucket.
+    - `inputs`: every input that was run, with the bucket it crashed into, or none for a false alarm,
+      and the resources it used, if it was measured.
+
+    Inputs stopped by a resource limit are in the `LIMIT_BUCKETS`, which are counted apart from unique crashes.
+    Inputs in the `IGNORED_BUCKET` are left out of all counts, results and the tree.
+
+    The tree can still be written with `export_tree`.
+
+    Results are committed every `COMMIT_INTERVAL` inputs and when closing, to a write-ahead log,
+    so an interrupted classification keeps what it recorded and can be resumed (see `has_input`).
+    """
+
+    COMMIT_INTERVAL = 1024
+    """number of new inputs after which they are committed to disk"""
+
+    path: Path
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.__n_uncommitted = 0
+        self.__bucket_ids: dict[str, int] = {}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__db = sqlite3.connect(path)
+        self.__db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+
+            CREATE TABLE IF NOT EXISTS experiments (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                fuzzer TEXT,
+                isel TEXT,
+                target TEXT,
+                replicate_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS experiments_fuzzer ON experiments (fuzzer);
+            CREATE INDEX IF NOT EXISTS experiments_target ON experiments (target);
+
+            CREATE TABLE IF NOT EXISTS buckets (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                fingerprint TEXT NOT NULL,
+                type TEXT NOT NULL,
+                subtype TEXT,
+                trace_depth INTEGER NOT NULL,
+                report TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS buckets_fingerprint ON buckets (fingerprint);
+
+            CREATE TABLE IF NOT EXISTS stack_frames (
+                bucket_id INTEGER NOT NULL REFERENCES buckets (id),
+                depth INTEGER NOT NULL,
+                function TEXT NOT NULL,
+                location TEXT NOT NULL,
+                PRIMARY KEY (bucket_id, depth)
+            );
+
+            CREATE TABLE IF NOT EXISTS inputs (
+                experiment_id INTEGER NOT NULL REFERENCES experiments (id),
+                path TEXT NOT NULL,
+                return_code INTEGER NOT NULL,
+                bucket_id INTEGER REFERENCES buckets (id),
+                max_rss_kb INTEGER,
+                cpu_time REAL,
+                wall_time REAL,
+                PRIMARY KEY (experiment_id, path)
+            );
+            CREATE INDEX IF NOT EXISTS inputs_bucket_id ON inputs (bucket_id);
+            """)
+
+    def add_experiment(
+        self, path: Path | str, experiment: Optional[Experiment] = None
+    ) -> int:
+        """
+        Returns the id of the experiment classified into `path`, adding it if it is new.
+        `experiment` describes it, if it is a fuzzing replicate.
+        """
+        self.__db.execute(
+            "INSERT OR IGNORE INTO experiments (path, fuzzer, isel, target, replicate_id)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                str(path),
+                *(
+                    (None, None, None, None)
+                    if experiment is None
+                    else (
+                        experiment.fuzzer,
+                        experiment.isel,
+                        str(experiment.target),
+                        experiment.replicate_id,
+                    )
+                ),
+            ),
+        )
+        (experiment_id,) = self.__db.execute(
+            "SELECT id FROM experiments WHERE path = ?", (str(path),)
+        ).fetchone()
+        return experiment_id
+
+    def clear_experiment(self, experiment_id: int) -> None:
+        """forget all inputs of an experiment, before classifying it from scratch"""
+        self.__db.execute(
+            "DELETE FROM inputs WHERE experiment_id = ?", (experiment_id,)
+        )
+
+    def has_input(self, experiment_id: int, path: str) -> bool:
+        """whether the result of an input was recorded, e.g. before classification was interrupted"""
+        return (
+            self.__db.execute(
+                "SELECT 1 FROM inputs WHERE experiment_id = ? AND path = ?",
+                (experiment_id, path),
+            ).fetchone()
+            is not None
+        )
+
+    def add_bucket(
+        self,
+        name: str,
+        fingerprint: str,
+        type: str,
+        subtype: Optional[str],
+        report: str,
+        stack_frames: Iterable[tuple[str, str]],
+    ) -> int:
+        """returns the id of the bucket called `name`, adding it if it is new"""
+        if (bucket_id := self.__bucket_ids.get(name)) is not None:
+            return bucket_id
+
+        row = self.__db.execute(
+            "SELECT id FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+
+        if row is not None:
+            bucket_id = row[0]
+        else:
+            stack_frames = list(stack_frames)
+            cursor = self.__db.execute(
+                "INSERT INTO buckets (name, fingerprint, type, subtype, trace_depth, report)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (name, fingerprint, type, subtype, len(stack_frames), report),
+            )
+            bucket_id = cursor.lastrowid
+            assert bucket_id is not None
+            self.__db.executemany(
+                "INSERT INTO stack_frames VALUES (?, ?, ?, ?)",
+                (
+                    (bucket_id, depth, function, location)
+                    for depth, (function, location) in enumerate(stack_frames)
+                ),
+            )
+
+        self.__bucket_ids[name] = bucket_id
+        return bucket_id
+
+    def add_input(
+        self,
+        experiment_id: int,
+        path: str,
+        return_code: int,
+        bucket_id: Optional[int],
+        usage: Optional[ResourceUsage] = None,
+    ) -> None:
+        """`bucket_id` is `None` for inputs that did not crash"""
+        self.__db.execute(
+            "INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                experiment_id,
+                path,
+                return_code,
+                bucket_id,
+                *(
+                    (None, None, None)
+                    if usage is None
+                    else (usage.max_rss_kb, usage.cpu_time, usage.wall_time)
+                ),
+            ),
+        )
+
+        self.__n_uncommitted += 1
+        if self.__n_uncommitted >= CrashDatabase.COMMIT_INTERVAL:
+            self.commit()
+
+    def get_experiment_summary(self, experiment_id: int) -> ExperimentSummary:
+        (row,) = self.__db.execute(
+            f"""
+            SELECT COUNT(*), COUNT(*) - COUNT(i.bucket_id), {_COUNT_CRASHES_AND_LIMIT_HITS}
+            FROM inputs i LEFT JOIN buckets b ON b.id = i.bucket_id
+            WHERE i.experiment_id = ? AND b.type IS NOT ?
+            """,
+            (*_COUNT_CRASHES_AND_LIMIT_HITS_PARAMETERS, experiment_id, IGNORED_BUCKET),
+        )
+        return ExperimentSummary(*row)
+
+    def get_input_results(self, experiment_path: Path | str) -> Iterator[InputResult]:
+        """the result of every input of the experiment classified into `experiment_path`"""
+        for row in self.__db.execute(
+            """
+            SELECT i.path, i.return_code, b.name
+            FROM experiments e
+            JOIN inputs i ON i.experiment_id = e.id
+            LEFT JOIN buckets b ON b.id = i.bucket_id
+            WHERE e.path = ? AND b.type IS NOT ?
+            """,
+            (str(experiment_path), IGNORED_BUCKET),
+        ):
+            yield InputResult(*row)
+
+    def count_unique_crashes_per_experiment(self) -> Iterator[ExperimentCrashCount]:
+        """number of distinct crash fingerprints of every experiment, and of its inputs that hit a limit"""
+        for row in self.__db.execute(
+            f"""
+            SELECT e.fuzzer, e.isel, e.target, e.replicate_id, {_COUNT_CRASHES_AND_LIMIT_HITS}
+            FROM experiments e
+            LEFT JOIN inputs i ON i.experiment_id = e.id
+            LEFT JOIN buckets b ON b.id = i.bucket_id
+            GROUP BY e.id
+            ORDER BY e.fuzzer, e.isel, e.target, e.replicate_id
+            """,
+            _COUNT_CRASHES_AND_LIMIT_HITS_PARAMETERS,
+        ):
+            yield ExperimentCrashCount(*row)
+
+    def count_unique_crashes_per_target(self) -> Iterator[TargetCrashCount]:
+        """
+        number of distinct crashes (trace depth and fingerprint) over all replicates of a target,
+        and of the inputs of its replicates that hit a limit
+        """
+        for row in self.__db.execute(
+            """
+            SELECT
+                e.fuzzer, e.isel, e.target,
+                COUNT(DISTINCT CASE WHEN b.type NOT IN (?, ?, ?) THEN b.trace_depth || ':' || b.fingerprint END),
+                COUNT(CASE WHEN b.type = ? THEN 1 END),
+                COUNT(CASE WHEN b.type = ? THEN 1 END)
+            FROM experiments e
+            LEFT JOIN inputs i ON i.experiment_id = e.id
+            LEFT JOIN buckets b ON b.id = i.bucket_id
+            GROUP BY e.fuzzer, e.isel, e.target
+            ORDER BY e.fuzzer, e.isel, e.target
+            """,
+            _COUNT_CRASHES_AND_LIMIT_HITS_PARAMETERS,
+        ):
+            yield TargetCrashCount(*row)
+
+    def export_tree(
+        self,
+        experiment_path: Optional[Path | str] = None,
+        create_symlink_to_source: bool = True,
+    ) -> None:
+        """
+        Write the classic folder tree into the directory of every experiment (or only `experiment_path`):
+        a folder with a `.log` report per bucket, symlinks to its inputs,
+        `false_positives.txt` and `unique_crashes`.
+        Existing reports and symlinks are kept, so a tree can be updated after incremental classification.
+        """
+        self.commit()
+
+        experiments = (
+            self.__db.execute("SELECT id, path FROM experiments")
+            if experiment_path is None
+            else self.__db.execute(
+                "SELECT id, path FROM experiments WHERE path = ?",
+                (str(experiment_path),),
+            )
+        ).fetchall()
+
+        for experiment_id, experiment_path in experiments:
+            Path(experiment_path).mkdir(parents=True, exist_ok=True)
+            false_alarms: list[str] = []
+            fingerprints: set[str] = set()
+
+            for input_path, name, type, fingerprint, report in self.__db.execute(
+                """
+                SELECT i.path, b.name, b.type, b.fingerprint, b.report
+                FROM inputs i LEFT JOIN buckets b ON b.id = i.bucket_id
+                WHERE i.experiment_id = ? AND b.type IS NOT ?
+                ORDER BY i.path
+                """,
+                (experiment_id, IGNORED_BUCKET),
+            ):
+                if name is None:
+                    false_alarms.append(input_path)
+                    continue
+
+                if type not in LIMIT_BUCKETS:
+                    fingerprints.add(fingerprint)
+                folder_path = os.path.join(experiment_path, name)
+                Path(folder_path).mkdir(parents=True, exist_ok=True)
+
+                report_path = folder_path + ".log"
+                if not os.path.exists(report_path):
+                    with open(report_path, "w+") as report_file:
+                        print(report, file=report_file)
+
+                symlink_path = os.path.join(
+                    folder_path, os.path.basename(input_path) + ".bc"
+                )
+                if create_symlink_to_source and not os.path.lexists(symlink_path):
+                    os.symlink(input_path, symlink_path)
+
+            with open(
+                os.path.join(experiment_path, "false_positives.txt"), "w"
+            ) as file:
+                file.writelines(line + "\n" for line in false_alarms)
+
+            with open(os.path.join(experiment_path, "unique_crashes"), "w+") as file:
+                file.write(str(len(fingerprints)))
+
+    def commit(self) -> None:
+        self.__db.commit()
+        self.__n_uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.__db.close()
+
+    def __enter__(self) -> "CrashDatabase":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -3,10 +3,14 @@ from typing import Iterable, NamedTuple, Optional
 
 import pandas as pd
 from lib.fs import subdirs_of
-from lib.plot_data import read_plot_data
+from lib.fuzzer_stats import aggregate_fuzzer_stats, read_fuzzer_stats
+from lib.plot_data import aggregate_plot_data, read_plot_data
 
 from lib.target import Target
 
+MAIN_INSTANCE_NAME = "default"
+"""output directory of the only AFL++ instance of an experiment, or of the main (`-M`) one of parallel instances"""
+
 
 class Experiment(NamedTuple):
     path: Path
@@ -21,15 +25,26 @@ class Experiment(NamedTuple):
 
     @property
     def plot_data_path(self) -> Path:
-        return self.path.joinpath("default", "plot_data")
+        return self.path.joinpath(MAIN_INSTANCE_NAME, "plot_data")
 
     @property
     def fuzzer_stats_path(self) -> Path:
-        return self.path.joinpath("default", "fuzzer_stats")
+        return self.path.joinpath(MAIN_INSTANCE_NAME, "fuzzer_stats")
     
     @property
     def cur_input_path(self) -> Path:
-        return self.path.joinpath("default", ".cur_input")
+        return self.path.joinpath(MAIN_INSTANCE_NAME, ".cur_input")
+
+    @property
+    def instance_paths(self) -> list[Path]:
+        """output directories of the AFL++ instances of the experiment, the main one first"""
+        secondaries = sorted(
+            Path(dir.path)
+            for dir in subdirs_of(self.path)
+            if dir.name != MAIN_INSTANCE_NAME
+            and Path(dir.path, "fuzzer_stats").exists()
+        )
+        return [self.path.joinpath(MAIN_INSTANCE_NAME), *secondaries]
     
     @property
     def run_time(self) -> int:
@@ -37,18 +52,32 @@ class Experiment(NamedTuple):
         return -1 if s is None else int(s)
 
     def __getitem__(self, key: str) -> Optional[str]:
+        """a stat of `fuzzer_stats`, aggregated over parallel instances"""
         if not self.fuzzer_stats_path.exists():
             return None
 
-        with open(self.fuzzer_stats_path) as f:
-            for line in f:
-                if line.startswith(key):
-                    return line.split(" : ")[1]
-        
-        return None
+        return self.read_fuzzer_stats().get(key)
+
+    def read_fuzzer_stats(self) -> dict[str, str]:
+        """`fuzzer_stats` of the experiment, aggregated over parallel instances"""
+        return aggregate_fuzzer_stats(
+            [
+                read_fuzzer_stats(path.joinpath("fuzzer_stats"))
+                for i, path in enumerate(self.instance_paths)
+                # secondaries may not have written it yet
+                if i == 0 or path.joinpath("fuzzer_stats").exists()
+            ]
+        )
 
     def read_plot_data(self) -> pd.DataFrame:
-        return read_plot_data(self.plot_data_path)
+        """`plot_data` of the experiment, aggregated over parallel instances"""
+        return aggregate_plot_data(
+            [
+                read_plot_data(path.joinpath("plot_data"))
+                for i, path in enumerate(self.instance_paths)
+                if i == 0 or path.joinpath("plot_data").exists()
+            ]
+        )
 
 
 def get_all_experiments(root_dir: Path | str) -> Iterable[Experiment]:
@@ -1,3 +1,4 @@
+import hashlib
 import os
 from pathlib import Path
 from typing import Iterator
@@ -12,3 +13,16 @@ def count_files(dir: Path) -> int:
     count number of file in the specified directory (not including sub-directories)
     """
     return len(next(os.walk(dir))[2])
+
+
+def get_content_hash(path: Path | str) -> str:
+    """
+    blake2b digest of the content of a file, used to recognize the same input under different names
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 16):
+            digest.update(chunk)
+
+    return digest.hexdigest()
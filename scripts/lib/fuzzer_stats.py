@@ -0,0 +1,75 @@
+from pathlib import Path
+
+# how the stats of parallel AFL++ instances of an experiment are combined,
+# others are taken from the main instance
+SUMMED_STATS = {
+    "execs_done",
+    "execs_per_sec",
+    "corpus_count",
+    "corpus_found",
+    "corpus_imported",
+    "pending_favs",
+    "pending_total",
+    "saved_crashes",
+    "saved_hangs",
+}
+MAX_STATS = {
+    "run_time",
+    "cycles_done",
+    "last_update",
+    "last_find",
+    "last_crash",
+    "last_hang",
+    "bitmap_cvg",
+    "edges_found",
+    "max_depth",
+}
+
+
+def read_fuzzer_stats(file_path: Path) -> dict[str, str]:
+    """the `key : value` pairs of an AFL++ `fuzzer_stats` file"""
+    stats: dict[str, str] = {}
+    with open(file_path) as f:
+        for line in f:
+            key, sep, value = line.partition(":")
+            if sep != "":
+                stats[key.strip()] = value.strip()
+    return stats
+
+
+def __parse_number(s: str) -> int | float:
+    s = s.removesuffix("%")
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+def __format_number(key: str, n: int | float) -> str:
+    s = str(n) if isinstance(n, int) else f"{n:.2f}"
+    return s + "%" if key == "bitmap_cvg" else s
+
+
+def aggregate_fuzzer_stats(instance_stats: list[dict[str, str]]) -> dict[str, str]:
+    """
+    Combine the stats of the parallel instances of an experiment, the main instance first:
+    counters are summed, times and coverage take the maximum over instances.
+    Coverage of the union of instances is not known from the stats, so the maximum is a lower bound.
+    """
+    if len(instance_stats) == 1:
+        return instance_stats[0]
+
+    aggregated = dict(instance_stats[0])
+    for key in SUMMED_STATS | MAX_STATS:
+        try:
+            values = [
+                __parse_number(stats[key]) for stats in instance_stats if key in stats
+            ]
+        except ValueError:
+            continue
+        if len(values) > 0:
+            aggregated[key] = __format_number(
+                key, sum(values) if key in SUMMED_STATS else max(values)
+            )
+
+    return aggregated
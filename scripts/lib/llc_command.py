@@ -10,6 +10,18 @@ from lib.target import Target
 class LLCCommand(NamedTuple):
     target: Target
     global_isel: bool
+    opt_level: Optional[int] = None
+    """`-O<n>`, llc's default if not set"""
+
+    @property
+    def isel(self) -> str:
+        return "gisel" if self.global_isel else "dagisel"
+
+    @property
+    def name(self) -> str:
+        """`<isel>[-O<n>]/<target>`, the path of its results when classifying with several commands"""
+        isel = self.isel if self.opt_level is None else f"{self.isel}-O{self.opt_level}"
+        return f"{isel}/{self.target}"
 
     def get_options(self, output: Optional[str | Path] = None) -> Iterable[str]:
         yield f"-mtriple={self.target.triple}"
@@ -18,11 +30,15 @@ class LLCCommand(NamedTuple):
             yield f"-mcpu={self.target.cpu}"
 
         if len(self.target.attrs) > 0:
-            yield f"-mattr={','.join(self.target.attrs)}"
+            # sorted, as the order of a set changes with the hash seed of each run
+            yield f"-mattr={','.join(sorted(self.target.attrs))}"
 
         if self.global_isel:
             yield "-global-isel"
 
+        if self.opt_level is not None:
+            yield f"-O{self.opt_level}"
+
         if output:
             yield f"-o"
             yield str(output)
@@ -56,6 +72,7 @@ class LLCCommand(NamedTuple):
                 attrs=cls.__get_attrs_from_command(command),
             ),
             global_isel=re.match(r".*-global-isel", command) is not None,
+            opt_level=cls.__get_opt_level_from_command(command),
         )
 
     @staticmethod
@@ -75,6 +92,13 @@ class LLCCommand(NamedTuple):
         else:
             return None
 
+    @staticmethod
+    def __get_opt_level_from_command(command: str) -> Optional[int]:
+        if (match := re.match(r".* -O=?([0-3])\b", command)) is not None:
+            return int(match.group(1))
+        else:
+            return None
+
     @staticmethod
     def __get_attrs_from_command(command: str) -> Iterable[str]:
         return (
@@ -82,3 +106,18 @@ class LLCCommand(NamedTuple):
             for arg_val in re.findall(r"-mattr[= ]\"?([A-Za-z0-9,\+-]+)", command)
             for attr in arg_val.split(",")
         )
+
+
+def get_command_key(command: Iterable[str | Path]) -> str:
+    """
+    A command line as a cache key: its arguments joined, with the attributes of every `-mattr=` sorted,
+    so the same command run by another process (hashing attribute sets differently) gets the same key.
+    """
+    return " ".join(
+        (
+            "-mattr=" + ",".join(sorted(str(arg).removeprefix("-mattr=").split(",")))
+            if str(arg).startswith("-mattr=")
+            else str(arg)
+        )
+        for arg in command
+    )
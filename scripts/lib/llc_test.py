@@ -1,14 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
 from pathlib import Path
 import re
+import sqlite3
 import subprocess
-from typing import Callable, Iterable, Optional
-from lib import LLVM, LLVM_AS
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+from lib import LLVM, LLVM_AS, LLVM_BIN_PATH
 
 from lib.llc_command import LLCCommand
+from lib.process_concurrency import MAX_SUBPROCESSES
+from lib.target import Target
 from lib.triple import Triple
 
+LLC_TESTS_DIR = Path(LLVM, "llvm/test/CodeGen")
+
+LLC_TEST_INDEX_PATH = Path(LLVM_BIN_PATH.parent, "llc_test_index.sqlite3")
+
+# patterns used on every line of a test, compiled once
+_NOTE_LINE = re.compile(r".*;.+NOTE:(.+)")
+_RUN_LINE = re.compile(r".*;.*RUN:(.+)")
+_TRIPLE_LINE = re.compile(r'target triple ?= ?"([a-z0-9_\.-]+)"')
+
 
 class LLCTest:
+    """
+    The header of an LLC test: its RUN commands and default triple.
+    The file is streamed once when parsing, its code is only read again through `code_lines`.
+    """
+
+    __slots__ = (
+        "path",
+        "backend",
+        "test_commands",
+        "runnable_llc_commands",
+        "default_triple",
+    )
+
     path: Path
 
     backend: str
@@ -21,7 +48,8 @@ class LLCTest:
     without going through `opt`, `sed`, etc. first.
     """
 
-    code_lines: list[str]
+    default_triple: Optional[Triple]
+    """the `target triple` in the code, if any"""
 
     def __init__(self, backend: str, file_path: Path) -> None:
         assert file_path.name.endswith(".ll")
@@ -29,15 +57,16 @@ class LLCTest:
         self.backend = backend
         self.path = file_path
         self.test_commands = []
-        self.code_lines = []
+        has_code = False
+        lines_with_triple: list[str] = []
 
         with open(file_path) as file:
             multiline_command = False  # whether last RUN header ends with '\'
             while line := file.readline():
-                if re.match(r".*;.+NOTE:(.+)", line):
+                if _NOTE_LINE.match(line):
                     continue
 
-                match = re.match(r".*;.*RUN:(.+)", line)
+                match = _RUN_LINE.match(line)
 
                 if match is not None:
                     command = match.group(1).strip()
@@ -55,22 +84,23 @@ class LLCTest:
                     assert (
                         not multiline_command
                     ), f"ERROR: something unexpected happened when parsing commands for {file_path}"
-                    self.code_lines.append(line)
+                    has_code = True
+
+                    if line.startswith("target triple"):
+                        lines_with_triple.append(line)
 
         assert (
             len(self.test_commands) > 0
         ), f"WARNING: {file_path} does not contain any test command."
 
-        assert (
-            len(self.code_lines) > 0
-        ), f"WARNING: {file_path} does not contain any test code."
+        assert has_code, f"WARNING: {file_path} does not contain any test code."
 
         llc_commands = [cmd for cmd in self.test_commands if "llc " in cmd]
         assert (
             len(llc_commands) > 0
         ), f"WARNING: {file_path} does not contain any `llc` command."
 
-        default_triple = self.get_default_triple()
+        self.default_triple = self.__parse_default_triple(lines_with_triple)
         runnable_llc_commands_raw = filter(
             lambda cmd: cmd.startswith("llc"),
             (cmd.split("|")[0] for cmd in llc_commands),
@@ -78,7 +108,7 @@ class LLCTest:
 
         try:
             self.runnable_llc_commands = [
-                LLCCommand.parse(cmd, default_triple)
+                LLCCommand.parse(cmd, self.default_triple)
                 for cmd in runnable_llc_commands_raw
             ]
         except Exception as e:
@@ -90,11 +120,35 @@ class LLCTest:
             len(self.runnable_llc_commands) > 0
         ), f"WARNING: {file_path} does not contain any runnable `llc` command."
 
-    def get_default_triple(self) -> Optional[Triple]:
-        lines_with_triple = [
-            line for line in self.code_lines if line.startswith("target triple")
-        ]
+    @classmethod
+    def from_index(
+        cls,
+        backend: str,
+        file_path: Path,
+        test_commands: list[str],
+        runnable_llc_commands: list[LLCCommand],
+        default_triple: Optional[Triple],
+    ) -> "LLCTest":
+        """a test restored from `LLCTestIndex` without reading its file"""
+        test = cls.__new__(cls)
+        test.backend = backend
+        test.path = file_path
+        test.test_commands = test_commands
+        test.runnable_llc_commands = runnable_llc_commands
+        test.default_triple = default_triple
+        return test
+
+    @property
+    def code_lines(self) -> list[str]:
+        """the lines of the test that are not RUN or NOTE lines, read from its file on every access"""
+        with open(self.path) as file:
+            return [
+                line
+                for line in file
+                if not _NOTE_LINE.match(line) and not _RUN_LINE.match(line)
+            ]
 
+    def __parse_default_triple(self, lines_with_triple: list[str]) -> Optional[Triple]:
         if len(lines_with_triple) == 0:
             return None
 
@@ -102,15 +156,31 @@ class LLCTest:
             len(lines_with_triple) == 1
         ), f"UNEXPECTED: {self.path} has more than one triple specified in code"
 
-        match = re.match(r'target triple ?= ?"([a-z0-9_\.-]+)"', lines_with_triple[0])
+        match = _TRIPLE_LINE.match(lines_with_triple[0])
         assert (
             match is not None
         ), f"UNEXPECTED: failed to extract triple from '{lines_with_triple[0]}'"
 
         return Triple.parse(match.group(1))
 
+    @property
+    def seed_name(self) -> str:
+        """
+        file name of the test as a seed, unique among all tests:
+        its path relative to `LLC_TESTS_DIR` (e.g. `X86/GlobalISel/add.ll` becomes `X86__GlobalISel__add.ll`),
+        as tests of different backends or subdirectories may have the same name
+        """
+        try:
+            relative_path = self.path.relative_to(LLC_TESTS_DIR)
+        except ValueError:
+            relative_path = Path(self.backend, self.path.name)
+        return "__".join(relative_path.parts)
+
+    def get_bc_path(self, out_dir: Path) -> Path:
+        return out_dir.joinpath(self.seed_name.removesuffix(".ll") + ".bc")
+
     def dump_bc(self, out_dir: Path) -> Path:
-        out_path = out_dir.joinpath(self.path.name.removesuffix(".ll") + ".bc")
+        out_path = self.get_bc_path(out_dir)
 
         process = subprocess.run(
             [
@@ -127,14 +197,237 @@ class LLCTest:
         return out_path
 
 
+class _IndexEntry(NamedTuple):
+    test_commands: list[str]
+    default_triple: Optional[str]
+    runnable_llc_commands: list[tuple[str, Optional[str], str, bool, Optional[int]]]
+    """triple, cpu, attrs, global isel and opt level of each command"""
+
+    error: Optional[str]
+    """why the test could not be parsed, if it could not"""
+
+
+def _parse_for_index(backend: str, file_path: Path) -> _IndexEntry:
+    try:
+        test = LLCTest(backend, file_path)
+    except Exception as e:
+        error = str(e) if e.__cause__ is None else f"{e} {e.__cause__}"
+        return _IndexEntry([], None, [], error)
+
+    return _IndexEntry(
+        test.test_commands,
+        None if test.default_triple is None else str(test.default_triple),
+        [
+            (
+                str(cmd.target.triple),
+                cmd.target.cpu,
+                ",".join(sorted(cmd.target.attrs)),
+                cmd.global_isel,
+                cmd.opt_level,
+            )
+            for cmd in test.runnable_llc_commands
+        ],
+        None,
+    )
+
+
+class LLCTestIndex:
+    """
+    On-disk index of the parsed LLC tests in `LLC_TESTS_DIR`, so they are not parsed again for every target.
+    An entry is parsed again when the size or modification time of its file changes,
+    stale entries are parsed on a process pool.
+    """
+
+    SCHEMA_VERSION = 2
+    """bumped whenever what is stored changes, an index of another version is rebuilt"""
+
+    path: Path
+
+    def __init__(self, path: Path = LLC_TEST_INDEX_PATH) -> None:
+        self.path = path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # several campaigns may update the index at the same time
+        self.__db = sqlite3.connect(path, timeout=60)
+        self.__db.execute("PRAGMA journal_mode = WAL")
+
+        (version,) = self.__db.execute("PRAGMA user_version").fetchone()
+        if version != LLCTestIndex.SCHEMA_VERSION:
+            self.__db.executescript(f"""
+                DROP TABLE IF EXISTS tests;
+                PRAGMA user_version = {LLCTestIndex.SCHEMA_VERSION};
+                """)
+
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS tests (
+                path TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                test_commands TEXT NOT NULL,
+                default_triple TEXT,
+                runnable_llc_commands TEXT NOT NULL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS tests_backend ON tests (backend);
+            """)
+
+    def update(self, backend_filter: Callable[[str], bool] = lambda _: True) -> None:
+        """
+        parse new and changed tests of the backends passing `backend_filter`, and forget deleted ones,
+        as well as all tests of backends that are no longer in `LLC_TESTS_DIR`
+        """
+        backend_dirs = [path for path in LLC_TESTS_DIR.iterdir() if path.is_dir()]
+        self.__db.execute(
+            f"DELETE FROM tests WHERE backend NOT IN ({', '.join('?' for _ in backend_dirs)})",
+            [backend_dir.name for backend_dir in backend_dirs],
+        )
+
+        for backend_dir in backend_dirs:
+            if not backend_filter(backend_dir.name):
+                continue
+
+            backend = backend_dir.name
+            indexed = {
+                path: (mtime_ns, size)
+                for path, mtime_ns, size in self.__db.execute(
+                    "SELECT path, mtime_ns, size FROM tests WHERE backend = ?",
+                    (backend,),
+                )
+            }
+
+            stale: list[tuple[Path, int, int]] = []
+            for file_path in backend_dir.rglob("*.ll"):
+                stat = file_path.stat()
+                key = (stat.st_mtime_ns, stat.st_size)
+                if indexed.pop(str(file_path), None) != key:
+                    stale.append((file_path, *key))
+
+            self.__db.executemany(
+                "DELETE FROM tests WHERE path = ?", ((path,) for path in indexed)
+            )
+
+            if len(stale) > 0:
+                with ProcessPoolExecutor(max_workers=MAX_SUBPROCESSES) as executor:
+                    entries = executor.map(
+                        _parse_for_index,
+                        (backend for _ in stale),
+                        (file_path for file_path, _, _ in stale),
+                        chunksize=64,
+                    )
+
+                    self.__db.executemany(
+                        "INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (
+                                str(file_path),
+                                backend,
+                                mtime_ns,
+                                size,
+                                json.dumps(entry.test_commands),
+                                entry.default_triple,
+                                json.dumps(entry.runnable_llc_commands),
+                                entry.error,
+                            )
+                            for (file_path, mtime_ns, size), entry in zip(
+                                stale, entries
+                            )
+                        ),
+                    )
+
+            self.__db.commit()
+
+    def get_tests(
+        self,
+        backend_filter: Callable[[str], bool] = lambda _: True,
+        verbose: bool = False,
+    ) -> Iterator[LLCTest]:
+        """the indexed tests of the backends passing `backend_filter`, call `update` first"""
+        total = 0
+        success = 0
+
+        backends = [
+            backend
+            for (backend,) in self.__db.execute("SELECT DISTINCT backend FROM tests")
+            if backend_filter(backend)
+        ]
+        rows = self.__db.execute(
+            "SELECT path, backend, test_commands, default_triple, runnable_llc_commands, error"
+            f" FROM tests WHERE backend IN ({', '.join('?' for _ in backends)})"
+            " ORDER BY backend, path",
+            backends,
+        ).fetchall()
+
+        for (
+            path,
+            backend,
+            test_commands,
+            default_triple,
+            runnable_llc_commands,
+            error,
+        ) in rows:
+            total += 1
+
+            if error is not None:
+                if verbose:
+                    print(error)
+                continue
+
+            yield LLCTest.from_index(
+                backend,
+                Path(path),
+                json.loads(test_commands),
+                [
+                    LLCCommand(
+                        target=Target(
+                            Triple.parse_normalized(triple), cpu, attrs or None
+                        ),
+                        global_isel=global_isel,
+                        opt_level=opt_level,
+                    )
+                    for triple, cpu, attrs, global_isel, opt_level in json.loads(
+                        runnable_llc_commands
+                    )
+                ],
+                (
+                    None
+                    if default_triple is None
+                    else Triple.parse_normalized(default_triple)
+                ),
+            )
+            success += 1
+
+        print(f"Successfully parsed {success}/{total} LLC tests.")
+
+    def close(self) -> None:
+        self.__db.close()
+
+    def __enter__(self) -> "LLCTestIndex":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
 def parse_llc_tests(
     backend_filter: Callable[[str], bool] = lambda _: True,
     verbose: bool = False,
+    use_index: bool = True,
 ) -> Iterable[LLCTest]:
+    """
+    All LLC tests in `LLC_TESTS_DIR` of the backends passing `backend_filter`.
+    With `use_index`, they come from the `LLCTestIndex`, which is updated first.
+    """
+    if use_index:
+        with LLCTestIndex() as index:
+            index.update(backend_filter)
+            yield from index.get_tests(backend_filter, verbose)
+        return
+
     total = 0
     success = 0
 
-    for backend_dir in Path(LLVM, "llvm/test/CodeGen").iterdir():
+    for backend_dir in LLC_TESTS_DIR.iterdir():
         if not backend_dir.is_dir() or not backend_filter(backend_dir.name):
             continue
 
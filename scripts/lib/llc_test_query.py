@@ -0,0 +1,117 @@
+from collections import defaultdict
+from functools import cache
+from typing import Hashable, Iterable, Optional
+
+from lib.llc_command import LLCCommand
+from lib.llc_test import LLCTest, parse_llc_tests
+from lib.target import Target, TargetProp, get_target_prop_selector
+
+INDEXED_PROPS: tuple[TargetProp, ...] = (
+    "triple",
+    "arch",
+    "vendor",
+    "os",
+    "abi",
+    "cpu",
+    "attrs",
+)
+
+
+def get_target_prop_key(target: Target, prop: TargetProp) -> Hashable:
+    """the value of `prop` of `target`, to look up in an index"""
+    return get_target_prop_selector(prop)(target)
+
+
+class LLCTestCorpus:
+    """
+    Hash indexes over the runnable llc commands of a set of tests,
+    one per `TargetProp`, global isel and backend, mapping a value to the ids of the commands having it.
+    A query intersects the id sets of the values it asks for instead of checking every command.
+    """
+
+    tests: list[LLCTest]
+
+    def __init__(self, tests: Iterable[LLCTest]) -> None:
+        self.tests = list(tests)
+        self.__command_tests: list[int] = []
+        """index of the test of every command id"""
+
+        self.__prop_indexes: dict[TargetProp, defaultdict[Hashable, set[int]]] = {
+            prop: defaultdict(set) for prop in INDEXED_PROPS
+        }
+        self.__global_isel_index: defaultdict[bool, set[int]] = defaultdict(set)
+        self.__backend_index: defaultdict[str, set[int]] = defaultdict(set)
+
+        for test_id, test in enumerate(self.tests):
+            for cmd in test.runnable_llc_commands:
+                command_id = len(self.__command_tests)
+                self.__command_tests.append(test_id)
+
+                for prop, index in self.__prop_indexes.items():
+                    index[get_target_prop_key(cmd.target, prop)].add(command_id)
+                self.__global_isel_index[cmd.global_isel].add(command_id)
+                self.__backend_index[test.backend].add(command_id)
+
+    @property
+    def backends(self) -> list[str]:
+        return sorted(self.__backend_index.keys())
+
+    def query(
+        self,
+        props: dict[TargetProp, Hashable] = {},
+        global_isel: Optional[bool] = None,
+        backend: Optional[str] = None,
+    ) -> list[LLCTest]:
+        """
+        Tests with a runnable command whose target has the given `props` (as keyed by `get_target_prop_key`),
+        and that uses global isel if `global_isel` is set, or not if it is `False`, in corpus order.
+        """
+        id_sets: list[set[int]] = [
+            self.__prop_indexes[prop].get(value, set()) for prop, value in props.items()
+        ]
+        if global_isel is not None:
+            id_sets.append(self.__global_isel_index.get(global_isel, set()))
+        if backend is not None:
+            id_sets.append(self.__backend_index.get(backend, set()))
+
+        if len(id_sets) == 0:
+            return list(self.tests)
+
+        # start from the smallest set, so intersecting is cheap
+        id_sets.sort(key=len)
+        command_ids = id_sets[0].intersection(*id_sets[1:])
+
+        return [
+            self.tests[test_id]
+            for test_id in sorted(set(self.__command_tests[i] for i in command_ids))
+        ]
+
+    def find_tests_for(
+        self,
+        target: Target,
+        props_to_match: Iterable[TargetProp],
+        global_isel: Optional[bool] = None,
+    ) -> list[LLCTest]:
+        """
+        Tests runnable on `target`: those with a command whose target equals `target` in every prop of
+        `props_to_match`, like `create_target_filter` checks.
+        """
+        return self.query(
+            {prop: get_target_prop_key(target, prop) for prop in props_to_match},
+            global_isel=global_isel,
+            backend=target.backend,
+        )
+
+    def get_commands(self, backend: Optional[str] = None) -> list[LLCCommand]:
+        """every runnable command of the tests of `backend`, or of all tests"""
+        return [
+            cmd
+            for test in (self.tests if backend is None else self.query(backend=backend))
+            for cmd in test.runnable_llc_commands
+        ]
+
+
+@cache
+def load_llc_test_corpus(backend: str) -> LLCTestCorpus:
+    """the corpus of the LLC tests of `backend`, loaded once per process"""
+    return LLCTestCorpus(parse_llc_tests(backend_filter=lambda b: b == backend))
@@ -1,8 +1,46 @@
 from pathlib import Path
 import pandas as pd
 
+TIME_COLUMN = "# relative_time"
 
-def __convert_percentage_to_float(s: str) -> float:
+COLUMNS = [
+    TIME_COLUMN,
+    "cycles_done",
+    "cur_item",
+    "corpus_count",
+    "pending_total",
+    "pending_favs",
+    "bit_cvg",
+    "shw_cvg",
+    "saved_crashes",
+    "saved_hangs",
+    "max_depth",
+    "execs_per_sec",
+    "total_execs",
+    "edges_found",
+]
+
+# how the plot data of parallel AFL++ instances of an experiment is combined, see `aggregate_plot_data`
+SUMMED_COLUMNS = [
+    "corpus_count",
+    "pending_total",
+    "pending_favs",
+    "saved_crashes",
+    "saved_hangs",
+    "execs_per_sec",
+    "total_execs",
+]
+MAX_COLUMNS = [
+    "cycles_done",
+    "cur_item",
+    "bit_cvg",
+    "shw_cvg",
+    "max_depth",
+    "edges_found",
+]
+
+
+def convert_percentage_to_float(s: str) -> float:
     return float(s.strip("%")) / 100
 
 
@@ -14,24 +52,40 @@ def read_plot_data(file_path: Path) -> pd.DataFrame:
         index_col=False,
         header=None,
         skiprows=1,
-        names=[
-            "# relative_time",
-            "cycles_done",
-            "cur_item",
-            "corpus_count",
-            "pending_total",
-            "pending_favs",
-            "bit_cvg",
-            "shw_cvg",
-            "saved_crashes",
-            "saved_hangs",
-            "max_depth",
-            "execs_per_sec",
-            "total_execs",
-            "edges_found",
-        ],
+        names=COLUMNS,
         converters={
-            "bit_cvg": __convert_percentage_to_float,
-            "shw_cvg": __convert_percentage_to_float,
+            "bit_cvg": convert_percentage_to_float,
+            "shw_cvg": convert_percentage_to_float,
         },
     )
+
+
+def aggregate_plot_data(instance_dfs: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine the plot data of the parallel instances of an experiment into one timeline:
+    at every time any instance logged a row, the last row of each instance so far is taken,
+    counters are summed over instances and coverage takes the maximum
+    (a lower bound of the coverage of their union, which is not in the plot data).
+    """
+    if len(instance_dfs) == 1:
+        return instance_dfs[0]
+
+    times = sorted(set().union(*(df[TIME_COLUMN] for df in instance_dfs)))
+    aligned = [
+        df.drop_duplicates(TIME_COLUMN, keep="last")
+        .set_index(TIME_COLUMN)
+        .reindex(times, method="ffill")
+        for df in instance_dfs
+    ]
+
+    combined = pd.concat(aligned, keys=range(len(aligned)))
+    by_time = combined.groupby(level=1)
+    return pd.concat(
+        [
+            by_time[SUMMED_COLUMNS].sum(),
+            by_time[MAX_COLUMNS].max(),
+        ],
+        axis=1,
+    ).rename_axis(TIME_COLUMN).reset_index()[instance_dfs[0].columns].astype(
+        instance_dfs[0].dtypes
+    )
@@ -1,60 +1,567 @@
+import asyncio
+import json
 import logging
 import multiprocessing
 import os
+import resource
+import signal
 import subprocess
-from typing import Callable, Iterable, Optional, Tuple, TypeVar
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+from typing import (
+    IO,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Sized,
+    Tuple,
+    TypeVar,
+)
 
 from tqdm import tqdm
 
 
 MAX_SUBPROCESSES = max(multiprocessing.cpu_count() - 2, 1)
 
+# how often to poll for child exit when pidfd is unavailable (Linux < 5.3)
+EXIT_POLL_INTERVAL_SECS = 0.05
+
+# how long a timed-out or cancelled child gets to exit after SIGTERM before SIGKILL
+KILL_GRACE_PERIOD_SECS = 5.0
+
+# how long to keep reading pipes after the child exited, in case a grandchild still holds them open
+PIPE_DRAIN_TIMEOUT_SECS = 5.0
+
+PIPE_READ_CHUNK_SIZE = 64 * 1024
+
+# tmpfs, so pipe output spilled out of the heap still never hits a disk
+MEMORY_BACKED_TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
 __T = TypeVar("__T")
 __R = TypeVar("__R")
+_Item = TypeVar("_Item")
 
 
-def run_concurrent_subprocesses(
-    iter: Iterable[__T],
+class WorkQueue(Generic[_Item]):
+    """
+    A FIFO of pool inputs that can still be extended while the pool is running,
+    e.g. from `on_exit` to schedule follow-up jobs.
+    The pool only stops once the queue is empty and no job is running anymore.
+    """
+
+    def __init__(self, items: Iterable[_Item] = ()) -> None:
+        self.__items: deque[_Item] = deque(items)
+
+    def push(self, item: _Item) -> None:
+        self.__items.append(item)
+
+    def push_front(self, item: _Item) -> None:
+        """schedule `item` before all queued items"""
+        self.__items.appendleft(item)
+
+    def extend(self, items: Iterable[_Item]) -> None:
+        self.__items.extend(items)
+
+    def __iter__(self) -> Iterator[_Item]:
+        return self
+
+    def __next__(self) -> _Item:
+        if len(self.__items) == 0:
+            raise StopIteration
+        return self.__items.popleft()
+
+
+class ResourceUsage(NamedTuple):
+    max_rss_kb: int
+    """peak resident set size in KiB"""
+
+    user_time: float
+    """CPU time spent in user mode in seconds"""
+
+    system_time: float
+    """CPU time spent in kernel mode in seconds"""
+
+    wall_time: float
+    """seconds elapsed between the process being handed to the pool and its exit"""
+
+    @property
+    def cpu_time(self) -> float:
+        return self.user_time + self.system_time
+
+    @staticmethod
+    def from_rusage(
+        rusage: "resource.struct_rusage", wall_time: float
+    ) -> "ResourceUsage":
+        return ResourceUsage(
+            max_rss_kb=rusage.ru_maxrss,
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            wall_time=wall_time,
+        )
+
+
+class ResourceLimits(NamedTuple):
+    cpu_time: Optional[int] = None
+    """CPU seconds (`RLIMIT_CPU`), a process exceeding it gets SIGXCPU"""
+
+    wall_time: Optional[float] = None
+    """wall-clock seconds, enforced by the watchdog of the pool (its `timeout`)"""
+
+    address_space: Optional[int] = None
+    """bytes of virtual memory (`RLIMIT_AS`), allocations beyond it fail"""
+
+    def apply(self, pid: int = 0) -> None:
+        """
+        Set the rlimits of process `pid` (the current process by default), meant to run in the child as `preexec_fn`,
+        or from the parent with the pid of a child that has not started any work yet.
+        """
+        if self.cpu_time is not None:
+            # the hard limit kills processes that ignore SIGXCPU
+            resource.prlimit(
+                pid, resource.RLIMIT_CPU, (self.cpu_time, self.cpu_time + 1)
+            )
+
+        if self.address_space is not None:
+            resource.prlimit(
+                pid, resource.RLIMIT_AS, (self.address_space, self.address_space)
+            )
+
+    @property
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        """`apply` if there are rlimits to set, so `Popen` only runs a preexec hook when needed"""
+        if self.cpu_time is None and self.address_space is None:
+            return None
+        return self.apply
+
+
+class ProcessResult(NamedTuple):
+    process: subprocess.Popen
+
+    exit_code: Optional[int]
+    """exit code of the process, or `None` if it did not exit normally (e.g. killed by a signal)"""
+
+    stdout: Optional[bytes]
+    """everything the process wrote to stdout, if it was started with `stdout=subprocess.PIPE`"""
+
+    stderr: Optional[bytes]
+    """everything the process wrote to stderr, if it was started with `stderr=subprocess.PIPE`"""
+
+    timed_out: bool
+    """whether the process was killed for exceeding its wall-clock timeout"""
+
+    usage: ResourceUsage
+    """resources used by the process (and all of its descendants it waited for)"""
+
+
+def _signal_process(p: subprocess.Popen, sig: int) -> None:
+    """
+    Send `sig` to the process group of `p` if it leads one (e.g. `start_new_session=True`),
+    so that children of shell commands are signalled as well, or to `p` alone otherwise.
+    """
+    try:
+        if os.getpgid(p.pid) == p.pid:
+            os.killpg(p.pid, sig)
+        else:
+            os.kill(p.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _wait_for_exit(pid: int) -> Tuple[int, "resource.struct_rusage"]:
+    """
+    Wait for the child `pid` to exit without blocking the event loop and reap it.
+    Only `pid` is reaped, unlike `os.wait()`, so processes started elsewhere are left alone.
+    Returns the raw wait status and the resource usage of the child.
+    """
+    loop = asyncio.get_running_loop()
+
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    if pidfd is None:
+        while True:
+            reaped_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if reaped_pid != 0:
+                return status, rusage
+            await asyncio.sleep(EXIT_POLL_INTERVAL_SECS)
+
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage
+
+
+class _PipeBuffer:
+    """
+    Collects the output of one pipe.
+    Without `max_size` everything is kept in memory. Otherwise the output is bounded:
+    only the first and last `max_size / 2` bytes are kept, cut at line boundaries,
+    or, with `spill`, output beyond `max_size` is moved to a memory-backed temporary file.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, spill: bool = False) -> None:
+        self.max_size = max_size
+        self.n_bytes = 0
+
+        self.__head = bytearray()
+        self.__tail: deque[bytes] = deque()
+        self.__tail_size = 0
+        self.__spill_file = (
+            tempfile.SpooledTemporaryFile(max_size=max_size, dir=MEMORY_BACKED_TMP_DIR)
+            if max_size is not None and spill
+            else None
+        )
+
+    @property
+    def truncated(self) -> bool:
+        return (
+            self.__spill_file is None
+            and self.max_size is not None
+            and self.n_bytes > self.max_size
+        )
+
+    def write(self, chunk: bytes) -> None:
+        self.n_bytes += len(chunk)
+
+        if self.__spill_file is not None:
+            self.__spill_file.write(chunk)
+            return
+
+        if self.max_size is None:
+            self.__head += chunk
+            return
+
+        head_size = self.max_size // 2
+        if len(self.__head) < head_size:
+            n_head_bytes = head_size - len(self.__head)
+            self.__head += chunk[:n_head_bytes]
+            chunk = chunk[n_head_bytes:]
+
+        if len(chunk) == 0:
+            return
+
+        self.__tail.append(chunk)
+        self.__tail_size += len(chunk)
+
+        tail_size = self.max_size - head_size
+        while self.__tail_size - len(self.__tail[0]) >= tail_size:
+            self.__tail_size -= len(self.__tail.popleft())
+
+    def getvalue(self) -> bytes:
+        if self.__spill_file is not None:
+            self.__spill_file.seek(0)
+            return self.__spill_file.read()
+
+        tail = b"".join(self.__tail)
+
+        if not self.truncated:
+            return bytes(self.__head) + tail
+
+        # drop the partial lines around the gap
+        head_end = self.__head.rfind(b"\n") + 1
+        tail = tail[len(tail) - (self.max_size - len(self.__head)) :]
+        tail_start = tail.find(b"\n") + 1
+        return bytes(self.__head[: head_end or len(self.__head)]) + tail[tail_start:]
+
+    def close(self) -> None:
+        if self.__spill_file is not None:
+            self.__spill_file.close()
+
+
+async def _read_pipe(pipe: IO[bytes], buffer: _PipeBuffer) -> None:
+    """Drain `pipe` into `buffer` until EOF without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+
+    try:
+        while chunk := await reader.read(PIPE_READ_CHUNK_SIZE):
+            buffer.write(chunk)
+    finally:
+        transport.close()
+
+
+async def _run_process(
+    p: subprocess.Popen,
+    timeout: Optional[float],
+    max_pipe_buffer_size: Optional[int] = None,
+    spill_pipes: bool = False,
+) -> ProcessResult:
+    start_time = time.monotonic()
+
+    pipe_buffers = [
+        None if pipe is None else _PipeBuffer(max_pipe_buffer_size, spill_pipes)
+        for pipe in (p.stdout, p.stderr)
+    ]
+    pipe_readers = [
+        asyncio.ensure_future(_read_pipe(pipe, buffer))
+        for pipe, buffer in zip((p.stdout, p.stderr), pipe_buffers)
+        if pipe is not None and buffer is not None
+    ]
+    exit_waiter = asyncio.ensure_future(_wait_for_exit(p.pid))
+
+    timed_out = False
+
+    try:
+        status, rusage = await asyncio.wait_for(asyncio.shield(exit_waiter), timeout)
+    except asyncio.TimeoutError:
+        logging.debug(f"Child process {p.pid} timed out after {timeout}s, killing.")
+        timed_out = True
+        status, rusage = await _terminate(p, exit_waiter)
+    except asyncio.CancelledError:
+        await _terminate(p, exit_waiter)
+        for reader in pipe_readers:
+            reader.cancel()
+        for buffer in pipe_buffers:
+            if buffer is not None:
+                buffer.close()
+        raise
+
+    wall_time = time.monotonic() - start_time
+
+    # The child is reaped by us, let `Popen` know so it will not try to wait for it again.
+    p.returncode = os.waitstatus_to_exitcode(status)
+
+    exit_code: Optional[int] = None
+
+    if os.WIFEXITED(status):
+        exit_code = os.WEXITSTATUS(status)
+        logging.debug(f"Child process {p.pid} exited with code {exit_code}.")
+    else:
+        logging.debug(f"Child process {p.pid} exited abnormally.")
+
+    if len(pipe_readers) > 0:
+        _, pending = await asyncio.wait(pipe_readers, timeout=PIPE_DRAIN_TIMEOUT_SECS)
+        for reader in pending:
+            reader.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    stdout, stderr = [
+        None if buffer is None else buffer.getvalue() for buffer in pipe_buffers
+    ]
+
+    for buffer in pipe_buffers:
+        if buffer is None:
+            continue
+        if buffer.truncated:
+            logging.debug(
+                f"Output of child process {p.pid} truncated from {buffer.n_bytes} to {buffer.max_size} bytes."
+            )
+        buffer.close()
+
+    return ProcessResult(
+        process=p,
+        exit_code=exit_code,
+        stdout=stdout,
+        stderr=stderr,
+        timed_out=timed_out,
+        usage=ResourceUsage.from_rusage(rusage, wall_time),
+    )
+
+
+async def _terminate(
+    p: subprocess.Popen,
+    exit_waiter: "asyncio.Future[Tuple[int, resource.struct_rusage]]",
+) -> Tuple[int, "resource.struct_rusage"]:
+    """
+    Ask `p` to terminate, escalate to SIGKILL after a grace period,
+    and return its wait status and resource usage.
+    """
+    _signal_process(p, signal.SIGTERM)
+
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(exit_waiter), KILL_GRACE_PERIOD_SECS
+        )
+    except asyncio.TimeoutError:
+        _signal_process(p, signal.SIGKILL)
+        return await exit_waiter
+
+
+async def run_subprocess_pool_async(
+    inputs: Iterable[__T],
     subprocess_creator: Callable[[__T], subprocess.Popen],
-    on_exit: Optional[Callable[[__T, Optional[int], subprocess.Popen], __R]] = None,
+    on_exit: Optional[Callable[[__T, ProcessResult], __R]] = None,
     max_jobs: int = MAX_SUBPROCESSES,
+    timeout: Optional[float] | Callable[[__T], Optional[float]] = None,
+    usage_log: Optional[Path] = None,
+    max_pipe_buffer_size: Optional[int] = None,
+    spill_pipes: bool = False,
+    collect_results: bool = True,
 ) -> dict[__T, __R]:
     """
-    Creates up to `max_jobs` subprocesses that run concurrently.
-    `iter` contains inputs that is used to start each subprocess.
-    `subprocess_creator` creates the subprocess and returns a `Popen`.
-    After each subprocess ends, `on_exit` will go collect user defined input and return.
-    The return valus is a dictionary of inputs and outputs.
-
-    User has to guarantee elements in `iter` is unique, or the output may be incorrect.
+    Coroutine version of `run_subprocess_pool`, for callers that already run an event loop.
     """
     ret: dict[__T, __R] = {}
-    processes: dict[int, Tuple[subprocess.Popen, __T]] = dict()
+    running: set[asyncio.Task[Tuple[__T, ProcessResult]]] = set()
+    input_iter = iter(inputs)
+    progress = tqdm(total=len(inputs) if isinstance(inputs, Sized) else None)
+    usage_log_file = None if usage_log is None else open(usage_log, "a")
 
-    def wait_next() -> None:
-        pid, status = os.wait()
-        p, i = processes.pop(pid)
+    async def run(input: __T) -> Tuple[__T, ProcessResult]:
+        p = subprocess_creator(input)
+        job_timeout = timeout(input) if callable(timeout) else timeout
+        return input, await _run_process(
+            p, job_timeout, max_pipe_buffer_size, spill_pipes
+        )
 
-        exit_code: Optional[int] = None
+    async def wait_next() -> None:
+        nonlocal running
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
 
-        if os.WIFEXITED(status):
-            exit_code = os.WEXITSTATUS(status)
-            logging.debug(f"Child process {pid} exited with code {exit_code}.")
-        else:
-            logging.debug(f"Child process {pid} exited abnormally.")
+        for task in done:
+            input, result = task.result()
+            progress.update()
+            if usage_log_file is not None:
+                _write_usage_log_entry(usage_log_file, input, result)
+            if on_exit is not None:
+                output = on_exit(input, result)
+                if collect_results:
+                    ret[input] = output
 
-        if on_exit is not None:
-            ret[i] = on_exit(i, exit_code, p)
+    try:
+        while True:
+            # only pull the next input once a slot is free
+            if len(running) < max_jobs:
+                input = next(input_iter, _NO_INPUT)
+                if input is not _NO_INPUT:
+                    running.add(asyncio.create_task(run(input)))  # type: ignore
+                    continue
 
-    for input in tqdm(iter):
-        p = subprocess_creator(input)
-        processes[p.pid] = (p, input)
+            if len(running) == 0:
+                break
+
+            # `on_exit` may add more inputs (see `WorkQueue`), so try again after each exit
+            await wait_next()
+    finally:
+        progress.close()
 
-        if len(processes) >= max_jobs:
-            wait_next()
+        # cancellation (e.g. Ctrl-C) or a failing `on_exit`: don't leave children behind
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
 
-    # wait for remaining processes to exit
-    while len(processes) > 0:
-        wait_next()
+        if usage_log_file is not None:
+            usage_log_file.close()
 
     return ret
+
+
+_NO_INPUT = object()
+
+
+def _write_usage_log_entry(
+    log_file: IO[str], input: object, result: ProcessResult
+) -> None:
+    p = result.process
+    log_file.write(
+        json.dumps(
+            {
+                "input": str(input),
+                "args": (
+                    p.args if isinstance(p.args, str) else [str(arg) for arg in p.args]
+                ),
+                "pid": p.pid,
+                "exit_code": result.exit_code,
+                "returncode": p.returncode,
+                "timed_out": result.timed_out,
+                **result.usage._asdict(),
+            }
+        )
+        + "\n"
+    )
+    log_file.flush()
+
+
+def run_subprocess_pool(
+    inputs: Iterable[__T],
+    subprocess_creator: Callable[[__T], subprocess.Popen],
+    on_exit: Optional[Callable[[__T, ProcessResult], __R]] = None,
+    max_jobs: int = MAX_SUBPROCESSES,
+    timeout: Optional[float] | Callable[[__T], Optional[float]] = None,
+    usage_log: Optional[Path] = None,
+    max_pipe_buffer_size: Optional[int] = None,
+    spill_pipes: bool = False,
+    collect_results: bool = True,
+) -> dict[__T, __R]:
+    """
+    Runs up to `max_jobs` subprocesses concurrently on an asyncio event loop.
+    `inputs` contains inputs that is used to start each subprocess,
+    it is consumed lazily: the next input is only taken once a slot is free.
+    It is polled again after every exit, so it may be a `WorkQueue` that grows while the pool is running.
+    `subprocess_creator` creates the subprocess and returns a `Popen`.
+    Pipes opened with `subprocess.PIPE` for stdout/stderr are drained concurrently,
+    and their content is handed to `on_exit`.
+    If `max_pipe_buffer_size` is set, only the first and last half of that many bytes of each pipe are kept;
+    with `spill_pipes`, output beyond it is moved to a temporary file in `/dev/shm` instead of being dropped.
+    `timeout` is the wall-clock limit in seconds for each subprocess (or a function giving it per input),
+    a subprocess exceeding it gets SIGTERM, then SIGKILL.
+    After each subprocess ends, `on_exit` is called in completion order to collect user defined output,
+    the `ProcessResult` it gets includes the resource usage (`os.wait4`) of the subprocess.
+    If `usage_log` is set, one JSON line with the exit status and resource usage is appended to it per subprocess.
+    The return value is a dictionary of inputs and outputs, unless `collect_results` is unset:
+    then outputs are dropped and an empty dictionary is returned, so memory does not grow with the number of inputs.
+
+    Only subprocesses started by the pool are reaped. If the pool is interrupted
+    (e.g. Ctrl-C) or `on_exit` raises, all running subprocesses are killed.
+
+    User has to guarantee elements in `inputs` is unique, or the output may be incorrect.
+    """
+    return asyncio.run(
+        run_subprocess_pool_async(
+            inputs=inputs,
+            subprocess_creator=subprocess_creator,
+            on_exit=on_exit,
+            max_jobs=max_jobs,
+            timeout=timeout,
+            usage_log=usage_log,
+            max_pipe_buffer_size=max_pipe_buffer_size,
+            spill_pipes=spill_pipes,
+            collect_results=collect_results,
+        )
+    )
+
+
+def run_concurrent_subprocesses(
+    iter: Iterable[__T],
+    subprocess_creator: Callable[[__T], subprocess.Popen],
+    on_exit: Optional[Callable[[__T, Optional[int], subprocess.Popen], __R]] = None,
+    max_jobs: int = MAX_SUBPROCESSES,
+) -> dict[__T, __R]:
+    """
+    Creates up to `max_jobs` subprocesses that run concurrently.
+    `iter` contains inputs that is used to start each subprocess.
+    `subprocess_creator` creates the subprocess and returns a `Popen`.
+    After each subprocess ends, `on_exit` will go collect user defined input and return.
+    The return valus is a dictionary of inputs and outputs.
+
+    Kept for compatibility, this is a thin wrapper around `run_subprocess_pool`.
+
+    User has to guarantee elements in `iter` is unique, or the output may be incorrect.
+    """
+    return run_subprocess_pool(
+        inputs=iter,
+        subprocess_creator=subprocess_creator,
+        on_exit=(
+            None
+            if on_exit is None
+            else lambda input, result: on_exit(input, result.exit_code, result.process)
+        ),
+        max_jobs=max_jobs,
+    )
@@ -0,0 +1,109 @@
+from pathlib import Path
+import sqlite3
+from typing import Literal, NamedTuple, Optional
+
+from lib.llc_command import get_command_key
+
+SeedFormat = Literal["bc", "ll"]
+
+ValidationOutcome = Literal["compiles", "fails", "timeout"]
+
+
+class ValidationResult(NamedTuple):
+    outcome: ValidationOutcome
+
+    time: float
+    """wall-clock seconds it took to compile the seed, or to give up on it"""
+
+    def is_valid(self, timeout_secs: Optional[float]) -> Optional[bool]:
+        """whether the seed is valid under `timeout_secs`, or `None` if it has to be validated again"""
+        match self.outcome:
+            case "fails":
+                return False
+            case "compiles":
+                return timeout_secs is None or self.time <= timeout_secs
+            case "timeout":
+                # we don't know if it compiles given more time than it had
+                if timeout_secs is None or timeout_secs > self.time:
+                    return None
+                return False
+
+
+class SeedValidationCache:
+    """
+    On-disk cache of whether a test compiles as a seed, so collecting seeds for a target again
+    only needs to assemble the tests instead of compiling them.
+    Results are keyed by (test content hash, seed format, llc command line (see `get_command_key`), LLVM commit).
+    """
+
+    COMMIT_INTERVAL = 256
+    """number of new results after which they are committed to disk"""
+
+    path: Path
+    llvm_commit: str
+
+    def __init__(self, path: Path, llvm_commit: str) -> None:
+        self.path = path
+        self.llvm_commit = llvm_commit
+        self.__n_uncommitted = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                content_hash TEXT NOT NULL,
+                seed_format TEXT NOT NULL,
+                command TEXT NOT NULL,
+                llvm_commit TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                time REAL NOT NULL,
+                PRIMARY KEY (content_hash, seed_format, command, llvm_commit)
+            )
+            """)
+
+    def get(
+        self, content_hash: str, seed_format: SeedFormat, command: list[str]
+    ) -> Optional[ValidationResult]:
+        row = self.__db.execute(
+            "SELECT outcome, time FROM results"
+            " WHERE content_hash = ? AND seed_format = ? AND command = ? AND llvm_commit = ?",
+            (content_hash, seed_format, get_command_key(command), self.llvm_commit),
+        ).fetchone()
+
+        return None if row is None else ValidationResult(*row)
+
+    def put(
+        self,
+        content_hash: str,
+        seed_format: SeedFormat,
+        command: list[str],
+        result: ValidationResult,
+    ) -> None:
+        self.__db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                content_hash,
+                seed_format,
+                get_command_key(command),
+                self.llvm_commit,
+                *result,
+            ),
+        )
+
+        self.__n_uncommitted += 1
+        if self.__n_uncommitted >= SeedValidationCache.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        self.__db.commit()
+        self.__n_uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.__db.close()
+
+    def __enter__(self) -> "SeedValidationCache":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
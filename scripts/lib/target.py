@@ -1,64 +1,85 @@
 from functools import reduce
 import re
-from typing import Callable, Iterable, Literal, Optional
+from typing import Callable, ClassVar, Iterable, Literal, Optional
 
 from lib.triple import Triple
 
 
 class Target:
+    """
+    Immutable and interned like `Triple`: constructing a target that exists already returns the existing object.
+    Its string form and hash are computed once.
+    """
+
+    __slots__ = ("triple", "cpu", "attrs", "_str", "_hash")
+
+    interned: ClassVar[
+        dict[tuple[Triple, Optional[str], frozenset[str]], "Target"]
+    ] = {}
+
     triple: Triple
     cpu: Optional[str]
-    attrs: set[str]
+    attrs: frozenset[str]
 
     @property
     def backend(self) -> str:
         return self.triple.backend
 
-    def __init__(
-        self,
+    def __new__(
+        cls,
         triple: Triple | str,
         cpu: Optional[str] = None,
         attrs: Iterable[str] | str | None = None,
-    ) -> None:
-        self.triple = triple if isinstance(triple, Triple) else Triple.parse(triple)
-        self.cpu = None if cpu is None or cpu == "" else cpu
-
+    ) -> "Target":
         if isinstance(attrs, str):
             attrs = attrs.split(",")
 
-        self.attrs = (
-            set(
-                (("+" + attr) if not attr.startswith(("+", "-")) else attr)
-                for attr in attrs
-            )
-            if attrs
-            else set()
+        key = (
+            triple if isinstance(triple, Triple) else Triple.parse(triple),
+            None if cpu is None or cpu == "" else cpu,
+            (
+                frozenset(
+                    (("+" + attr) if not attr.startswith(("+", "-")) else attr)
+                    for attr in attrs
+                    if attr != ""
+                )
+                if attrs
+                else frozenset()
+            ),
         )
 
-    def __repr__(self) -> str:
-        def get_parts() -> Iterable[str]:
-            yield str(self.triple)
+        if (target := cls.interned.get(key)) is not None:
+            return target
 
-            if self.cpu:
-                yield self.cpu
+        target = super().__new__(cls)
+        for name, value in zip(("triple", "cpu", "attrs"), key):
+            object.__setattr__(target, name, value)
 
-            for attr in sorted(self.attrs):
-                yield attr
+        triple, cpu, attrs = key
+        parts = [str(triple), *([cpu] if cpu else []), *sorted(attrs)]
+        object.__setattr__(target, "_str", ",".join(parts))
+        object.__setattr__(target, "_hash", hash(target._str))
 
-        return ",".join(get_parts())
+        cls.interned[key] = target
+        return target
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return Target, (self.triple, self.cpu, self.attrs)
+
+    def __repr__(self) -> str:
+        return self._str
 
     def __eq__(self, __o: object) -> bool:
         if not isinstance(__o, Target):
             return False
 
-        return (
-            self.triple == __o.triple
-            and self.cpu == __o.cpu
-            and self.attrs == __o.attrs
-        )
+        return self is __o or self._str == __o._str
 
     def __hash__(self) -> int:
-        return hash(str(self))
+        return self._hash
 
     @staticmethod
     def parse(s: str) -> "Target":
@@ -104,7 +125,7 @@ TargetProp = Literal["triple", "arch", "vendor", "os", "abi", "cpu", "attrs"]
 
 def get_target_prop_selector(
     prop: TargetProp,
-) -> Callable[[Target], Triple | str | set[str] | None]:
+) -> Callable[[Target], Triple | str | frozenset[str] | None]:
     match prop:
         case "triple":
             return lambda target: target.triple
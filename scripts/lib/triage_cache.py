@@ -0,0 +1,75 @@
+from pathlib import Path
+import sqlite3
+from typing import NamedTuple, Optional
+
+from lib.llc_command import get_command_key
+
+
+class CachedResult(NamedTuple):
+    return_code: int
+    stderr: str
+
+
+class TriageCache:
+    """
+    On-disk cache of the outcome of running an input, so re-classifying a growing
+    crash directory only needs to run the inputs that were not seen before.
+    Results are keyed by (input content hash, command line (see `get_command_key`), LLVM commit).
+    """
+
+    COMMIT_INTERVAL = 256
+    """number of new results after which they are committed to disk"""
+
+    path: Path
+    llvm_commit: str
+
+    def __init__(self, path: Path, llvm_commit: str) -> None:
+        self.path = path
+        self.llvm_commit = llvm_commit
+        self.__n_uncommitted = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__db = sqlite3.connect(path)
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                content_hash TEXT NOT NULL,
+                command TEXT NOT NULL,
+                llvm_commit TEXT NOT NULL,
+                return_code INTEGER NOT NULL,
+                stderr TEXT NOT NULL,
+                PRIMARY KEY (content_hash, command, llvm_commit)
+            )
+            """)
+
+    def get(self, content_hash: str, command: list[str]) -> Optional[CachedResult]:
+        row = self.__db.execute(
+            "SELECT return_code, stderr FROM results"
+            " WHERE content_hash = ? AND command = ? AND llvm_commit = ?",
+            (content_hash, get_command_key(command), self.llvm_commit),
+        ).fetchone()
+
+        return None if row is None else CachedResult(*row)
+
+    def put(self, content_hash: str, command: list[str], result: CachedResult) -> None:
+        self.__db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (content_hash, get_command_key(command), self.llvm_commit, *result),
+        )
+
+        self.__n_uncommitted += 1
+        if self.__n_uncommitted >= TriageCache.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        self.__db.commit()
+        self.__n_uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.__db.close()
+
+    def __enter__(self) -> "TriageCache":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
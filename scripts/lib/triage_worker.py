@@ -0,0 +1,223 @@
+import logging
+import os
+from pathlib import Path
+import queue
+import struct
+import subprocess
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, NamedTuple, Optional, TypeVar
+
+from tqdm import tqdm
+
+from lib.process_concurrency import MAX_SUBPROCESSES, ResourceLimits, ResourceUsage
+
+__T = TypeVar("__T")
+__R = TypeVar("__R")
+
+# wire format, see `llvm-isel-afl/triage-driver.cpp`
+_REQUEST_HEADER = struct.Struct("=IQ")
+_RESPONSE_HEADER = struct.Struct("=iBqdddQ")
+
+
+class WorkerResult(NamedTuple):
+    exit_code: Optional[int]
+    """exit code of the input's process, or `None` if it did not exit normally (e.g. crashed on a signal)"""
+
+    returncode: int
+    """exit code, or the negated signal number if killed by a signal (like `Popen.returncode`)"""
+
+    stderr: bytes
+
+    timed_out: bool
+
+    usage: ResourceUsage
+
+
+class TriageWorker:
+    """
+    A long-lived `isel-triage` process that runs inputs sent over a pipe.
+    The worker forks for every input, so a crashing input does not kill it.
+    """
+
+    args: list[str]
+    process: subprocess.Popen
+
+    limits: ResourceLimits
+    """rlimits set on the worker, inherited by the process of every input"""
+
+    def __init__(
+        self, args: list[str], limits: ResourceLimits = ResourceLimits()
+    ) -> None:
+        self.args = args
+        self.limits = limits
+        self.__killed = False
+        self.__start()
+
+    def __start(self) -> None:
+        self.process = subprocess.Popen(
+            self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        # set from here instead of a `preexec_fn`, which is not safe in threads,
+        # before any input is sent, so the worker has not forked yet
+        self.limits.apply(self.process.pid)
+
+    def run(self, input: bytes, timeout_secs: Optional[float] = None) -> WorkerResult:
+        """
+        Run one input in the worker. If the worker itself died, it is restarted once, unless it was killed.
+        """
+        try:
+            return self.__run(input, timeout_secs)
+        except (BrokenPipeError, EOFError):
+            if self.__killed:
+                raise
+            logging.warning(f"Triage worker {self.process.pid} died, restarting.")
+            self.close()
+            self.__start()
+            return self.__run(input, timeout_secs)
+
+    def __run(self, input: bytes, timeout_secs: Optional[float]) -> WorkerResult:
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+
+        timeout_ms = 0 if timeout_secs is None else max(int(timeout_secs * 1000), 1)
+        stdin.write(_REQUEST_HEADER.pack(timeout_ms, len(input)))
+        stdin.write(input)
+        stdin.flush()
+
+        header = stdout.read(_RESPONSE_HEADER.size)
+        if len(header) != _RESPONSE_HEADER.size:
+            raise EOFError()
+
+        (
+            status,
+            timed_out,
+            max_rss_kb,
+            user_time,
+            system_time,
+            wall_time,
+            stderr_size,
+        ) = _RESPONSE_HEADER.unpack(header)
+
+        stderr = stdout.read(stderr_size)
+        if len(stderr) != stderr_size:
+            raise EOFError()
+
+        return WorkerResult(
+            exit_code=os.WEXITSTATUS(status) if os.WIFEXITED(status) else None,
+            returncode=os.waitstatus_to_exitcode(status),
+            stderr=stderr,
+            timed_out=bool(timed_out),
+            usage=ResourceUsage(
+                max_rss_kb=max_rss_kb,
+                user_time=user_time,
+                system_time=system_time,
+                wall_time=wall_time,
+            ),
+        )
+
+    def close(self) -> None:
+        """Close the worker's stdin, which makes it exit, and reap it."""
+        if self.process.stdin is not None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def kill(self) -> None:
+        """
+        Kill the worker and the input it runs, e.g. when the pool is interrupted.
+        It may be called from another thread than the one running an input, which then fails instead of restarting it.
+        """
+        self.__killed = True
+        self.process.kill()
+        self.process.wait()
+
+
+def run_triage_workers(
+    inputs: Iterable[__T],
+    worker_args: list[str],
+    get_input_path: Callable[[__T], Path | str],
+    on_exit: Optional[Callable[[__T, WorkerResult], __R]] = None,
+    n_workers: int = MAX_SUBPROCESSES,
+    timeout: Optional[float] = None,
+    limits: ResourceLimits = ResourceLimits(),
+    collect_results: bool = True,
+) -> dict[__T, __R]:
+    """
+    Runs every input on a pool of `n_workers` persistent `isel-triage` workers started with `worker_args`.
+    `get_input_path` gives the file to send to a worker for an input.
+    `timeout` is the wall-clock limit in seconds for each input.
+    The rlimits of `limits` are set on every worker and inherited by the process of each input.
+    After each input is done, `on_exit` is called in completion order to collect user defined output.
+    The return value is a dictionary of inputs and outputs, or empty if `collect_results` is unset.
+
+    User has to guarantee elements in `inputs` is unique, or the output may be incorrect.
+    """
+    ret: dict[__T, __R] = {}
+    idle_workers: queue.SimpleQueue[TriageWorker] = queue.SimpleQueue()
+    all_workers: list[TriageWorker] = []
+    # guards `all_workers` and `killed`, so no worker is started after they were killed
+    workers_lock = threading.Lock()
+    killed = False
+
+    def run(input: __T) -> WorkerResult:
+        try:
+            worker = idle_workers.get_nowait()
+        except queue.Empty:
+            with workers_lock:
+                if killed:
+                    raise RuntimeError("the triage workers were killed")
+                worker = TriageWorker(worker_args, limits)
+                all_workers.append(worker)
+
+        try:
+            with open(get_input_path(input), "rb") as file:
+                return worker.run(file.read(), timeout)
+        finally:
+            idle_workers.put(worker)
+
+    running: dict[Future[WorkerResult], __T] = {}
+
+    def wait_next() -> None:
+        done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            input = running.pop(future)
+            result = future.result()
+            if on_exit is not None:
+                output = on_exit(input, result)
+                if collect_results:
+                    ret[input] = output
+
+    # not a `with` block, whose exit waits for the running inputs, which may have no timeout
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    try:
+        for input in tqdm(inputs):
+            running[executor.submit(run, input)] = input
+
+            # only pull the next input once a worker is free
+            if len(running) >= n_workers:
+                wait_next()
+
+        while len(running) > 0:
+            wait_next()
+    except BaseException:
+        # interrupted (e.g. Ctrl-C) or a failing `on_exit`: stop the running inputs and drop the queued ones
+        with workers_lock:
+            killed = True
+        for worker in all_workers:
+            worker.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+    for worker in all_workers:
+        worker.close()
+
+    return ret
@@ -1,5 +1,9 @@
+import atexit
 from ctypes import CDLL, c_char_p, cdll
-from typing import ClassVar, Optional
+import json
+import logging
+import os
+from typing import ClassVar, Iterable, Optional
 from lib import LLVM
 
 from lib.arch import ARCH_TO_BACKEND_MAP, normalize_arch
@@ -7,9 +11,71 @@ from lib.arch import ARCH_TO_BACKEND_MAP, normalize_arch
 
 LIB_LLVM_TARGET_PATH = LLVM + "/build-release/lib/libLLVMTarget.so"
 
+TRIPLE_TABLE_ENV = "IRFUZZER_TRIPLE_TABLE"
+"""
+path of a JSON file persisting normalized triples, loaded on first use and updated at exit,
+so machines without `libLLVMTarget.so` normalize the triples seen before exactly like LLVM
+"""
+
+# components recognized by `normalize_without_llvm`, a subset of those known to `llvm::Triple`
+_VENDORS = set(
+    "unknown none apple pc scei sie fsl ibm img mti nvidia csr amd mesa suse oe intel ti".split()
+)
+_OS_PREFIXES = tuple(
+    """
+    linux darwin macos ios tvos watchos xros driverkit windows win32 freebsd netbsd openbsd dragonfly
+    solaris aix zos haiku fuchsia hurd rtems nacl cuda nvcl amdhsa amdpal mesa3d ps4 ps5 elfiamcu
+    wasi emscripten hermit uefi liteos serenity vulkan shadermodel lv2
+    """.split()
+)
+_ENV_PREFIXES = tuple(
+    """
+    gnu eabi musl android msvc itanium cygnus coreclr simulator macabi elf code16 opencl ohos
+    """.split()
+)
+
+
+def normalize_without_llvm(s: str) -> str:
+    """
+    Pure-Python approximation of `llvm::Triple::normalize` for machines without `libLLVMTarget.so`:
+    fills empty components and an omitted vendor or OS in front of a known OS or environment with "unknown".
+    """
+    parts = s.split("-")
+
+    if len(parts) >= 2 and parts[1] not in _VENDORS:
+        if parts[1].startswith(_OS_PREFIXES):
+            parts.insert(1, "unknown")  # e.g. x86_64-linux-gnu
+        elif parts[1].startswith(_ENV_PREFIXES):
+            parts[1:1] = ["unknown", "unknown"]  # e.g. x86_64-gnu
+
+    if len(parts) == 3 and parts[2].startswith(_ENV_PREFIXES):
+        parts.insert(2, "unknown")  # e.g. arm-none-eabi
+
+    if len(parts) > 4:
+        parts[3:] = ["-".join(parts[3:])]
+
+    return "-".join(part if part != "" else "unknown" for part in parts)
+
+
 class Triple:
+    """
+    Immutable and interned: constructing a triple that exists already returns the existing object.
+    Its string form and hash are computed once.
+    """
+
+    __slots__ = ("arch", "vendor", "os", "abi", "_str", "_hash")
+
+    interned: ClassVar[
+        dict[tuple[str, Optional[str], Optional[str], Optional[str]], "Triple"]
+    ] = {}
+
     llvm_lib: ClassVar[Optional[CDLL]] = None
 
+    llvm_lib_missing: ClassVar[bool] = False
+
+    normalized: ClassVar[Optional[dict[str, str]]] = None
+    """memoized normalizations, loaded from the table at `$IRFUZZER_TRIPLE_TABLE` if set"""
+
     arch: str
     vendor: Optional[str]
     os: Optional[str]
@@ -19,40 +85,52 @@ class Triple:
     def backend(self) -> str:
         return ARCH_TO_BACKEND_MAP[self.arch]
 
-    def __init__(
-        self,
+    def __new__(
+        cls,
         arch: str,
         vendor: Optional[str] = None,
         os: Optional[str] = None,
         abi: Optional[str] = None,
-    ) -> None:
+    ) -> "Triple":
         assert len(arch) > 0
-        self.arch = normalize_arch(arch)
-        self.vendor = self.normalize_component(vendor)
-        self.os = self.normalize_component(os)
-        self.abi = self.normalize_component(abi)
+        key = (
+            normalize_arch(arch),
+            cls.normalize_component(vendor),
+            cls.normalize_component(os),
+            cls.normalize_component(abi),
+        )
+
+        if (triple := cls.interned.get(key)) is not None:
+            return triple
+
+        triple = super().__new__(cls)
+        for name, value in zip(("arch", "vendor", "os", "abi"), key):
+            object.__setattr__(triple, name, value)
+
+        s = "-".join((component if component else "") for component in key)
+        object.__setattr__(triple, "_str", s.rstrip("-"))
+        object.__setattr__(triple, "_hash", hash(triple._str))
+
+        cls.interned[key] = triple
+        return triple
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return Triple, (self.arch, self.vendor, self.os, self.abi)
 
     def __eq__(self, __o: object) -> bool:
         if not isinstance(__o, Triple):
             return False
 
-        return (
-            self.arch == __o.arch
-            and self.vendor == __o.vendor
-            and self.os == __o.os
-            and self.abi == __o.abi
-        )
+        return self is __o or self._str == __o._str
 
     def __hash__(self) -> int:
-        return hash(str(self))
+        return self._hash
 
     def __repr__(self) -> str:
-        s = "-".join(
-            (component if component else "")
-            for component in [self.arch, self.vendor, self.os, self.abi]
-        )
-
-        return s.rstrip("-")
+        return self._str
 
     @classmethod
     def normalize_component(cls, s: Optional[str]) -> Optional[str]:
@@ -60,19 +138,90 @@ class Triple:
 
     @classmethod
     def normalize(cls, s: str) -> str:
+        """
+        `llvm::Triple::normalize`, memoized.
+        Falls back to `normalize_without_llvm` if `libLLVMTarget.so` can't be loaded.
+        """
+        normalized = cls.__get_normalized()
+
+        if (ret := normalized.get(s)) is None:
+            ret = normalized[s] = cls.__normalize_uncached(s)
+        return ret
+
+    @classmethod
+    def normalize_all(cls, strings: Iterable[str]) -> list[str]:
+        """normalize every string, calling into LLVM once per distinct one"""
+        strings = list(strings)
+        normalized = cls.__get_normalized()
+
+        for s in set(strings).difference(normalized.keys()):
+            normalized[s] = cls.__normalize_uncached(s)
+
+        return [normalized[s] for s in strings]
+
+    @classmethod
+    def __get_normalized(cls) -> dict[str, str]:
+        if cls.normalized is None:
+            cls.normalized = {}
+
+            if (table_path := os.getenv(TRIPLE_TABLE_ENV)) is not None:
+                if os.path.exists(table_path):
+                    with open(table_path) as file:
+                        cls.normalized.update(json.load(file))
+                atexit.register(cls.save_table, table_path)
+
+        return cls.normalized
+
+    @classmethod
+    def __normalize_uncached(cls, s: str) -> str:
+        if cls.llvm_lib is None and not cls.llvm_lib_missing:
+            try:
+                cls.llvm_lib = cdll.LoadLibrary(LIB_LLVM_TARGET_PATH)
+                cls.llvm_lib.LLVMNormalizeTargetTriple.restype = c_char_p
+            except OSError:
+                logging.warning(
+                    f"Cannot load {LIB_LLVM_TARGET_PATH}, triples are normalized without LLVM."
+                )
+                cls.llvm_lib_missing = True
+
         if cls.llvm_lib is None:
-            cls.llvm_lib = cdll.LoadLibrary(LIB_LLVM_TARGET_PATH)
-            cls.llvm_lib.LLVMNormalizeTargetTriple.restype = c_char_p
+            return normalize_without_llvm(s)
 
         c_arg = c_char_p(s.encode("ascii"))
         c_ret = cls.llvm_lib.LLVMNormalizeTargetTriple(c_arg)
         return c_ret.decode("ascii")
 
+    @classmethod
+    def save_table(cls, path: str) -> None:
+        """persist the normalizations done by LLVM so far, merged with those already in `path`"""
+        if cls.llvm_lib is None or cls.normalized is None:
+            # don't spread approximations
+            return
+
+        table: dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                table = json.load(file)
+        table.update(cls.normalized)
+
+        with open(path, "w") as file:
+            json.dump(table, file, indent=4, sort_keys=True)
+            file.write("\n")
+
     @classmethod
     def parse(cls, s: str) -> "Triple":
         assert len(s) > 0
 
-        parts = cls.normalize(s).split("-")
+        return cls.parse_normalized(cls.normalize(s))
+
+    @classmethod
+    def parse_all(cls, strings: Iterable[str]) -> list["Triple"]:
+        return [cls.parse_normalized(s) for s in cls.normalize_all(strings)]
+
+    @classmethod
+    def parse_normalized(cls, s: str) -> "Triple":
+        """parse a triple that is already normalized, e.g. `str()` of a `Triple`"""
+        parts = s.split("-")
         n = len(parts)
 
         assert n > 0 and n <= 4
@@ -1,34 +1,25 @@
-from typing import Generator, Tuple
+import os
+from pathlib import Path
 import pandas as pd
 import argparse
 
-from lib.experiment import Experiment, get_all_experiments
-
-
-def iterate_over_all_experiments(
-    dir: str,
-) -> Generator[Tuple[Experiment, int], None, None]:
-    for expr_info in get_all_experiments(dir):
-        with open(
-            expr_info.path.joinpath("unique_crashes"), "r"
-        ) as file:
-            yield (expr_info, int(file.readline()))
+from lib.crash_db import CRASH_DB_FILE_NAME, CrashDatabase
 
 
 def collect_crash_data(dir: str) -> pd.DataFrame:
-    return pd.DataFrame(
-        columns=["fuzzer", "isel", "target", "replicate", "n_unique_crashes"],
-        data=(
-            [
-                exp.fuzzer,
-                exp.isel,
-                str(exp.target),
-                exp.replicate_id,
-                n_unique_crashes,
-            ]
-            for (exp, n_unique_crashes) in iterate_over_all_experiments(dir)
-        ),
-    )
+    with CrashDatabase(Path(dir, CRASH_DB_FILE_NAME)) as crash_db:
+        return pd.DataFrame(
+            columns=[
+                "fuzzer",
+                "isel",
+                "target",
+                "replicate",
+                "n_unique_crashes",
+                "n_timeouts",
+                "n_ooms",
+            ],
+            data=(list(row) for row in crash_db.count_unique_crashes_per_experiment()),
+        )
 
 
 def main() -> None:
@@ -44,6 +35,10 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    # opening a missing database would create an empty one and report no crashes
+    if not os.path.exists(Path(args.input, CRASH_DB_FILE_NAME)):
+        parser.error(f"no {CRASH_DB_FILE_NAME} in {args.input}")
+
     df = collect_crash_data(args.input)
 
     df_summary = (
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent.parent
+
+# the scripts are run from $FUZZING_HOME with `scripts` on the path, do the same for the tests
+sys.path.insert(0, str(SCRIPTS_DIR))
+os.environ.setdefault("FUZZING_HOME", os.getcwd())
@@ -0,0 +1,45 @@
+from lib.cpu_topology import CoreAllocator, PhysicalCore
+
+# two NUMA nodes of two cores with two SMT siblings each
+TWO_NODE_CORES = [
+    PhysicalCore(0, 0, (0, 4)),
+    PhysicalCore(0, 0, (1, 5)),
+    PhysicalCore(1, 1, (2, 6)),
+    PhysicalCore(1, 1, (3, 7)),
+]
+
+
+def get_nodes(cpus: tuple[int, ...]) -> set[int]:
+    return {core.node for core in TWO_NODE_CORES for cpu in cpus if cpu in core.cpus}
+
+
+def test_allocate_keeps_job_on_one_node() -> None:
+    allocator = CoreAllocator(TWO_NODE_CORES)
+
+    first = allocator.allocate(2)
+    assert first is not None and len(get_nodes(first)) == 1
+    # a core of its own for each process, not two siblings
+    assert sorted(first) in ([0, 1], [2, 3])
+
+    second = allocator.allocate(2)
+    assert second is not None and len(get_nodes(second)) == 1
+    assert get_nodes(first) != get_nodes(second)
+
+
+def test_allocate_prefers_node_with_idle_cores() -> None:
+    allocator = CoreAllocator(TWO_NODE_CORES)
+    assert allocator.allocate(1) is not None
+
+    # the other node still has two idle cores, the first only one
+    cpus = allocator.allocate(2)
+    assert cpus is not None and len(get_nodes(cpus)) == 1
+    assert all(core.node == 1 for core in TWO_NODE_CORES if cpus[0] in core.cpus)
+
+
+def test_allocate_spreads_when_no_node_has_room() -> None:
+    allocator = CoreAllocator(TWO_NODE_CORES, whole_cores=True)
+
+    cpus = allocator.allocate(3)
+    assert cpus is not None and get_nodes(cpus) == {0, 1}
+    assert allocator.allocate(2) is None
+    assert allocator.allocate(1) is not None
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+from lib.crash_db import IGNORED_BUCKET, OOM_BUCKET, TIMEOUT_BUCKET, CrashDatabase
+
+
+def add_bucket(crash_db: CrashDatabase, name: str, type: str) -> int:
+    return crash_db.add_bucket(
+        name=name,
+        fingerprint=name,
+        type=type,
+        subtype=None,
+        report="",
+        stack_frames=[],
+    )
+
+
+def test_limit_buckets_are_not_crashes(tmp_path: Path) -> None:
+    with CrashDatabase(tmp_path.joinpath("crashes.sqlite3")) as crash_db:
+        experiment_id = crash_db.add_experiment(tmp_path.joinpath("out"))
+        crash = add_bucket(crash_db, "crash", "dag-instruction-selection")
+        timeout = add_bucket(crash_db, TIMEOUT_BUCKET, TIMEOUT_BUCKET)
+        oom = add_bucket(crash_db, OOM_BUCKET, OOM_BUCKET)
+
+        for path, bucket_id in [
+            ("a", None),
+            ("b", crash),
+            ("c", crash),
+            ("d", timeout),
+            ("e", timeout),
+            ("f", oom),
+        ]:
+            crash_db.add_input(experiment_id, path, 1, bucket_id)
+
+        summary = crash_db.get_experiment_summary(experiment_id)
+        assert (summary.n_inputs, summary.n_false_alarms) == (6, 1)
+        assert (summary.n_unique_crashes, summary.n_timeouts, summary.n_ooms) == (
+            1,
+            2,
+            1,
+        )
+
+        (experiment_count,) = crash_db.count_unique_crashes_per_experiment()
+        assert experiment_count.n_unique_crashes == 1
+        assert (experiment_count.n_timeouts, experiment_count.n_ooms) == (2, 1)
+
+        (target_count,) = crash_db.count_unique_crashes_per_target()
+        assert target_count.n_unique_crashes == 1
+        assert (target_count.n_timeouts, target_count.n_ooms) == (2, 1)
+
+        crash_db.export_tree()
+        assert tmp_path.joinpath("out", "unique_crashes").read_text() == "1"
+        assert tmp_path.joinpath("out", TIMEOUT_BUCKET).is_dir()
+
+
+def test_ignored_inputs_are_left_out(tmp_path: Path) -> None:
+    with CrashDatabase(tmp_path.joinpath("crashes.sqlite3")) as crash_db:
+        experiment_id = crash_db.add_experiment(tmp_path.joinpath("out"))
+        ignored = add_bucket(crash_db, IGNORED_BUCKET, IGNORED_BUCKET)
+        crash_db.add_input(experiment_id, "a", 0, None)
+        crash_db.add_input(experiment_id, "b", 1, ignored)
+
+        # recorded, so resuming skips it
+        assert crash_db.has_input(experiment_id, "b")
+
+        summary = crash_db.get_experiment_summary(experiment_id)
+        assert (summary.n_inputs, summary.n_false_alarms) == (1, 1)
+        assert summary.n_unique_crashes == 0
+        (experiment_count,) = crash_db.count_unique_crashes_per_experiment()
+        assert experiment_count.n_unique_crashes == 0
+        (target_count,) = crash_db.count_unique_crashes_per_target()
+        assert target_count.n_unique_crashes == 0
+        assert [
+            result.path
+            for result in crash_db.get_input_results(tmp_path.joinpath("out"))
+        ] == ["a"]
+
+        crash_db.export_tree()
+        assert tmp_path.joinpath("out", "false_positives.txt").read_text() == "a\n"
+        assert tmp_path.joinpath("out", "unique_crashes").read_text() == "0"
+        assert not tmp_path.joinpath("out", IGNORED_BUCKET).exists()
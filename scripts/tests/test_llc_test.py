@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+
+import lib.llc_test
+from lib.llc_test import LLCTestIndex
+
+TEST_CONTENT = """; RUN: llc -mtriple=x86_64 < %s | FileCheck %s
+define void @f() {
+  ret void
+}
+"""
+
+
+def test_index_filters_and_prunes_backends(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tests_dir = tmp_path.joinpath("CodeGen")
+    for backend in ["X86", "AArch64"]:
+        tests_dir.joinpath(backend).mkdir(parents=True)
+        tests_dir.joinpath(backend, "test.ll").write_text(TEST_CONTENT)
+    monkeypatch.setattr(lib.llc_test, "LLC_TESTS_DIR", tests_dir)
+
+    with LLCTestIndex(tmp_path.joinpath("index.sqlite3")) as index:
+        index.update()
+        assert [test.backend for test in index.get_tests(lambda b: b == "X86")] == [
+            "X86"
+        ]
+
+        tests_dir.joinpath("AArch64", "test.ll").unlink()
+        tests_dir.joinpath("AArch64").rmdir()
+        # only the remaining backend is updated, the removed one is forgotten anyway
+        index.update(lambda b: b == "X86")
+        assert [test.backend for test in index.get_tests()] == ["X86"]
@@ -0,0 +1,31 @@
+import subprocess
+
+from lib.process_concurrency import run_subprocess_pool
+
+
+def test_collect_results() -> None:
+    exit_codes: dict[int, int] = {}
+
+    def on_exit(input, result):
+        exit_codes[input] = result.exit_code
+        return result.exit_code
+
+    def create_subprocess(input):
+        return subprocess.Popen(["sh", "-c", f"exit {input}"])
+
+    assert run_subprocess_pool(range(4), create_subprocess, on_exit) == {
+        0: 0,
+        1: 1,
+        2: 2,
+        3: 3,
+    }
+
+    exit_codes.clear()
+    assert (
+        run_subprocess_pool(
+            range(4), create_subprocess, on_exit, collect_results=False
+        )
+        == {}
+    )
+    # `on_exit` still runs for every input
+    assert exit_codes == {0: 0, 1: 1, 2: 2, 3: 3}
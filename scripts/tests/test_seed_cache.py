@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from conftest import SCRIPTS_DIR
+
+# caches a validation result unless it is cached already, and prints whether it was
+LOOKUP_SCRIPT = """
+import sys
+from pathlib import Path
+from lib.llc_command import LLCCommand
+from lib.seed_cache import SeedValidationCache, ValidationResult
+from lib.target import Target
+
+command = list(
+    LLCCommand(Target("x86_64", None, "+avx,+avx2,+sse4.2,-bmi"), False).get_options("-")
+)
+with SeedValidationCache(Path(sys.argv[1]), llvm_commit="0") as cache:
+    hit = cache.get("hash", "bc", command) is not None
+    if not hit:
+        cache.put("hash", "bc", command, ValidationResult("compiles", 0.01))
+print("hit" if hit else "miss")
+"""
+
+
+def test_cache_hits_across_hash_seeds(tmp_path: Path) -> None:
+    cache_path = tmp_path.joinpath("seed_validation_cache.sqlite3")
+
+    outputs = [
+        subprocess.check_output(
+            [sys.executable, "-c", LOOKUP_SCRIPT, str(cache_path)],
+            env={**os.environ, "PYTHONHASHSEED": seed, "PYTHONPATH": str(SCRIPTS_DIR)},
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+        for seed in ("1", "2", "3")
+    ]
+
+    assert outputs == ["miss", "hit", "hit"]
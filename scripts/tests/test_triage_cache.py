@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from conftest import SCRIPTS_DIR
+
+# caches a result unless it is cached already, and prints whether it was
+LOOKUP_SCRIPT = """
+import sys
+from pathlib import Path
+from lib.llc_command import LLCCommand
+from lib.target import Target
+from lib.triage_cache import CachedResult, TriageCache
+
+command = list(
+    LLCCommand(Target("x86_64", "skylake", "+avx,+avx2,+sse4.2,-bmi"), False).get_options()
+)
+with TriageCache(Path(sys.argv[1]), llvm_commit="0") as cache:
+    hit = cache.get("hash", command) is not None
+    if not hit:
+        cache.put("hash", command, CachedResult(0, ""))
+print("hit" if hit else "miss")
+"""
+
+
+def test_cache_hits_across_hash_seeds(tmp_path: Path) -> None:
+    cache_path = tmp_path.joinpath("triage_cache.sqlite3")
+
+    outputs = [
+        subprocess.check_output(
+            [sys.executable, "-c", LOOKUP_SCRIPT, str(cache_path)],
+            env={**os.environ, "PYTHONHASHSEED": seed, "PYTHONPATH": str(SCRIPTS_DIR)},
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+        for seed in ("1", "2", "3")
+    ]
+
+    assert outputs == ["miss", "hit", "hit"]